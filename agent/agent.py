@@ -68,6 +68,7 @@ async def main():
             }
         },
         allowed_tools=[
+            "mcp__login-verifier__start_environment",
             "mcp__login-verifier__verify_login",
             "mcp__login-verifier__start_webapp",
             "mcp__login-verifier__start_keycloak",
@@ -75,6 +76,7 @@ async def main():
             "mcp__login-verifier__start_database",
             "mcp__login-verifier__verify_database",
             "mcp__login-verifier__create_and_verify_payment",
+            "mcp__login-verifier__load_test",
         ],
         can_use_tool=handle_tool_permission,
     )
@@ -87,9 +89,11 @@ async def main():
         f"{claude_md_content}\n"
         "---\n\n"
         "Follow the Operational Workflow in CLAUDE.md. "
-        "Prefer using the MCP tools (start_docker, start_keycloak, start_database, "
-        "verify_database, start_webapp, verify_login, create_and_verify_payment) "
-        "as they already handle health checks and startup internally. "
+        "Prefer using the MCP tools (start_environment, start_docker, start_keycloak, "
+        "start_database, verify_database, start_webapp, verify_login, "
+        "create_and_verify_payment) as they already handle health checks and startup "
+        "internally. start_environment brings up Docker, Keycloak, PostgreSQL and the "
+        "web app concurrently in one call. "
         "You may also use shell commands like curl or wget if needed for additional checks. "
         "Report the final status of each step."
     )
@@ -0,0 +1,385 @@
+"""Benchmark the webapp data layer and JSON API against a seeded scratch database.
+
+Creates (or reuses) a separate database, loads db/init.sql plus a
+deterministic synthetic data set, applies the migrations, then times the
+db.py ingest, search and update functions and the /api/* endpoints. Results
+are written as JSON so runs on different commits can be compared:
+
+    python db/benchmark.py --accounts 1000000 --payments 10000000 --output before.json
+    python db/benchmark.py --reuse --output after.json --compare before.json
+
+The ingest and update benchmarks write to the database, so --reuse runs see
+a slightly larger data set; re-seed when comparing closely.
+
+Only a local PostgreSQL is needed. The API is driven through Flask's test
+client with Keycloak bypassed, so the numbers cover routing, the data layer
+and JSON encoding but not authentication. The search cache is disabled so
+every search hits PostgreSQL; set SEARCH_CACHE_SIZE to benchmark with it.
+A benchmark regresses when its median grows by more than --threshold times
+the baseline; the exit status is 1 if anything regressed.
+"""
+import argparse
+import csv
+import datetime
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import psycopg2
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WEBAPP_DIR = os.path.join(ROOT_DIR, "webapp")
+INIT_SQL = os.path.join(ROOT_DIR, "db", "init.sql")
+sys.path.insert(0, WEBAPP_DIR)
+
+os.environ.setdefault("SEARCH_CACHE_SIZE", "0")
+
+import db  # noqa: E402  (webapp/db.py)
+import ingest  # noqa: E402  (webapp/ingest.py)
+import migrate  # noqa: E402  (db/migrate.py)
+
+# Median growth below this many milliseconds is treated as noise.
+MIN_TIME_REGRESSION_MS = 2.0
+SEED_CHUNK = 1_000_000
+CREATE_THREADS = 32
+
+SEED_ACCOUNTS_SQL = """
+    INSERT INTO accounts (name, account_type, status, created_at)
+    SELECT (ARRAY['Alice','Bob','Charlie','Dana','Eve','Frank','Grace','Heidi',
+                  'Ivan','Judy','Mallory','Oscar'])[1 + mod(i, 12)]
+           || ' ' || (ARRAY['Savings','Current','Business','Holdings','Trust'])[1 + mod(i / 12, 5)]
+           || ' ' || i,
+           (ARRAY['savings','current','business'])[1 + mod(i, 3)],
+           CASE WHEN mod(i, 10) = 0 THEN 'inactive' ELSE 'active' END,
+           now() - mod(i, 730) * interval '1 day'
+    FROM generate_series(%s, %s) AS i
+"""
+
+# The credit account is offset from the debit one by 1..accounts-1, so no
+# payment is a self-transfer, which updates would reject.
+SEED_PAYMENTS_SQL = """
+    INSERT INTO payments (amount, currency, debit_account, credit_account, created_at)
+    SELECT amount, currency, 1 + debit, 1 + mod(debit + 1 + floor(random() * (%(accounts)s - 1))::int, %(accounts)s),
+           created_at
+    FROM (
+        SELECT round((random() * 10000)::numeric, 2) AS amount,
+               (ARRAY['USD','USD','USD','EUR','GBP','JPY'])[1 + floor(random() * 6)::int] AS currency,
+               floor(random() * %(accounts)s)::int AS debit,
+               now() - random() * interval '730 days' AS created_at
+        FROM generate_series(%(start)s, %(stop)s)
+    ) p
+"""
+
+
+def _chunks(total):
+    for start in range(1, total + 1, SEED_CHUNK):
+        yield start, min(start + SEED_CHUNK - 1, total)
+
+
+def seed(dbname, accounts, payments, seed_value, run_migrations=True):
+    """Recreate ``dbname`` from db/init.sql plus synthetic rows, then migrate and analyze."""
+    admin = psycopg2.connect(**dict(db.DB_CONFIG, dbname="postgres"))
+    admin.autocommit = True
+    with admin.cursor() as cur:
+        cur.execute(f'DROP DATABASE IF EXISTS "{dbname}"')
+        cur.execute(f'CREATE DATABASE "{dbname}"')
+    admin.close()
+
+    conn = psycopg2.connect(**db.DB_CONFIG)
+    try:
+        with conn.cursor() as cur, open(INIT_SQL) as f:
+            cur.execute(f.read())
+            for start, stop in _chunks(accounts):
+                cur.execute(SEED_ACCOUNTS_SQL, (start, stop))
+                conn.commit()
+                print(f"[seed] accounts {stop}/{accounts}")
+            cur.execute("SELECT count(*) FROM accounts")
+            (account_count,) = cur.fetchone()
+            cur.execute("SELECT setseed(%s)", (seed_value,))
+            for start, stop in _chunks(payments):
+                cur.execute(SEED_PAYMENTS_SQL, {"accounts": account_count, "start": start, "stop": stop})
+                conn.commit()
+                print(f"[seed] payments {stop}/{payments}")
+        # Indexes are cheaper to build once the data is in.
+        if run_migrations:
+            migrate.apply_migrations(conn, log=print)
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute("VACUUM ANALYZE")
+    finally:
+        conn.close()
+
+
+def table_counts():
+    with db.get_conn() as conn, conn.cursor() as cur:
+        cur.execute("SELECT (SELECT count(*) FROM accounts), (SELECT count(*) FROM payments), "
+                    "(SELECT max(id) FROM accounts), (SELECT max(id) FROM payments), "
+                    "current_setting('server_version')")
+        return cur.fetchone()
+
+
+def active_account_ids():
+    """Ids of the active accounts; payments between any others are rejected."""
+    with db.get_conn() as conn, conn.cursor() as cur:
+        cur.execute("SELECT id FROM accounts WHERE status = 'active' ORDER BY id")
+        return [row[0] for row in cur.fetchall()]
+
+
+def measure(fn, repeat, warmup=2, rows=None):
+    """Call ``fn`` warmup + repeat times and summarize the timed calls in milliseconds."""
+    for _ in range(warmup):
+        fn()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - start) * 1000)
+    times.sort()
+    result = {
+        "runs": repeat,
+        "min_ms": round(times[0], 3),
+        "median_ms": round(statistics.median(times), 3),
+        "p95_ms": round(times[max(0, -(-95 * repeat // 100) - 1)], 3),
+        "mean_ms": round(statistics.fmean(times), 3),
+    }
+    if rows:
+        result["rows"] = rows
+        result["rows_per_sec"] = round(rows / (result["median_ms"] / 1000))
+    return result
+
+
+def _expect_inserted(fn, rows):
+    def run():
+        inserted, errors = fn(rows)
+        if inserted != len(rows):
+            raise RuntimeError(f"{fn.__name__} inserted {inserted} of {len(rows)}: {errors[:3]}")
+    return run
+
+
+def data_layer_benchmarks(args, max_account_id, max_payment_id, active_ids):
+    """Return [(name, fn, rows, warmup, repeat)] for the db.py functions.
+
+    Generated payments only use active_ids, so every one of them is accepted.
+    """
+    rng = random.Random(args.seed)
+    accounts = [
+        {"name": f"Bench Account {i}", "account_type": "savings", "status": "active"}
+        for i in range(args.batch)
+    ]
+    payments = [
+        {"amount": f"{rng.randint(1, 999999) / 100:.2f}", "currency": "USD",
+         "debit_account": str(debit), "credit_account": str(credit)}
+        for debit, credit in (rng.sample(active_ids, 2) for _ in range(args.batch))
+    ]
+
+    payments_csv = io.StringIO()
+    writer = csv.DictWriter(payments_csv, ["amount", "currency", "debit_account", "credit_account"])
+    writer.writeheader()
+    writer.writerows(payments)
+    payments_csv = payments_csv.getvalue().encode()
+
+    def insert_payments_parallel():
+        inserted, errors = db.insert_payments(ingest.split_csv(io.BytesIO(payments_csv), chunk_bytes=256 * 1024))
+        if inserted != len(payments):
+            raise RuntimeError(f"insert_payments:parallel inserted {inserted} of {len(payments)}: {errors[:3]}")
+
+    def create_payments_batch():
+        created, results = db.create_payments(payments[:db.CREATE_PAYMENTS_MAX_ROWS], "bench")
+        if created != min(len(payments), db.CREATE_PAYMENTS_MAX_ROWS):
+            raise RuntimeError(f"create_payments created {created}: {[r for r in results if r['status'] != 'created'][:3]}")
+
+    # One payment per call from CREATE_THREADS threads at once, as concurrent
+    # API clients would; payment_writer commits them in groups.
+    def create_payments_concurrent():
+        with ThreadPoolExecutor(CREATE_THREADS) as pool:
+            created = sum(c for c, _ in pool.map(lambda p: db.create_payments([p], "bench"), payments))
+        if created != len(payments):
+            raise RuntimeError(f"create_payments:concurrent created {created} of {len(payments)}")
+
+    def update_account():
+        account_id = rng.randint(1, max_account_id)
+        db.update_account(account_id, f"Bench Account {account_id}", "savings", "active")
+
+    def update_payment():
+        db.update_payment(rng.randint(1, max_payment_id), "100.00", "USD", *active_ids[:2])
+
+    def update_payments_batch():
+        ids = rng.sample(range(1, max_payment_id + 1), min(args.batch, max_payment_id))
+        updated, results = db.update_payments([{"id": i, "currency": "USD"} for i in ids])
+        if updated != len(ids):
+            raise RuntimeError(f"update_payments updated {updated} of {len(ids)}")
+
+    searches = [
+        ("search_accounts:all", lambda: db.search_accounts()),
+        ("search_accounts:name", lambda: db.search_accounts(name="ali")),
+        ("search_account_names", lambda: db.search_account_names("ali")),
+        ("search_account_names:typo", lambda: db.search_account_names("grace holdngs")),
+        ("search_accounts:type+status", lambda: db.search_accounts(account_type="business", status="active")),
+        ("search_accounts:deep_page", lambda: db.search_accounts(after=max_account_id // 2)),
+        ("search_payments:all", lambda: db.search_payments()),
+        ("search_payments:currency", lambda: db.search_payments(currency="GBP")),
+        ("search_payments:amount_range", lambda: db.search_payments(min_amount="100", max_amount="150")),
+        ("search_payments:currency+amount_range",
+         lambda: db.search_payments(currency="EUR", min_amount="100", max_amount="150")),
+        ("search_payments:last_week",
+         lambda: db.search_payments(created_from=datetime.date.today() - datetime.timedelta(days=7))),
+        ("search_payments:currency+month",
+         lambda: db.search_payments(currency="GBP", created_from=datetime.date.today().replace(day=1))),
+        ("search_payments:deep_page", lambda: db.search_payments(after=max_payment_id // 2)),
+        ("dashboard_stats", lambda: db.dashboard_stats()),
+        ("account_balances:page", lambda: db.account_balances(range(1, min(max_account_id, 100) + 1))),
+    ]
+    benchmarks = [
+        ("insert_accounts", _expect_inserted(db.insert_accounts, accounts), args.batch, 1, args.ingest_repeat),
+        ("insert_payments", _expect_inserted(db.insert_payments, payments), args.batch, 1, args.ingest_repeat),
+        ("insert_payments:parallel", insert_payments_parallel, args.batch, 1, args.ingest_repeat),
+        ("create_payments:batch", create_payments_batch, min(args.batch, db.CREATE_PAYMENTS_MAX_ROWS), 1,
+         args.ingest_repeat),
+        ("create_payments:concurrent", create_payments_concurrent, args.batch, 1, args.ingest_repeat),
+    ]
+    benchmarks += [(name, fn, None, 2, args.repeat) for name, fn in searches]
+    benchmarks += [
+        ("update_account", update_account, None, 2, args.repeat),
+        ("update_payment", update_payment, None, 2, args.repeat),
+        ("update_payments:batch", update_payments_batch, args.batch, 1, args.ingest_repeat),
+    ]
+    return benchmarks
+
+
+def api_benchmarks(args):
+    """Return [(name, fn, rows, warmup, repeat)] for the /api/* endpoints."""
+    import app as webapp  # webapp/app.py
+
+    class _NoAuth:
+        def validate(self, tokens):
+            return {"sub": "benchmark"}, tokens
+
+    webapp.keycloak_auth = _NoAuth()
+    client = webapp.app.test_client()
+    tokens = {"access_token": "", "refresh_token": "", "expires_at": time.time() + 86400, "refresh_expires_at": 0}
+    with client.session_transaction() as session:
+        session["username"] = "benchmark"
+        session["session_id"] = webapp.create_auth_session("benchmark", tokens)
+
+    def get(path):
+        def run():
+            response = client.get(path)
+            body = response.get_data()
+            if response.status_code != 200:
+                raise RuntimeError(f"GET {path} returned {response.status_code}: {body[:200]!r}")
+        return run
+
+    endpoints = [
+        "/api/accounts",
+        "/api/accounts?name=ali&limit=100",
+        "/api/accounts?q=ali&limit=20",
+        "/api/accounts?status=inactive&limit=1000",
+        "/api/payments",
+        "/api/payments?currency=GBP&limit=1000",
+        "/api/payments?min_amount=100&max_amount=150",
+        f"/api/payments?created_from={datetime.date.today() - datetime.timedelta(days=7)}",
+        "/api/dashboard/stats",
+        "/api/payments/export?format=ndjson&currency=GBP&min_amount=100&max_amount=110",
+        "/api/payments/export?format=csv&currency=GBP&min_amount=100&max_amount=110",
+    ]
+    return [(f"GET {path}", get(path), None, 2, args.repeat) for path in endpoints]
+
+
+def git_revision():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT_DIR, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=ROOT_DIR,
+                                    capture_output=True, text=True).stdout.strip())
+        return commit, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+
+def find_regressions(baseline, current, threshold):
+    """Return a list of human-readable regression messages."""
+    problems = []
+    for name, now in current.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        if (now["median_ms"] - before["median_ms"] > MIN_TIME_REGRESSION_MS
+                and now["median_ms"] > threshold * before["median_ms"]):
+            problems.append(f"{name}: median {before['median_ms']}ms -> {now['median_ms']}ms")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dbname", default="localdev_bench", help="scratch database (default localdev_bench)")
+    parser.add_argument("--accounts", type=int, default=100_000, help="synthetic accounts to seed")
+    parser.add_argument("--payments", type=int, default=1_000_000, help="synthetic payments to seed")
+    parser.add_argument("--seed", type=float, default=0.42, help="random seed for data and benchmark inputs")
+    parser.add_argument("--reuse", action="store_true", help="benchmark the existing database without re-seeding")
+    parser.add_argument("--no-migrations", action="store_true", help="seed with db/init.sql only")
+    parser.add_argument("--repeat", type=int, default=30, help="timed calls per search/update/API benchmark")
+    parser.add_argument("--ingest-repeat", type=int, default=5, help="timed calls per ingest benchmark")
+    parser.add_argument("--batch", type=int, default=10_000, help="rows per insert_* call")
+    parser.add_argument("--output", metavar="FILE", help="write the results as JSON to FILE")
+    parser.add_argument("--compare", metavar="FILE", help="compare against results written by --output")
+    parser.add_argument("--threshold", type=float, default=1.5, help="allowed median growth factor (default 1.5)")
+    args = parser.parse_args()
+
+    db.DB_CONFIG["dbname"] = args.dbname
+    if not args.reuse:
+        seed(args.dbname, args.accounts, args.payments, args.seed, run_migrations=not args.no_migrations)
+
+    accounts, payments, max_account_id, max_payment_id, server_version = table_counts()
+    print(f"[bench] {args.dbname}: {accounts} accounts, {payments} payments (PostgreSQL {server_version})")
+
+    results = {}
+    benchmarks = data_layer_benchmarks(args, max_account_id, max_payment_id, active_account_ids())
+    benchmarks += api_benchmarks(args)
+    for name, fn, rows, warmup, repeat in benchmarks:
+        results[name] = measure(fn, repeat, warmup=warmup, rows=rows)
+        r = results[name]
+        extra = f"  {r['rows_per_sec']} rows/s" if rows else ""
+        print(f"{name:60} median {r['median_ms']:>9.3f}ms  p95 {r['p95_ms']:>9.3f}ms{extra}")
+
+    commit, dirty = git_revision()
+    report = {
+        "meta": {
+            "commit": commit,
+            "dirty": dirty,
+            "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "postgres": server_version,
+            "dbname": args.dbname,
+            "accounts": accounts,
+            "payments": payments,
+            "batch": args.batch,
+            "search_cache_size": db.CACHE_CONFIG["maxsize"],
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        print(f"Saved {len(results)} result(s) to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        problems = find_regressions(baseline["results"], results, args.threshold)
+        for p in problems:
+            print(f"REGRESSION {p}")
+        if problems:
+            return 1
+        print(f"No regressions against {baseline['meta'].get('commit') or args.compare}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,153 @@
+"""Run EXPLAIN (ANALYZE, BUFFERS) for every account/payment search shape and flag plan regressions.
+
+The queries are built with the same filter helpers the webapp uses, so the
+plans are the ones production traffic gets. Save a baseline once, then
+compare later runs against it:
+
+    python db/explain_searches.py --save db/plan_baseline.json
+    python db/explain_searches.py --compare db/plan_baseline.json
+
+A shape regresses when it gains a sequential scan the baseline did not
+have, or when its shared-buffer count or execution time grows by more than
+--threshold times the baseline. The exit status is 1 if anything regressed.
+"""
+import argparse
+import datetime
+import json
+import os
+import sys
+
+import psycopg2
+
+WEBAPP_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "webapp")
+sys.path.insert(0, WEBAPP_DIR)
+
+import db  # noqa: E402  (webapp/db.py)
+
+# Execution-time growth below this many milliseconds is treated as noise.
+MIN_TIME_REGRESSION_MS = 5.0
+
+
+def search_shapes():
+    """Return [(label, sql, params)] for each search filter combination."""
+    accounts = [
+        ("accounts:all", {}),
+        ("accounts:name", {"name": "ali"}),
+        ("accounts:type", {"account_type": "savings"}),
+        ("accounts:status", {"status": "inactive"}),
+        ("accounts:type+status", {"account_type": "business", "status": "active"}),
+    ]
+    payments = [
+        ("payments:all", {}),
+        ("payments:currency", {"currency": "GBP"}),
+        ("payments:amount_range", {"min_amount": "100", "max_amount": "150"}),
+        ("payments:currency+amount_range", {"currency": "EUR", "min_amount": "100", "max_amount": "150"}),
+        ("payments:last_week", {"created_from": datetime.date.today() - datetime.timedelta(days=7)}),
+        ("payments:currency+month", {"currency": "GBP", "created_from": datetime.date.today().replace(day=1),
+                                     "created_to": datetime.date.today()}),
+    ]
+    shapes = []
+    for label, filters in accounts:
+        clauses, params = db._account_filters(**filters)
+        sql, params, _ = db._page_query("accounts", clauses, params, None, None)
+        shapes.append((label, sql, params))
+    for label, args in [("accounts:name_search", ("ali",)), ("accounts:name_search+status", ("grace holdngs", None, "active"))]:
+        sql, params = db._name_search_query(*args)
+        shapes.append((label, sql, params))
+    for label, filters in payments:
+        clauses, params = db._payment_filters(**filters)
+        sql, params, _ = db._page_query("payments", clauses, params, None, None)
+        shapes.append((label, sql, params))
+    return shapes
+
+
+def _walk(node):
+    yield node
+    for child in node.get("Plans", []):
+        yield from _walk(child)
+
+
+def summarize(plan):
+    """Reduce EXPLAIN (FORMAT JSON) output to the numbers we compare."""
+    root = plan[0]
+    nodes = list(_walk(root["Plan"]))
+    return {
+        "execution_ms": round(root["Execution Time"], 3),
+        "total_cost": root["Plan"]["Total Cost"],
+        "shared_buffers": root["Plan"].get("Shared Hit Blocks", 0) + root["Plan"].get("Shared Read Blocks", 0),
+        "seq_scans": sorted({n["Relation Name"] for n in nodes if n["Node Type"] == "Seq Scan"}),
+        "nodes": [n["Node Type"] + (f" on {n['Relation Name']}" if "Relation Name" in n else "") for n in nodes],
+    }
+
+
+def explain_all(conn):
+    results = {}
+    with conn.cursor() as cur:
+        # The name search shapes are planned at the threshold the webapp sets for them.
+        db._set_name_search_similarity(cur)
+        for label, sql, params in search_shapes():
+            cur.execute(sql, params)  # warm the cache so buffers/time are comparable between runs
+            cur.execute("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + sql, params)
+            results[label] = summarize(cur.fetchone()[0])
+    conn.rollback()
+    return results
+
+
+def find_regressions(baseline, current, threshold):
+    """Return a list of human-readable regression messages."""
+    problems = []
+    for label, now in current.items():
+        before = baseline.get(label)
+        if before is None:
+            continue
+        new_seq = sorted(set(now["seq_scans"]) - set(before["seq_scans"]))
+        if new_seq:
+            problems.append(f"{label}: new sequential scan on {', '.join(new_seq)}")
+        if before["shared_buffers"] and now["shared_buffers"] > threshold * before["shared_buffers"]:
+            problems.append(
+                f"{label}: shared buffers {before['shared_buffers']} -> {now['shared_buffers']}"
+            )
+        if (now["execution_ms"] - before["execution_ms"] > MIN_TIME_REGRESSION_MS
+                and now["execution_ms"] > threshold * before["execution_ms"]):
+            problems.append(
+                f"{label}: execution {before['execution_ms']}ms -> {now['execution_ms']}ms"
+            )
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--save", metavar="FILE", help="write the plan summaries to FILE")
+    parser.add_argument("--compare", metavar="FILE", help="compare against a baseline written by --save")
+    parser.add_argument("--threshold", type=float, default=2.0, help="allowed growth factor (default 2.0)")
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(**db.DB_CONFIG)
+    try:
+        results = explain_all(conn)
+    finally:
+        conn.close()
+
+    for label, summary in results.items():
+        print(f"{label:34} {summary['execution_ms']:>10.3f}ms  buffers={summary['shared_buffers']:<8} "
+              f"{' > '.join(summary['nodes'])}")
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print(f"Saved {len(results)} plan(s) to {args.save}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        problems = find_regressions(baseline, results, args.threshold)
+        for p in problems:
+            print(f"REGRESSION {p}")
+        if problems:
+            return 1
+        print("No plan regressions")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,119 @@
+"""Apply pending schema migrations on top of db/init.sql.
+
+Migrations live in db/migrations/ as NNN_description.sql and are applied in
+version order. Each one runs in its own transaction and is recorded in
+schema_migrations, so a failed migration leaves the schema at the previous
+version and re-running the tool is always safe.
+
+Usage:
+    python db/migrate.py             # apply everything pending
+    python db/migrate.py --status    # list applied and pending migrations
+"""
+import argparse
+import os
+import re
+import sys
+
+import psycopg2
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+MIGRATION_RE = re.compile(r"^(\d+)_(\w+)\.sql$")
+
+# Arbitrary key for pg_advisory_lock so concurrent runs apply migrations one at a time.
+MIGRATION_LOCK_ID = 4412001
+
+
+def discover_migrations():
+    """Return [(version, name, path)] for every migration file, sorted by version."""
+    migrations = []
+    for filename in os.listdir(MIGRATIONS_DIR):
+        m = MIGRATION_RE.match(filename)
+        if m:
+            migrations.append((int(m.group(1)), m.group(2), os.path.join(MIGRATIONS_DIR, filename)))
+    migrations.sort()
+    versions = [v for v, _, _ in migrations]
+    if len(versions) != len(set(versions)):
+        raise ValueError(f"duplicate migration versions in {MIGRATIONS_DIR}")
+    return migrations
+
+
+def applied_versions(conn):
+    with conn.cursor() as cur:
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version     INTEGER PRIMARY KEY,
+                name        TEXT NOT NULL,
+                applied_at  TIMESTAMP NOT NULL DEFAULT now()
+            )
+        """)
+        cur.execute("SELECT version FROM schema_migrations")
+        versions = {row[0] for row in cur.fetchall()}
+    conn.commit()
+    return versions
+
+
+def apply_migrations(conn, log=print):
+    """Apply every pending migration. Returns the list of applied migration names."""
+    applied = []
+    with conn.cursor() as cur:
+        cur.execute("SELECT pg_advisory_lock(%s)", (MIGRATION_LOCK_ID,))
+    try:
+        done = applied_versions(conn)
+        for version, name, path in discover_migrations():
+            if version in done:
+                continue
+            with open(path) as f:
+                sql = f.read()
+            log(f"[migrate] applying {version:03d}_{name}")
+            try:
+                with conn.cursor() as cur:
+                    cur.execute(sql)
+                    cur.execute(
+                        "INSERT INTO schema_migrations (version, name) VALUES (%s, %s)",
+                        (version, name),
+                    )
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            applied.append(f"{version:03d}_{name}")
+    finally:
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_ID,))
+        conn.commit()
+    return applied
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=5432)
+    parser.add_argument("--dbname", default="localdev")
+    parser.add_argument("--user", default="localdev")
+    parser.add_argument("--password", default="localdev")
+    parser.add_argument("--status", action="store_true", help="show applied/pending migrations and exit")
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(
+        host=args.host, port=args.port, dbname=args.dbname,
+        user=args.user, password=args.password, connect_timeout=5,
+    )
+    try:
+        if args.status:
+            done = applied_versions(conn)
+            for version, name, _ in discover_migrations():
+                state = "applied" if version in done else "pending"
+                print(f"{version:03d}_{name}: {state}")
+            return 0
+        applied = apply_migrations(conn)
+        print(f"Applied {len(applied)} migration(s)" + (f": {', '.join(applied)}" if applied else ""))
+        return 0
+    except Exception as e:
+        print(f"FAIL: {e}", file=sys.stderr)
+        return 1
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
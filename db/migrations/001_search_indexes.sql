@@ -0,0 +1,23 @@
+-- Indexes for the account and payment search filters and the payment FKs.
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+-- search_accounts: name ILIKE '%x%', account_type =, status =
+CREATE INDEX IF NOT EXISTS accounts_name_trgm_idx
+    ON accounts USING gin (name gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS accounts_type_status_idx
+    ON accounts (account_type, status);
+CREATE INDEX IF NOT EXISTS accounts_status_idx
+    ON accounts (status);
+
+-- search_payments: currency = plus amount range, or amount range alone
+CREATE INDEX IF NOT EXISTS payments_currency_amount_idx
+    ON payments (currency, amount);
+CREATE INDEX IF NOT EXISTS payments_amount_idx
+    ON payments (amount);
+
+-- Foreign keys: per-account lookups and FK checks on accounts changes
+CREATE INDEX IF NOT EXISTS payments_debit_account_idx
+    ON payments (debit_account);
+CREATE INDEX IF NOT EXISTS payments_credit_account_idx
+    ON payments (credit_account);
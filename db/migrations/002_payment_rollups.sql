@@ -0,0 +1,109 @@
+-- Rollup tables for the dashboard, kept current by statement-level triggers.
+--
+-- The triggers see every changed row through transition tables, so a bulk
+-- upload costs one grouped upsert per rollup table rather than one per row.
+-- Upserts run in key order so concurrent writers lock rollup rows in the
+-- same order and cannot deadlock each other.
+
+-- Keep writers out while the rollups are backfilled and the triggers go in.
+LOCK TABLE payments IN SHARE ROW EXCLUSIVE MODE;
+
+CREATE TABLE payment_daily_totals (
+    day             DATE NOT NULL,
+    currency        VARCHAR(3) NOT NULL,
+    payment_count   BIGINT NOT NULL,
+    total_amount    NUMERIC(20,2) NOT NULL,
+    PRIMARY KEY (day, currency)
+);
+
+CREATE TABLE payment_account_totals (
+    account_id      INTEGER NOT NULL,
+    currency        VARCHAR(3) NOT NULL,
+    debit_count     BIGINT NOT NULL,
+    debit_total     NUMERIC(20,2) NOT NULL,
+    credit_count    BIGINT NOT NULL,
+    credit_total    NUMERIC(20,2) NOT NULL,
+    PRIMARY KEY (account_id, currency)
+);
+
+-- Top accounts per currency for the dashboard.
+CREATE INDEX payment_account_totals_debit_idx
+    ON payment_account_totals (currency, debit_total DESC);
+CREATE INDEX payment_account_totals_credit_idx
+    ON payment_account_totals (currency, credit_total DESC);
+
+-- Add (direction = 1) or remove (direction = -1) a set of payments from the rollups.
+CREATE FUNCTION payments_rollup_apply(direction integer, changed payments[]) RETURNS void
+LANGUAGE sql AS $$
+    INSERT INTO payment_daily_totals AS t (day, currency, payment_count, total_amount)
+    SELECT created_at::date, currency, direction * count(*), direction * sum(amount)
+    FROM unnest(changed)
+    GROUP BY 1, 2
+    ORDER BY 1, 2
+    ON CONFLICT (day, currency) DO UPDATE SET
+        payment_count = t.payment_count + EXCLUDED.payment_count,
+        total_amount = t.total_amount + EXCLUDED.total_amount;
+
+    INSERT INTO payment_account_totals AS t
+        (account_id, currency, debit_count, debit_total, credit_count, credit_total)
+    SELECT account_id, currency,
+           direction * sum(debit_count), direction * sum(debit_total),
+           direction * sum(credit_count), direction * sum(credit_total)
+    FROM (
+        SELECT debit_account AS account_id, currency,
+               1 AS debit_count, amount AS debit_total, 0 AS credit_count, 0 AS credit_total
+        FROM unnest(changed)
+        UNION ALL
+        SELECT credit_account, currency, 0, 0, 1, amount
+        FROM unnest(changed)
+    ) sides
+    GROUP BY 1, 2
+    ORDER BY 1, 2
+    ON CONFLICT (account_id, currency) DO UPDATE SET
+        debit_count = t.debit_count + EXCLUDED.debit_count,
+        debit_total = t.debit_total + EXCLUDED.debit_total,
+        credit_count = t.credit_count + EXCLUDED.credit_count,
+        credit_total = t.credit_total + EXCLUDED.credit_total;
+$$;
+
+CREATE FUNCTION payments_rollup_trigger() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM payments_rollup_apply(-1, ARRAY(SELECT o::payments FROM old_rows o));
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM payments_rollup_apply(1, ARRAY(SELECT n::payments FROM new_rows n));
+    END IF;
+    RETURN NULL;
+END
+$$;
+
+CREATE TRIGGER payments_rollup_insert
+    AFTER INSERT ON payments REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION payments_rollup_trigger();
+CREATE TRIGGER payments_rollup_update
+    AFTER UPDATE ON payments REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION payments_rollup_trigger();
+CREATE TRIGGER payments_rollup_delete
+    AFTER DELETE ON payments REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION payments_rollup_trigger();
+
+-- Backfill from the existing payments.
+INSERT INTO payment_daily_totals (day, currency, payment_count, total_amount)
+SELECT created_at::date, currency, count(*), sum(amount)
+FROM payments
+GROUP BY 1, 2;
+
+INSERT INTO payment_account_totals
+    (account_id, currency, debit_count, debit_total, credit_count, credit_total)
+SELECT account_id, currency, sum(debit_count), sum(debit_total), sum(credit_count), sum(credit_total)
+FROM (
+    SELECT debit_account AS account_id, currency,
+           count(*) AS debit_count, sum(amount) AS debit_total, 0 AS credit_count, 0 AS credit_total
+    FROM payments GROUP BY 1, 2
+    UNION ALL
+    SELECT credit_account, currency, 0, 0, count(*), sum(amount)
+    FROM payments GROUP BY 1, 2
+) sides
+GROUP BY 1, 2;
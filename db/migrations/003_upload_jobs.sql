@@ -0,0 +1,40 @@
+-- Durable queue for CSV uploads processed by webapp/upload_worker.py.
+--
+-- The uploaded file is stored in upload_job_chunks so any worker can pick
+-- the job up. Workers claim queued jobs with FOR UPDATE SKIP LOCKED and
+-- commit progress with every batch of rows, so a job whose worker dies is
+-- resumed after its last committed batch.
+
+CREATE TABLE upload_jobs (
+    id              BIGSERIAL PRIMARY KEY,
+    kind            VARCHAR(20) NOT NULL CHECK (kind IN ('accounts', 'payments')),
+    status          VARCHAR(20) NOT NULL DEFAULT 'queued'
+                        CHECK (status IN ('queued', 'running', 'done', 'failed')),
+    filename        VARCHAR(255) NOT NULL,
+    submitted_by    VARCHAR(255) NOT NULL,
+    size_bytes      BIGINT NOT NULL DEFAULT 0,
+    rows_done       BIGINT NOT NULL DEFAULT 0,
+    rows_inserted   BIGINT NOT NULL DEFAULT 0,
+    rows_failed     BIGINT NOT NULL DEFAULT 0,
+    errors          JSONB NOT NULL DEFAULT '[]',
+    error           TEXT,
+    attempts        INTEGER NOT NULL DEFAULT 0,
+    worker          VARCHAR(255),
+    created_at      TIMESTAMP NOT NULL DEFAULT now(),
+    started_at      TIMESTAMP,
+    heartbeat_at    TIMESTAMP,
+    finished_at     TIMESTAMP
+);
+
+-- Claiming: the oldest queued job, or a running one whose worker went quiet.
+CREATE INDEX upload_jobs_pending_idx
+    ON upload_jobs (id) WHERE status IN ('queued', 'running');
+CREATE INDEX upload_jobs_submitted_by_idx
+    ON upload_jobs (submitted_by, id);
+
+CREATE TABLE upload_job_chunks (
+    job_id          BIGINT NOT NULL REFERENCES upload_jobs(id) ON DELETE CASCADE,
+    seq             INTEGER NOT NULL,
+    data            BYTEA NOT NULL,
+    PRIMARY KEY (job_id, seq)
+);
@@ -0,0 +1,62 @@
+-- Change feed for the in-memory account directory (AccountDirectory in
+-- webapp/cache.py), which lets payment writes reject unknown and inactive
+-- accounts without a query.
+--
+-- Every statement that adds or deletes accounts, or changes their status,
+-- sends one NOTIFY on account_directory, delivered when it commits:
+--   {"active": [ids], "inactive": [ids], "deleted": [ids]}
+-- A statement touching more than 500 accounts, or a TRUNCATE, sends
+-- {"reset": true} instead, which keeps the payload well under NOTIFY's
+-- 8000-byte limit; the directory then reloads from the table.
+
+CREATE FUNCTION accounts_directory_notify() RETURNS trigger
+LANGUAGE plpgsql AS $$
+DECLARE
+    ids integer[];
+    statuses text[];
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        SELECT array_agg(id), array_agg(status) INTO ids, statuses
+        FROM (SELECT id, status FROM new_rows LIMIT 501) c;
+    ELSIF TG_OP = 'UPDATE' THEN
+        -- Only rows whose id or status changed; renames are not news.
+        SELECT array_agg(id), array_agg(status) INTO ids, statuses FROM (
+            (SELECT id, status FROM new_rows EXCEPT SELECT id, status FROM old_rows)
+            UNION ALL
+            (SELECT id, NULL::varchar FROM old_rows EXCEPT SELECT id, NULL::varchar FROM new_rows)
+            LIMIT 501
+        ) c;
+    ELSIF TG_OP = 'DELETE' THEN
+        SELECT array_agg(id), array_agg(NULL::text) INTO ids, statuses
+        FROM (SELECT id FROM old_rows LIMIT 501) c;
+    ELSE
+        ids := array_fill(0, ARRAY[501]);
+    END IF;
+
+    IF ids IS NULL THEN
+        RETURN NULL;
+    END IF;
+    PERFORM pg_notify('account_directory', CASE
+        WHEN cardinality(ids) > 500 THEN '{"reset": true}'
+        ELSE json_build_object(
+            'active', ARRAY(SELECT i FROM unnest(ids, statuses) u (i, s) WHERE s = 'active'),
+            'inactive', ARRAY(SELECT i FROM unnest(ids, statuses) u (i, s) WHERE s <> 'active'),
+            'deleted', ARRAY(SELECT i FROM unnest(ids, statuses) u (i, s) WHERE s IS NULL)
+        )::text
+    END);
+    RETURN NULL;
+END
+$$;
+
+CREATE TRIGGER accounts_directory_insert
+    AFTER INSERT ON accounts REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION accounts_directory_notify();
+CREATE TRIGGER accounts_directory_update
+    AFTER UPDATE ON accounts REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION accounts_directory_notify();
+CREATE TRIGGER accounts_directory_delete
+    AFTER DELETE ON accounts REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION accounts_directory_notify();
+CREATE TRIGGER accounts_directory_truncate
+    AFTER TRUNCATE ON accounts
+    FOR EACH STATEMENT EXECUTE FUNCTION accounts_directory_notify();
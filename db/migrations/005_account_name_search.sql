@@ -0,0 +1,9 @@
+-- Ranked account name search (db.search_account_names).
+--
+-- Query words are matched against name words by prefix through this
+-- full-text index; misspelt queries fall back to pg_trgm word similarity
+-- through accounts_name_trgm_idx from 001_search_indexes. The expression
+-- must match the one in db._name_search_query() for the index to be used.
+
+CREATE INDEX IF NOT EXISTS accounts_name_tsv_idx
+    ON accounts USING gin (to_tsvector('simple', name));
@@ -0,0 +1,155 @@
+-- Partition payments by month of created_at.
+--
+-- Date-range searches then only scan the partitions their range covers.
+-- The table is rebuilt: the old heap is renamed, a partitioned payments
+-- takes its place with the same columns, sequence, indexes and foreign
+-- keys, and every row is copied across. The primary key becomes
+-- (id, created_at), because a partitioned table's unique keys must include
+-- the partition key; ids still come from payments_id_seq.
+--
+-- payments_create_partitions() creates the monthly partitions up to a few
+-- months ahead. The webapp calls it periodically (db.ensure_payment_partitions),
+-- and anything dated beyond the last partition lands in payments_default
+-- until its month is created.
+--
+-- The rollup functions from 002 take the table's row type, so they are
+-- recreated for the new table. The rollups themselves already count every
+-- copied row, so the triggers go in only after the copy.
+
+-- Keep readers and writers out until the new table is in place.
+LOCK TABLE payments IN ACCESS EXCLUSIVE MODE;
+
+DROP TRIGGER payments_rollup_insert ON payments;
+DROP TRIGGER payments_rollup_update ON payments;
+DROP TRIGGER payments_rollup_delete ON payments;
+DROP FUNCTION payments_rollup_trigger();
+DROP FUNCTION payments_rollup_apply(integer, payments[]);
+
+ALTER TABLE payments RENAME TO payments_unpartitioned;
+ALTER TABLE payments_unpartitioned DROP CONSTRAINT payments_pkey;
+DROP INDEX IF EXISTS payments_currency_amount_idx;
+DROP INDEX IF EXISTS payments_amount_idx;
+DROP INDEX IF EXISTS payments_debit_account_idx;
+DROP INDEX IF EXISTS payments_credit_account_idx;
+
+CREATE TABLE payments (
+    id              INTEGER NOT NULL DEFAULT nextval('payments_id_seq'),
+    amount          NUMERIC(15,2) NOT NULL,
+    currency        VARCHAR(3) NOT NULL DEFAULT 'USD',
+    debit_account   INTEGER NOT NULL REFERENCES accounts(id),
+    credit_account  INTEGER NOT NULL REFERENCES accounts(id),
+    created_at      TIMESTAMP NOT NULL DEFAULT now(),
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+
+ALTER SEQUENCE payments_id_seq OWNED BY payments.id;
+
+CREATE TABLE payments_default PARTITION OF payments DEFAULT;
+
+-- Create the monthly partitions from since's month to months_ahead months
+-- past the current one. Rows of a new month that already landed in
+-- payments_default are moved into its partition. Returns how many
+-- partitions were created; safe to run concurrently and repeatedly.
+CREATE FUNCTION payments_create_partitions(months_ahead integer DEFAULT 3, since date DEFAULT NULL)
+RETURNS integer
+LANGUAGE plpgsql AS $$
+DECLARE
+    month date := date_trunc('month', COALESCE(since, now()::date));
+    next_month date;
+    last_month date := date_trunc('month', now()) + make_interval(months => months_ahead);
+    part_name text;
+    created integer := 0;
+BEGIN
+    PERFORM pg_advisory_xact_lock(hashtext('payments_create_partitions'));
+    WHILE month <= last_month LOOP
+        next_month := month + interval '1 month';
+        part_name := 'payments_' || to_char(month, 'YYYY_MM');
+        IF to_regclass(part_name) IS NULL THEN
+            EXECUTE format('CREATE TABLE %I (LIKE payments INCLUDING DEFAULTS)', part_name);
+            EXECUTE format(
+                'WITH moved AS (DELETE FROM payments_default WHERE created_at >= %L AND created_at < %L RETURNING *) '
+                'INSERT INTO %I SELECT * FROM moved',
+                month, next_month, part_name
+            );
+            -- Attaching adds the parent's indexes and foreign keys to the partition.
+            EXECUTE format(
+                'ALTER TABLE payments ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                part_name, month, next_month
+            );
+            created := created + 1;
+        END IF;
+        month := next_month;
+    END LOOP;
+    RETURN created;
+END
+$$;
+
+SELECT payments_create_partitions(3, (SELECT min(created_at)::date FROM payments_unpartitioned));
+
+INSERT INTO payments SELECT * FROM payments_unpartitioned;
+DROP TABLE payments_unpartitioned;
+
+-- The indexes from 001, now one per partition.
+CREATE INDEX payments_currency_amount_idx ON payments (currency, amount);
+CREATE INDEX payments_amount_idx ON payments (amount);
+CREATE INDEX payments_debit_account_idx ON payments (debit_account);
+CREATE INDEX payments_credit_account_idx ON payments (credit_account);
+
+-- The rollup functions and triggers from 002, unchanged.
+CREATE FUNCTION payments_rollup_apply(direction integer, changed payments[]) RETURNS void
+LANGUAGE sql AS $$
+    INSERT INTO payment_daily_totals AS t (day, currency, payment_count, total_amount)
+    SELECT created_at::date, currency, direction * count(*), direction * sum(amount)
+    FROM unnest(changed)
+    GROUP BY 1, 2
+    ORDER BY 1, 2
+    ON CONFLICT (day, currency) DO UPDATE SET
+        payment_count = t.payment_count + EXCLUDED.payment_count,
+        total_amount = t.total_amount + EXCLUDED.total_amount;
+
+    INSERT INTO payment_account_totals AS t
+        (account_id, currency, debit_count, debit_total, credit_count, credit_total)
+    SELECT account_id, currency,
+           direction * sum(debit_count), direction * sum(debit_total),
+           direction * sum(credit_count), direction * sum(credit_total)
+    FROM (
+        SELECT debit_account AS account_id, currency,
+               1 AS debit_count, amount AS debit_total, 0 AS credit_count, 0 AS credit_total
+        FROM unnest(changed)
+        UNION ALL
+        SELECT credit_account, currency, 0, 0, 1, amount
+        FROM unnest(changed)
+    ) sides
+    GROUP BY 1, 2
+    ORDER BY 1, 2
+    ON CONFLICT (account_id, currency) DO UPDATE SET
+        debit_count = t.debit_count + EXCLUDED.debit_count,
+        debit_total = t.debit_total + EXCLUDED.debit_total,
+        credit_count = t.credit_count + EXCLUDED.credit_count,
+        credit_total = t.credit_total + EXCLUDED.credit_total;
+$$;
+
+CREATE FUNCTION payments_rollup_trigger() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM payments_rollup_apply(-1, ARRAY(SELECT o::payments FROM old_rows o));
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM payments_rollup_apply(1, ARRAY(SELECT n::payments FROM new_rows n));
+    END IF;
+    RETURN NULL;
+END
+$$;
+
+CREATE TRIGGER payments_rollup_insert
+    AFTER INSERT ON payments REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION payments_rollup_trigger();
+CREATE TRIGGER payments_rollup_update
+    AFTER UPDATE ON payments REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION payments_rollup_trigger();
+CREATE TRIGGER payments_rollup_delete
+    AFTER DELETE ON payments REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION payments_rollup_trigger();
+
+ANALYZE payments;
@@ -0,0 +1,18 @@
+-- Idempotency keys for payment creation (db.create_payments).
+--
+-- A request that names an idempotency key claims it here, in the same
+-- transaction that inserts its payment, and the primary key lets only one
+-- claim per (submitted_by, key) commit. A retry finds the key and gets the
+-- original payment back rather than posting it twice; a retry whose payment
+-- differs (by fingerprint) is rejected. The key cannot live on payments
+-- itself: the unique indexes of a partitioned table must include created_at.
+
+CREATE TABLE payment_requests (
+    submitted_by        VARCHAR(255) NOT NULL,
+    idempotency_key     VARCHAR(255) NOT NULL,
+    fingerprint         CHAR(64) NOT NULL,
+    payment_id          INTEGER NOT NULL,
+    payment_created_at  TIMESTAMP NOT NULL,
+    created_at          TIMESTAMP NOT NULL DEFAULT now(),
+    PRIMARY KEY (submitted_by, idempotency_key)
+);
@@ -0,0 +1,12 @@
+-- Account balances (db.account_balances).
+--
+-- payment_account_totals from 002_payment_rollups already holds each
+-- account's debit and credit volume per currency, kept current by the
+-- payments triggers in the same transaction as every insert, update and
+-- delete; an update removes the old row's amounts before adding the new
+-- ones. The balance is what the account was credited less what it was
+-- debited, so it is stored next to those totals rather than summed from
+-- payments, and reading one account's balances is a primary-key lookup.
+
+ALTER TABLE payment_account_totals
+    ADD COLUMN balance NUMERIC(21,2) GENERATED ALWAYS AS (credit_total - debit_total) STORED;
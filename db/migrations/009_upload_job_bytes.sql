@@ -0,0 +1,8 @@
+-- Resume position, in bytes, for payment jobs ingested in parallel
+-- (db.ingest_upload_chunks): the size of the CSV records after the header
+-- that have been committed. Such jobs resume by skipping these bytes rather
+-- than parsing their way past rows_done rows. A batch ingested row by row
+-- (db.ingest_upload_batch) sets it back to 0, and the job then resumes by
+-- rows_done.
+
+ALTER TABLE upload_jobs ADD COLUMN bytes_done BIGINT NOT NULL DEFAULT 0;
@@ -0,0 +1,77 @@
+-- Apply each payments statement to the rollups with one upsert per table.
+--
+-- The triggers from 002 (recreated in 006) ran an UPDATE as two upserts,
+-- first the old rows with direction -1 and then the new rows with +1,
+-- each in key order only within itself. Two concurrent updates could thus
+-- lock rollup rows in opposite orders and deadlock: one moving a payment's
+-- debit from account 5 to 2 locks 5 then 2, one moving another from 2 to 5
+-- locks 2 then 5. The old and new rows are now netted into a single grouped
+-- upsert per rollup table, in key order, so every writer locks the rows of
+-- payment_daily_totals and then those of payment_account_totals in the
+-- same order. Groups whose changes cancel out are left untouched.
+
+CREATE FUNCTION payments_rollup_change(old_rows payments[], new_rows payments[]) RETURNS void
+LANGUAGE sql AS $$
+    INSERT INTO payment_daily_totals AS t (day, currency, payment_count, total_amount)
+    SELECT created_at::date, currency, sum(direction), sum(direction * amount)
+    FROM (
+        SELECT -1 AS direction, o.* FROM unnest(old_rows) o
+        UNION ALL
+        SELECT 1, n.* FROM unnest(new_rows) n
+    ) changes
+    GROUP BY 1, 2
+    HAVING sum(direction) <> 0 OR sum(direction * amount) <> 0
+    ORDER BY 1, 2
+    ON CONFLICT (day, currency) DO UPDATE SET
+        payment_count = t.payment_count + EXCLUDED.payment_count,
+        total_amount = t.total_amount + EXCLUDED.total_amount;
+
+    INSERT INTO payment_account_totals AS t
+        (account_id, currency, debit_count, debit_total, credit_count, credit_total)
+    SELECT account_id, currency,
+           sum(debit_count), sum(debit_total), sum(credit_count), sum(credit_total)
+    FROM (
+        SELECT debit_account AS account_id, currency,
+               direction AS debit_count, direction * amount AS debit_total,
+               0 AS credit_count, 0 AS credit_total
+        FROM (
+            SELECT -1 AS direction, o.* FROM unnest(old_rows) o
+            UNION ALL
+            SELECT 1, n.* FROM unnest(new_rows) n
+        ) changes
+        UNION ALL
+        SELECT credit_account, currency, 0, 0, direction, direction * amount
+        FROM (
+            SELECT -1 AS direction, o.* FROM unnest(old_rows) o
+            UNION ALL
+            SELECT 1, n.* FROM unnest(new_rows) n
+        ) changes
+    ) sides
+    GROUP BY 1, 2
+    HAVING sum(debit_count) <> 0 OR sum(debit_total) <> 0 OR sum(credit_count) <> 0 OR sum(credit_total) <> 0
+    ORDER BY 1, 2
+    ON CONFLICT (account_id, currency) DO UPDATE SET
+        debit_count = t.debit_count + EXCLUDED.debit_count,
+        debit_total = t.debit_total + EXCLUDED.debit_total,
+        credit_count = t.credit_count + EXCLUDED.credit_count,
+        credit_total = t.credit_total + EXCLUDED.credit_total;
+$$;
+
+-- The triggers themselves are unchanged and pick up the new body.
+CREATE OR REPLACE FUNCTION payments_rollup_trigger() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM payments_rollup_change('{}', ARRAY(SELECT n::payments FROM new_rows n));
+    ELSIF TG_OP = 'UPDATE' THEN
+        PERFORM payments_rollup_change(
+            ARRAY(SELECT o::payments FROM old_rows o), ARRAY(SELECT n::payments FROM new_rows n)
+        );
+    ELSE
+        PERFORM payments_rollup_change(ARRAY(SELECT o::payments FROM old_rows o), '{}');
+    END IF;
+    RETURN NULL;
+END
+$$;
+
+DROP FUNCTION payments_rollup_apply(integer, payments[]);
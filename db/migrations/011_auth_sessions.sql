@@ -0,0 +1,18 @@
+-- Server-side store for the Keycloak tokens of logged-in users (webapp/app.py).
+--
+-- Flask's session cookie is signed but not encrypted, so tokens kept in it
+-- can be read by anyone who sees the cookie, and a copied refresh token
+-- keeps minting access tokens until it expires. The cookie now carries only
+-- a random session id; the tokens live here under that id, shared by every
+-- gunicorn worker. A row is useless once its refresh token has expired
+-- (expires_at), and expired rows are deleted at each login.
+
+CREATE TABLE auth_sessions (
+    id              VARCHAR(64) PRIMARY KEY,
+    username        VARCHAR(255) NOT NULL,
+    tokens          JSONB NOT NULL,
+    expires_at      TIMESTAMP NOT NULL,
+    created_at      TIMESTAMP NOT NULL DEFAULT now()
+);
+
+CREATE INDEX auth_sessions_expires_at_idx ON auth_sessions (expires_at);
@@ -0,0 +1,182 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+
+from playwright.async_api import async_playwright
+
+
+class ContextLease:
+    """A browser context checked out of the pool.
+
+    ``reused`` is True when the context already carries a logged-in session
+    for the lease key (an idle context, or a new one seeded from the cached
+    storage state). Set ``keep = False`` if the session is not good, so the
+    context is discarded rather than handed to the next caller.
+    """
+
+    def __init__(self, context, key, reused):
+        self.context = context
+        self.key = key
+        self.reused = reused
+        self.keep = True
+
+
+class BrowserPool:
+    """One long-lived headless Chromium shared by every tool call.
+
+    Callers get an isolated browser context per call. Contexts are keyed (for
+    example per user), and when released they go back to an idle list for
+    that key with their storage state cached, so the next call for the same
+    key starts already logged in. Contexts idle longer than ``idle_ttl`` are
+    closed, and the browser itself is shut down once nothing has used it for
+    that long; it is relaunched on demand, including after a crash.
+    """
+
+    def __init__(self, max_contexts=4, idle_ttl=300.0, log=print):
+        self.max_contexts = max_contexts
+        self.idle_ttl = idle_ttl
+        self.log = log
+        self._slots = asyncio.Semaphore(max_contexts)
+        self._lock = asyncio.Lock()
+        self._playwright = None
+        self._browser = None
+        self._idle = {}    # key -> [(context, released_at)]
+        self._states = {}  # key -> (storage_state, saved_at)
+        self._leased = 0
+        self._last_used = time.monotonic()
+        self._reaper = None
+        self._stats = {"launches": 0, "contexts_created": 0, "contexts_reused": 0, "state_reused": 0}
+
+    async def _ensure_browser(self):
+        async with self._lock:
+            if self._browser is not None and self._browser.is_connected():
+                return self._browser
+            if self._browser is not None:
+                self.log("[browser_pool] Browser disconnected, relaunching")
+                self._idle.clear()
+            if self._playwright is None:
+                self._playwright = await async_playwright().start()
+            self._browser = await self._playwright.chromium.launch(headless=True)
+            self._stats["launches"] += 1
+            self.log("[browser_pool] Launched headless Chromium")
+            if self._reaper is None or self._reaper.done():
+                self._reaper = asyncio.ensure_future(self._reap_forever())
+            return self._browser
+
+    async def _checkout(self, key):
+        browser = await self._ensure_browser()
+        idle = self._idle.get(key) or []
+        while idle:
+            context, _ = idle.pop()
+            if context.browser is not None and context.browser.is_connected():
+                self._stats["contexts_reused"] += 1
+                return ContextLease(context, key, reused=key is not None)
+        cached = self._states.get(key) if key is not None else None
+        if cached is not None and time.monotonic() - cached[1] > self.idle_ttl:
+            self._states.pop(key, None)
+            cached = None
+        context = await browser.new_context(storage_state=cached[0] if cached else None)
+        self._stats["contexts_created"] += 1
+        if cached:
+            self._stats["state_reused"] += 1
+        return ContextLease(context, key, reused=cached is not None)
+
+    async def _checkin(self, lease):
+        context = lease.context
+        try:
+            if lease.keep and lease.key is not None:
+                self._states[lease.key] = (await context.storage_state(), time.monotonic())
+                for page in list(context.pages):
+                    await page.close()
+                self._idle.setdefault(lease.key, []).append((context, time.monotonic()))
+                return
+            if not lease.keep and lease.key is not None:
+                self.forget(lease.key)
+        except Exception:
+            pass
+        try:
+            await context.close()
+        except Exception:
+            pass
+
+    @asynccontextmanager
+    async def context(self, key=None):
+        """Check out a context for ``key`` (None for a throwaway anonymous one)."""
+        async with self._slots:
+            self._leased += 1
+            lease = None
+            try:
+                lease = await self._checkout(key)
+                yield lease
+            except BaseException:
+                if lease is not None:
+                    lease.keep = False
+                raise
+            finally:
+                if lease is not None:
+                    await self._checkin(lease)
+                self._leased -= 1
+                self._last_used = time.monotonic()
+
+    def forget(self, key):
+        """Drop the cached session for a key and close its idle contexts."""
+        self._states.pop(key, None)
+        for context, _ in self._idle.pop(key, []):
+            asyncio.ensure_future(context.close())
+
+    async def _reap_forever(self):
+        interval = max(1.0, min(self.idle_ttl / 2, 30.0))
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.reap()
+            except Exception as e:
+                self.log(f"[browser_pool] Cleanup error: {e}")
+
+    async def reap(self):
+        """Close contexts idle past the TTL, and the browser if nothing used it for that long."""
+        now = time.monotonic()
+        for key in list(self._idle):
+            keep = []
+            for context, released_at in self._idle[key]:
+                if now - released_at > self.idle_ttl:
+                    await context.close()
+                else:
+                    keep.append((context, released_at))
+            if keep:
+                self._idle[key] = keep
+            else:
+                del self._idle[key]
+        for key in [k for k, (_, saved_at) in self._states.items() if now - saved_at > self.idle_ttl]:
+            del self._states[key]
+        if self._leased == 0 and not self._idle and now - self._last_used > self.idle_ttl:
+            await self.close()
+
+    async def close(self):
+        async with self._lock:
+            for contexts in self._idle.values():
+                for context, _ in contexts:
+                    try:
+                        await context.close()
+                    except Exception:
+                        pass
+            self._idle.clear()
+            if self._browser is not None:
+                try:
+                    await self._browser.close()
+                except Exception:
+                    pass
+                self._browser = None
+                self.log("[browser_pool] Closed idle browser")
+            if self._playwright is not None:
+                await self._playwright.stop()
+                self._playwright = None
+
+    def stats(self):
+        return dict(
+            self._stats,
+            browser_running=self._browser is not None and self._browser.is_connected(),
+            leased=self._leased,
+            idle_contexts=sum(len(v) for v in self._idle.values()),
+            cached_sessions=len(self._states),
+        )
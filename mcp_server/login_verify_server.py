@@ -1,17 +1,26 @@
 import asyncio
+import functools
+import hashlib
+import http.cookiejar
 import json
+import math
 import os
 import platform
+import random
 import shutil
 import subprocess
 import sys
+import time
 import urllib.error
 import urllib.parse
 import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 
-from playwright.async_api import async_playwright
 from mcp.server.fastmcp import FastMCP
 
+from browser_pool import BrowserPool
+
 mcp = FastMCP("login-verifier")
 
 
@@ -21,15 +30,119 @@ def log(msg: str) -> None:
 
 PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
+# Serializes docker-compose invocations so concurrent starts don't race on
+# creating the project network; the slow part (waiting) happens outside it.
+_compose_lock = asyncio.Lock()
+
+# Bounded pool for the remaining blocking calls (urllib, psycopg2) so they
+# never stall the event loop and concurrent tools can't spawn unbounded threads.
+_io_executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get("MCP_IO_THREADS", "8")),
+    thread_name_prefix="mcp-io",
+)
+
+# One headless Chromium shared by the browser tools, with per-user contexts
+# kept warm between calls and closed after MCP_BROWSER_IDLE_TTL seconds idle.
+browser_pool = BrowserPool(
+    max_contexts=int(os.environ.get("MCP_BROWSER_CONTEXTS", "4")),
+    idle_ttl=float(os.environ.get("MCP_BROWSER_IDLE_TTL", "300")),
+    log=log,
+)
+
+
+async def _in_executor(fn, *args):
+    """Run a blocking call on the bounded I/O thread pool."""
+    return await asyncio.get_running_loop().run_in_executor(_io_executor, functools.partial(fn, *args))
+
+
+async def _run(cmd: list[str], timeout: float | None = None, cwd: str | None = None) -> subprocess.CompletedProcess:
+    """Run a command as an asyncio subprocess and capture its text output.
+
+    Raises subprocess.TimeoutExpired (after killing the process) if it runs
+    past the timeout, and FileNotFoundError if the executable is missing.
+    """
+    proc = await asyncio.create_subprocess_exec(
+        *cmd, cwd=cwd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+    )
+    try:
+        stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout)
+    except asyncio.TimeoutError:
+        proc.kill()
+        await proc.wait()
+        raise subprocess.TimeoutExpired(cmd, timeout)
+    return subprocess.CompletedProcess(
+        cmd, proc.returncode, stdout.decode(errors="replace"), stderr.decode(errors="replace"),
+    )
+
+
+def _timed(fn):
+    """Log the wall-clock latency of every call of an async tool to stderr."""
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        start = time.monotonic()
+        try:
+            return await fn(*args, **kwargs)
+        finally:
+            log(f"[latency] {fn.__name__} took {time.monotonic() - start:.2f}s")
+    return wrapper
+
+
+def _http_ok(url: str, timeout: float = 2) -> bool:
+    """Return True if the URL answers without an error status."""
+    try:
+        urllib.request.urlopen(url, timeout=timeout)
+        return True
+    except Exception:
+        return False
+
+
+async def _wait_until(check, timeout: float, tag: str) -> float | None:
+    """Await an async readiness check repeatedly until it returns True.
+
+    Backs off from 0.1s to 1s between attempts. Returns the seconds waited,
+    or None if the check did not pass within the timeout.
+    """
+    start = time.monotonic()
+    delay = 0.1
+    next_report = 10
+    while True:
+        if await check():
+            return time.monotonic() - start
+        elapsed = time.monotonic() - start
+        if elapsed >= timeout:
+            return None
+        if elapsed >= next_report:
+            log(f"[{tag}] Still waiting... ({int(elapsed)}s)")
+            next_report += 10
+        await asyncio.sleep(min(delay, timeout - elapsed))
+        delay = min(delay * 2, 1.0)
+
+
+async def _compose_up(*services: str) -> str | None:
+    """Run docker-compose up -d for the given services. Returns an error message, or None on success."""
+    compose_file = os.path.join(PROJECT_ROOT, "docker-compose.yml")
+    if not os.path.exists(compose_file):
+        return f"docker-compose.yml not found at {compose_file}"
+    async with _compose_lock:
+        result = await _run(["docker-compose", "up", "-d", *services], cwd=PROJECT_ROOT)
+    if result.returncode != 0:
+        return f"docker-compose up -d {' '.join(services)} failed: {result.stderr}"
+    return None
+
 
 @mcp.tool()
-async def start_webapp(port: int = 9777) -> str:
+@_timed
+async def start_webapp(port: int = 9777, mode: str = "production") -> str:
     """Start the Flask web application if it is not already running.
 
-    Spawns the webapp as a detached subprocess and waits until it is healthy.
+    Spawns the webapp and the upload workers as detached subprocesses and
+    waits until the webapp is healthy.
 
     Args:
         port: The port the web app listens on (default 9777).
+        mode: "production" serves it with gunicorn (multi-worker, threaded) using
+            webapp/gunicorn.conf.py; "debug" runs the Flask debug server.
+            Production falls back to debug if gunicorn is not installed in .venv.
 
     Returns:
         A message indicating whether the app was started or was already running.
@@ -37,43 +150,60 @@ async def start_webapp(port: int = 9777) -> str:
     url = f"http://localhost:{port}/"
 
     # Check if already running
-    try:
-        urllib.request.urlopen(url, timeout=3)
+    if await _in_executor(_http_ok, url, 3):
         log(f"[start_webapp] App is already running on port {port}")
         return f"App is already running on port {port}"
-    except Exception:
-        log(f"[start_webapp] Web app is NOT running on port {port}. Starting it now...")
+    log(f"[start_webapp] Web app is NOT running on port {port}. Starting it now...")
+
+    if mode not in ("production", "debug"):
+        return f"FAIL: Unknown mode '{mode}'. Use 'production' or 'debug'."
 
     # Resolve paths
     venv_python = os.path.join(PROJECT_ROOT, ".venv", "bin", "python3")
+    venv_gunicorn = os.path.join(PROJECT_ROOT, ".venv", "bin", "gunicorn")
     webapp_script = os.path.join(PROJECT_ROOT, "webapp", "app.py")
+    gunicorn_conf = os.path.join(PROJECT_ROOT, "webapp", "gunicorn.conf.py")
 
     if not os.path.exists(venv_python):
         return f"FAIL: Python not found at {venv_python}"
     if not os.path.exists(webapp_script):
         return f"FAIL: webapp/app.py not found at {webapp_script}"
 
+    if mode == "production" and not os.path.exists(venv_gunicorn):
+        log(f"[start_webapp] gunicorn not found at {venv_gunicorn}, falling back to the debug server")
+        mode = "debug"
+    if mode == "production":
+        cmd = [venv_gunicorn, "-c", gunicorn_conf, "--bind", f"0.0.0.0:{port}", "app:app"]
+    else:
+        cmd = [venv_python, webapp_script]
+
     # Spawn as a detached subprocess
-    log(f"[start_webapp] Spawning webapp process: {venv_python} {webapp_script}")
+    log(f"[start_webapp] Spawning webapp process ({mode}): {' '.join(cmd)}")
     subprocess.Popen(
-        [venv_python, webapp_script],
+        cmd,
         cwd=PROJECT_ROOT,
         stdout=subprocess.DEVNULL,
         stderr=subprocess.DEVNULL,
         start_new_session=True,
     )
 
-    # Poll until healthy (up to 15 seconds)
-    for _ in range(15):
-        await asyncio.sleep(1)
-        try:
-            urllib.request.urlopen(url, timeout=2)
-            log(f"[start_webapp] Web app is now healthy on port {port}")
-            return f"SUCCESS: Web app started and healthy on port {port}"
-        except Exception:
-            continue
+    # Background workers for queued uploads (webapp/upload_worker.py)
+    worker_script = os.path.join(PROJECT_ROOT, "webapp", "upload_worker.py")
+    log("[start_webapp] Spawning upload workers")
+    subprocess.Popen(
+        [venv_python, worker_script],
+        cwd=os.path.join(PROJECT_ROOT, "webapp"),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,
+    )
 
-    return f"FAIL: Started process but app not responding on port {port} after 15 seconds"
+    # Poll until healthy (up to 15 seconds)
+    waited = await _wait_until(lambda: _in_executor(_http_ok, url), 15, "start_webapp")
+    if waited is None:
+        return f"FAIL: Started process but app not responding on port {port} after 15 seconds"
+    log(f"[start_webapp] Web app is now healthy on port {port} ({waited:.1f}s)")
+    return f"SUCCESS: Web app started ({mode}) and healthy on port {port}"
 
 
 def _ensure_keycloak_user(
@@ -148,21 +278,21 @@ def _ensure_keycloak_user(
         return f"FAIL: Could not create user: {e}"
 
 
-def _disable_master_ssl(container_name: str = "agent-local-env-keycloak-1") -> str:
+async def _disable_master_ssl(container_name: str = "agent-local-env-keycloak-1") -> str:
     """Disable SSL requirement on master realm via kcadm.sh inside the container."""
     try:
         # Configure kcadm credentials
-        subprocess.run(
+        await _run(
             ["docker", "exec", container_name, "/opt/keycloak/bin/kcadm.sh",
              "config", "credentials", "--server", "http://localhost:8080",
              "--realm", "master", "--user", "admin", "--password", "admin"],
-            capture_output=True, text=True, timeout=10,
+            timeout=10,
         )
         # Set sslRequired=NONE on master
-        result = subprocess.run(
+        result = await _run(
             ["docker", "exec", container_name, "/opt/keycloak/bin/kcadm.sh",
              "update", "realms/master", "-s", "sslRequired=NONE"],
-            capture_output=True, text=True, timeout=10,
+            timeout=10,
         )
         if result.returncode == 0:
             log("[disable_master_ssl] Disabled SSL on master realm")
@@ -172,23 +302,20 @@ def _disable_master_ssl(container_name: str = "agent-local-env-keycloak-1") -> s
         return f"FAIL: {e}"
 
 
-def _is_docker_running() -> bool:
+async def _is_docker_running() -> bool:
     """Check if the Docker daemon is responsive."""
     docker_cmd = shutil.which("docker")
     if not docker_cmd:
         return False
     try:
-        result = subprocess.run(
-            [docker_cmd, "info"],
-            capture_output=True,
-            timeout=5,
-        )
+        result = await _run([docker_cmd, "info"], timeout=5)
         return result.returncode == 0
     except Exception:
         return False
 
 
 @mcp.tool()
+@_timed
 async def start_docker() -> str:
     """Start the Docker daemon if it is not already running.
 
@@ -199,7 +326,7 @@ async def start_docker() -> str:
     Returns:
         A message indicating whether Docker was started or was already running.
     """
-    if _is_docker_running():
+    if await _is_docker_running():
         log("[start_docker] Docker is already running")
         return "Docker is already running"
 
@@ -216,19 +343,11 @@ async def start_docker() -> str:
             stderr=subprocess.DEVNULL,
         )
     elif system == "Linux":
-        result = subprocess.run(
-            ["systemctl", "start", "docker"],
-            capture_output=True,
-            text=True,
-        )
+        result = await _run(["systemctl", "start", "docker"])
         if result.returncode != 0:
             # Try with sudo as fallback
             log("[start_docker] systemctl failed without sudo, retrying with sudo...")
-            result = subprocess.run(
-                ["sudo", "systemctl", "start", "docker"],
-                capture_output=True,
-                text=True,
-            )
+            result = await _run(["sudo", "systemctl", "start", "docker"])
             if result.returncode != 0:
                 return f"FAIL: Could not start Docker: {result.stderr}"
     else:
@@ -236,18 +355,15 @@ async def start_docker() -> str:
 
     # Poll until Docker daemon is responsive (up to 30 seconds)
     log("[start_docker] Waiting for Docker daemon to be ready...")
-    for i in range(30):
-        await asyncio.sleep(1)
-        if _is_docker_running():
-            log("[start_docker] Docker is now running")
-            return "SUCCESS: Docker started and ready"
-        if i % 10 == 9:
-            log(f"[start_docker] Still waiting... ({i + 1}s)")
-
-    return "FAIL: Started Docker but daemon not responding after 30 seconds"
+    waited = await _wait_until(_is_docker_running, 30, "start_docker")
+    if waited is None:
+        return "FAIL: Started Docker but daemon not responding after 30 seconds"
+    log(f"[start_docker] Docker is now running ({waited:.1f}s)")
+    return "SUCCESS: Docker started and ready"
 
 
 @mcp.tool()
+@_timed
 async def start_keycloak(port: int = 8080) -> str:
     """Start Keycloak via docker-compose if it is not already running.
 
@@ -262,93 +378,92 @@ async def start_keycloak(port: int = 8080) -> str:
     health_url = f"http://localhost:{port}/realms/master"
 
     # Check if already running
-    try:
-        urllib.request.urlopen(health_url, timeout=3)
+    if await _in_executor(_http_ok, health_url, 3):
         log(f"[start_keycloak] Keycloak is already running on port {port}")
-        _disable_master_ssl()
-        user_result = _ensure_keycloak_user(f"http://localhost:{port}/")
+        await _disable_master_ssl()
+        user_result = await _in_executor(_ensure_keycloak_user, f"http://localhost:{port}/")
         log(f"[start_keycloak] User provisioning: {user_result}")
         return f"Keycloak is already running on port {port}. {user_result}"
-    except Exception:
-        log(f"[start_keycloak] Keycloak is NOT running on port {port}. Starting it now...")
+    log(f"[start_keycloak] Keycloak is NOT running on port {port}. Starting it now...")
 
     # Ensure Docker daemon is running first
-    if not _is_docker_running():
+    if not await _is_docker_running():
         log("[start_keycloak] Docker is not running, starting it first...")
         docker_result = await start_docker()
         if docker_result.startswith("FAIL"):
             return f"FAIL: Cannot start Keycloak — {docker_result}"
 
     # Start via docker-compose
-    compose_file = os.path.join(PROJECT_ROOT, "docker-compose.yml")
-    if not os.path.exists(compose_file):
-        return f"FAIL: docker-compose.yml not found at {compose_file}"
-
-    log("[start_keycloak] Running docker-compose up -d")
-    result = subprocess.run(
-        ["docker-compose", "up", "-d"],
-        cwd=PROJECT_ROOT,
-        capture_output=True,
-        text=True,
-    )
-    if result.returncode != 0:
-        log(f"[start_keycloak] docker-compose failed: {result.stderr}")
-        return f"FAIL: docker-compose up -d failed: {result.stderr}"
+    log("[start_keycloak] Running docker-compose up -d keycloak")
+    error = await _compose_up("keycloak")
+    if error:
+        log(f"[start_keycloak] {error}")
+        return f"FAIL: {error}"
 
     # Poll until healthy (up to 60 seconds — Keycloak is slow to cold-start)
     log("[start_keycloak] Waiting for Keycloak to become healthy...")
-    for i in range(60):
-        await asyncio.sleep(1)
-        try:
-            urllib.request.urlopen(health_url, timeout=2)
-            log(f"[start_keycloak] Keycloak is now healthy on port {port}")
-            # Disable SSL on master realm so admin API works over HTTP
-            ssl_result = _disable_master_ssl()
-            log(f"[start_keycloak] Master SSL disable: {ssl_result}")
-            # Ensure the test user exists
-            user_result = _ensure_keycloak_user(f"http://localhost:{port}/")
-            log(f"[start_keycloak] User provisioning: {user_result}")
-            return f"SUCCESS: Keycloak started and healthy on port {port}. {user_result}"
-        except Exception:
-            if i % 10 == 9:
-                log(f"[start_keycloak] Still waiting... ({i + 1}s)")
-            continue
+    waited = await _wait_until(lambda: _in_executor(_http_ok, health_url), 60, "start_keycloak")
+    if waited is None:
+        return f"FAIL: Started Keycloak container but not responding on port {port} after 60 seconds"
+    log(f"[start_keycloak] Keycloak is now healthy on port {port} ({waited:.1f}s)")
+    # Disable SSL on master realm so admin API works over HTTP
+    ssl_result = await _disable_master_ssl()
+    log(f"[start_keycloak] Master SSL disable: {ssl_result}")
+    # Ensure the test user exists
+    user_result = await _in_executor(_ensure_keycloak_user, f"http://localhost:{port}/")
+    log(f"[start_keycloak] User provisioning: {user_result}")
+    return f"SUCCESS: Keycloak started and healthy on port {port}. {user_result}"
+
+
+def _connect_localdev(port: int, connect_timeout: int):
+    """Open a psycopg2 connection to the localdev database (blocking; run it via _in_executor)."""
+    import psycopg2
+    return psycopg2.connect(
+        host="localhost", port=port,
+        dbname="localdev", user="localdev", password="localdev",
+        connect_timeout=connect_timeout,
+    )
+
 
-    return f"FAIL: Started Keycloak container but not responding on port {port} after 60 seconds"
+def _query_localdev(port: int, *queries: str) -> list:
+    """Run each query on a fresh localdev connection and return their first rows (blocking)."""
+    conn = _connect_localdev(port, 5)
+    try:
+        cur = conn.cursor()
+        rows = []
+        for query in queries:
+            cur.execute(query)
+            rows.append(cur.fetchone())
+        cur.close()
+        return rows
+    finally:
+        conn.close()
 
 
-def _check_port_conflict(port: int) -> str | None:
+async def _check_port_conflict(port: int) -> str | None:
     """Check if a non-Docker PostgreSQL is occupying the port.
 
     Attempts to connect with the expected localdev role. If the port is open
     but the role doesn't exist, a local/system PostgreSQL is likely blocking
     the Docker container. Returns a diagnostic message or None if no conflict.
     """
-    import socket
     try:
-        s = socket.create_connection(("localhost", port), timeout=2)
-        s.close()
+        _, writer = await asyncio.wait_for(asyncio.open_connection("localhost", port), 2)
+        writer.close()
+        await writer.wait_closed()
     except Exception:
         return None  # port not open, no conflict
 
     # Port is open — verify it's the right postgres
     try:
-        import psycopg2
-        conn = psycopg2.connect(
-            host="localhost", port=port,
-            dbname="localdev", user="localdev", password="localdev",
-            connect_timeout=3,
-        )
+        conn = await _in_executor(_connect_localdev, port, 3)
         conn.close()
         return None  # connected fine, it's our Docker postgres
     except Exception as e:
         if "role" in str(e).lower() and "does not exist" in str(e).lower():
             # Identify the conflicting process
             try:
-                result = subprocess.run(
-                    ["lsof", "-i", f":{port}", "-sTCP:LISTEN", "-n", "-P"],
-                    capture_output=True, text=True, timeout=5,
-                )
+                result = await _run(["lsof", "-i", f":{port}", "-sTCP:LISTEN", "-n", "-P"], timeout=5)
                 processes = [
                     line for line in result.stdout.strip().split("\n")[1:]
                     if "docker" not in line.lower()
@@ -371,10 +486,26 @@ def _check_port_conflict(port: int) -> str | None:
         return None  # some other connection error, not a port conflict
 
 
+async def _apply_migrations(port: int) -> str:
+    """Run db/migrate.py against the local database and return its summary line."""
+    migrate_script = os.path.join(PROJECT_ROOT, "db", "migrate.py")
+    try:
+        result = await _run([sys.executable, migrate_script, "--port", str(port)], timeout=300, cwd=PROJECT_ROOT)
+    except Exception as e:
+        return f"FAIL: could not run migrations: {e}"
+    if result.returncode != 0:
+        return f"FAIL: migrations failed: {result.stderr.strip()}"
+    return result.stdout.strip().splitlines()[-1]
+
+
 @mcp.tool()
+@_timed
 async def start_database(port: int = 5432) -> str:
     """Start PostgreSQL via docker-compose if it is not already running.
 
+    Once the database accepts connections, pending schema migrations from
+    db/migrations/ are applied.
+
     Args:
         port: The port PostgreSQL listens on (default 5432).
 
@@ -382,62 +513,136 @@ async def start_database(port: int = 5432) -> str:
         A message indicating whether PostgreSQL was started or was already running.
     """
     # Check for port conflict with a local PostgreSQL
-    conflict = _check_port_conflict(port)
+    conflict = await _check_port_conflict(port)
     if conflict:
         log(f"[start_database] {conflict}")
         return f"FAIL: {conflict}"
 
-    # Check if already running by attempting a TCP connection
-    import socket
-    def _pg_ready():
+    # Ready means the server accepts an authenticated connection, not just an open port
+    async def _pg_ready():
         try:
-            s = socket.create_connection(("localhost", port), timeout=2)
-            s.close()
+            (await _in_executor(_connect_localdev, port, 2)).close()
             return True
         except Exception:
             return False
 
-    if _pg_ready():
+    if await _pg_ready():
         log(f"[start_database] PostgreSQL is already running on port {port}")
-        return f"PostgreSQL is already running on port {port}"
+        migrate_result = await _apply_migrations(port)
+        log(f"[start_database] Migrations: {migrate_result}")
+        return f"PostgreSQL is already running on port {port}. {migrate_result}"
 
     # Ensure Docker daemon is running first
-    if not _is_docker_running():
+    if not await _is_docker_running():
         log("[start_database] Docker is not running, starting it first...")
         docker_result = await start_docker()
         if docker_result.startswith("FAIL"):
             return f"FAIL: Cannot start PostgreSQL — {docker_result}"
 
     # Start via docker-compose
-    compose_file = os.path.join(PROJECT_ROOT, "docker-compose.yml")
-    if not os.path.exists(compose_file):
-        return f"FAIL: docker-compose.yml not found at {compose_file}"
-
     log("[start_database] Running docker-compose up -d postgres")
-    result = subprocess.run(
-        ["docker-compose", "up", "-d", "postgres"],
-        cwd=PROJECT_ROOT,
-        capture_output=True,
-        text=True,
-    )
-    if result.returncode != 0:
-        log(f"[start_database] docker-compose failed: {result.stderr}")
-        return f"FAIL: docker-compose up -d postgres failed: {result.stderr}"
+    error = await _compose_up("postgres")
+    if error:
+        log(f"[start_database] {error}")
+        return f"FAIL: {error}"
 
-    # Poll until healthy (up to 30 seconds)
+    # Poll until ready (up to 30 seconds)
     log("[start_database] Waiting for PostgreSQL to become ready...")
-    for i in range(30):
-        await asyncio.sleep(1)
-        if _pg_ready():
-            log(f"[start_database] PostgreSQL is now ready on port {port}")
-            return f"SUCCESS: PostgreSQL started and ready on port {port}"
-        if i % 10 == 9:
-            log(f"[start_database] Still waiting... ({i + 1}s)")
+    waited = await _wait_until(_pg_ready, 30, "start_database")
+    if waited is None:
+        return f"FAIL: Started PostgreSQL container but not responding on port {port} after 30 seconds"
+    log(f"[start_database] PostgreSQL is now ready on port {port} ({waited:.1f}s)")
+    migrate_result = await _apply_migrations(port)
+    log(f"[start_database] Migrations: {migrate_result}")
+    return f"SUCCESS: PostgreSQL started and ready on port {port}. {migrate_result}"
+
+
+# Each service lists the services that must be up before it starts. Keycloak
+# and PostgreSQL only need Docker, so they come up side by side; the web app
+# waits for the database so migrations are in place before it serves queries.
+SERVICE_DEPENDENCIES = {
+    "docker": [],
+    "keycloak": ["docker"],
+    "database": ["docker"],
+    "webapp": ["database"],
+}
+
+
+async def _run_service_graph(starters: dict) -> dict:
+    """Start services as soon as their dependencies are up.
+
+    ``starters`` maps a service name to a zero-argument coroutine function.
+    Returns {service: (result, started_at, duration)} with times relative to
+    the start of the run. A service whose dependency failed is skipped.
+    """
+    t0 = time.monotonic()
+    tasks = {}
+
+    async def run(name):
+        for dep in SERVICE_DEPENDENCIES[name]:
+            dep_result = (await tasks[dep])[0]
+            if dep_result.startswith(("FAIL", "SKIPPED")):
+                return f"SKIPPED: dependency '{dep}' did not start", time.monotonic() - t0, 0.0
+        started = time.monotonic()
+        log(f"[start_environment] Starting {name}")
+        try:
+            result = await starters[name]()
+        except Exception as e:
+            result = f"FAIL: {e}"
+        duration = time.monotonic() - started
+        log(f"[start_environment] {name} finished in {duration:.1f}s: {result}")
+        return result, started - t0, duration
+
+    for name in SERVICE_DEPENDENCIES:
+        tasks[name] = asyncio.ensure_future(run(name))
+    await asyncio.gather(*tasks.values())
+    return {name: task.result() for name, task in tasks.items()}
+
+
+@mcp.tool()
+@_timed
+async def start_environment(
+    keycloak_port: int = 8080,
+    db_port: int = 5432,
+    webapp_port: int = 9777,
+    webapp_mode: str = "production",
+) -> str:
+    """Bring up the whole local environment: Docker, Keycloak, PostgreSQL and the web app.
+
+    Services are started from a dependency graph, so independent ones (Keycloak
+    and PostgreSQL) start concurrently, and each waits on its own readiness
+    check rather than a fixed delay.
+
+    Args:
+        keycloak_port: The port Keycloak listens on (default 8080).
+        db_port: The port PostgreSQL listens on (default 5432).
+        webapp_port: The port the web app listens on (default 9777).
+        webapp_mode: "production" (gunicorn) or "debug" (Flask debug server).
 
-    return f"FAIL: Started PostgreSQL container but not responding on port {port} after 30 seconds"
+    Returns:
+        One line per service with its result, start offset and duration.
+    """
+    t0 = time.monotonic()
+    results = await _run_service_graph({
+        "docker": start_docker,
+        "keycloak": lambda: start_keycloak(keycloak_port),
+        "database": lambda: start_database(db_port),
+        "webapp": lambda: start_webapp(webapp_port, webapp_mode),
+    })
+    total = time.monotonic() - t0
+
+    failed = [name for name, (result, _, _) in results.items() if result.startswith(("FAIL", "SKIPPED"))]
+    lines = [
+        f"{'FAIL' if failed else 'SUCCESS'}: environment "
+        f"{'incomplete, failed: ' + ', '.join(failed) if failed else 'is up'} ({total:.1f}s total)"
+    ]
+    for name, (result, started_at, duration) in results.items():
+        lines.append(f"- {name}: started at +{started_at:.1f}s, took {duration:.1f}s — {result}")
+    return "\n".join(lines)
 
 
 @mcp.tool()
+@_timed
 async def verify_database(port: int = 5432) -> str:
     """Verify that PostgreSQL is running and the accounts/payments tables exist with data.
 
@@ -451,36 +656,71 @@ async def verify_database(port: int = 5432) -> str:
         A message with table row counts or an error.
     """
     # Check for port conflict first
-    conflict = _check_port_conflict(port)
+    conflict = await _check_port_conflict(port)
     if conflict:
         log(f"[verify_database] {conflict}")
         return f"FAIL: {conflict}"
 
     try:
-        import psycopg2
-        conn = psycopg2.connect(
-            host="localhost", port=port,
-            dbname="localdev", user="localdev", password="localdev",
-            connect_timeout=5,
+        (accounts_count,), (payments_count,) = await _in_executor(
+            _query_localdev, port,
+            "SELECT count(*) FROM accounts",
+            "SELECT count(*) FROM payments",
         )
-        cur = conn.cursor()
-        cur.execute("SELECT count(*) FROM accounts")
-        accounts_count = cur.fetchone()[0]
-        cur.execute("SELECT count(*) FROM payments")
-        payments_count = cur.fetchone()[0]
-        cur.close()
-        conn.close()
         return f"SUCCESS: Database is healthy. accounts={accounts_count} rows, payments={payments_count} rows."
     except Exception as e:
         return f"FAIL: Could not connect to PostgreSQL: {e}"
 
 
+def _session_key(url: str, username: str, password: str) -> str:
+    """Key for pooled browser sessions. Including a password digest means a
+    cached session only stands in for the exact credentials that created it."""
+    digest = hashlib.sha256(password.encode()).hexdigest()[:16]
+    return f"{urllib.parse.urljoin(url, '/')}|{username}|{digest}"
+
+
+async def _open_dashboard(lease, url: str, username: str, password: str):
+    """Return (page, error, used_cached_session) with the page on the dashboard.
+
+    A reused context first tries the dashboard directly; if its session has
+    expired, it falls back to filling in the login form like a real user.
+    """
+    page = await lease.context.new_page()
+    if lease.reused:
+        base_url = url.rsplit("/", 1)[0]
+        try:
+            await page.goto(f"{base_url}/dashboard", timeout=5000)
+            if "Welcome" in (await page.content()):
+                return page, None, True
+        except Exception:
+            pass
+
+    try:
+        await page.goto(url, timeout=5000)
+    except Exception as e:
+        lease.keep = False
+        return page, f"FAIL: Could not connect to {url}. Is the server running? ({e})", False
+
+    await page.fill('input[name="username"]', username)
+    await page.fill('input[name="password"]', password)
+    await page.click('button[type="submit"]')
+    await page.wait_for_load_state("networkidle")
+
+    if "Welcome" not in (await page.content()):
+        lease.keep = False
+        return page, f"FAIL: Login did not reach dashboard. Page URL: {page.url}", False
+    return page, None, False
+
+
 @mcp.tool()
+@_timed
 async def verify_login(url: str, username: str, password: str) -> str:
     """Verify that a web application login page is reachable and credentials work.
 
     Uses a headless browser (Playwright) to fill in the login form and submit it,
-    just like a real user would.
+    just like a real user would. The browser is shared between calls, and a
+    session from an earlier successful login with the same credentials is
+    reused when it is still valid, skipping the form.
 
     Args:
         url: The login page URL (e.g. http://localhost:9777/login.html)
@@ -491,37 +731,19 @@ async def verify_login(url: str, username: str, password: str) -> str:
         A message indicating whether the login succeeded or failed.
     """
     try:
-        async with async_playwright() as p:
-            browser = await p.chromium.launch(headless=True)
-            page = await browser.new_page()
-
-            # Step 1: Navigate to the login page
-            try:
-                await page.goto(url, timeout=5000)
-            except Exception as e:
-                await browser.close()
-                return f"FAIL: Could not connect to {url}. Is the server running? ({e})"
-
-            # Step 2: Fill in credentials and submit
-            await page.fill('input[name="username"]', username)
-            await page.fill('input[name="password"]', password)
-            await page.click('button[type="submit"]')
-
-            # Step 3: Wait for navigation and check for dashboard
-            await page.wait_for_load_state("networkidle")
-
-            if "Welcome" in (await page.content()):
-                await browser.close()
-                return f"SUCCESS: Login worked. Reached dashboard for user '{username}'."
-
-            current_url = page.url
-            await browser.close()
-            return f"FAIL: Login did not reach dashboard. Page URL: {current_url}"
+        async with browser_pool.context(_session_key(url, username, password)) as lease:
+            _, error, cached = await _open_dashboard(lease, url, username, password)
+            if error:
+                return error
+            if cached:
+                return f"SUCCESS: Login worked. Reached dashboard for user '{username}' (reused session)."
+            return f"SUCCESS: Login worked. Reached dashboard for user '{username}'."
     except Exception as e:
         return f"FAIL: Browser automation error: {e}"
 
 
 @mcp.tool()
+@_timed
 async def create_and_verify_payment(
     url: str,
     username: str,
@@ -529,7 +751,8 @@ async def create_and_verify_payment(
 ) -> str:
     """Create a payment through the webapp UI and verify it was persisted in the database.
 
-    Logs in via Playwright, navigates to the payments page, fills the create payment form
+    Logs in via Playwright (reusing a pooled session when one is still valid),
+    navigates to the payments page, fills the create payment form
     (amount=50.00, USD, debit_account=1, credit_account=2), submits it, checks for a
     success message, and then verifies the payment row exists in PostgreSQL.
 
@@ -542,25 +765,11 @@ async def create_and_verify_payment(
         A message indicating whether the payment was created and verified successfully.
     """
     try:
-        async with async_playwright() as p:
-            browser = await p.chromium.launch(headless=True)
-            page = await browser.new_page()
-
-            # Step 1: Log in
-            try:
-                await page.goto(url, timeout=5000)
-            except Exception as e:
-                await browser.close()
-                return f"FAIL: Could not connect to {url}. Is the server running? ({e})"
-
-            await page.fill('input[name="username"]', username)
-            await page.fill('input[name="password"]', password)
-            await page.click('button[type="submit"]')
-            await page.wait_for_load_state("networkidle")
-
-            if "Welcome" not in (await page.content()):
-                await browser.close()
-                return f"FAIL: Login did not reach dashboard. Page URL: {page.url}"
+        async with browser_pool.context(_session_key(url, username, password)) as lease:
+            # Step 1: Log in (or reuse the pooled session)
+            page, error, _ = await _open_dashboard(lease, url, username, password)
+            if error:
+                return error
 
             # Step 2: Navigate to payments page
             base_url = url.rsplit("/", 1)[0]  # strip /login.html
@@ -579,7 +788,6 @@ async def create_and_verify_payment(
 
             # Step 5: Check for success message
             content = await page.content()
-            await browser.close()
 
             if "Payment created successfully" not in content:
                 return f"FAIL: Success message not found on page after form submission."
@@ -589,21 +797,12 @@ async def create_and_verify_payment(
 
     # Step 6: Verify in database
     try:
-        import psycopg2
-        conn = psycopg2.connect(
-            host="localhost", port=5432,
-            dbname="localdev", user="localdev", password="localdev",
-            connect_timeout=5,
-        )
-        cur = conn.cursor()
-        cur.execute(
+        (row,) = await _in_executor(
+            _query_localdev, 5432,
             "SELECT id FROM payments WHERE amount = 50.00 AND currency = 'USD' "
             "AND debit_account = 1 AND credit_account = 2 "
-            "ORDER BY id DESC LIMIT 1"
+            "ORDER BY id DESC LIMIT 1",
         )
-        row = cur.fetchone()
-        cur.close()
-        conn.close()
         if row:
             return f"SUCCESS: Payment created via UI and verified in database (payment id={row[0]})."
         return "FAIL: Payment not found in database after form submission."
@@ -611,5 +810,182 @@ async def create_and_verify_payment(
         return f"FAIL: Database verification error: {e}"
 
 
+# ── Load testing ─────────────────────────────────────────────────────
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    """Return redirects as responses so a POST is timed on its own, not with the page it leads to."""
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+def _multipart_csv(field: str, filename: str, content: bytes) -> tuple[bytes, str]:
+    boundary = uuid.uuid4().hex
+    body = (
+        f"--{boundary}\r\n"
+        f'Content-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+        "Content-Type: text/csv\r\n\r\n"
+    ).encode() + content + f"\r\n--{boundary}--\r\n".encode()
+    return body, f"multipart/form-data; boundary={boundary}"
+
+
+def _virtual_user(base_url: str, username: str, password: str, iterations: int,
+                  marker: str, upload_rows: int) -> tuple[list, int]:
+    """One simulated user over a plain HTTP session (blocking).
+
+    Logs in, then per iteration runs both API searches, creates a payment
+    through the form and uploads a small payments CSV. Every payment uses the
+    run's marker amount so the rows can be found afterwards. Returns
+    ([(route, seconds, ok)], payments the app reported as created).
+    """
+    opener = urllib.request.build_opener(
+        urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), _NoRedirect(),
+    )
+    samples = []
+
+    def call(route, path, data=None, content_type=None, expect=200, check=None):
+        req = urllib.request.Request(base_url + path, data=data)
+        if content_type:
+            req.add_header("Content-Type", content_type)
+        start = time.perf_counter()
+        try:
+            try:
+                resp = opener.open(req, timeout=30)
+            except urllib.error.HTTPError as e:
+                resp = e
+            body = resp.read()
+            ok = resp.status == expect and (check is None or check(resp.headers, body))
+        except Exception:
+            body, ok = b"", False
+        samples.append((route, time.perf_counter() - start, ok))
+        return ok, body
+
+    form = urllib.parse.urlencode({"username": username, "password": password}).encode()
+    ok, _ = call("POST /login", "/login", form, "application/x-www-form-urlencoded", expect=302,
+                 check=lambda headers, body: headers.get("Location", "").endswith("/dashboard"))
+    if not ok:
+        return samples, 0
+
+    created = 0
+    payment = urllib.parse.urlencode(
+        {"amount": marker, "currency": "USD", "debit_account": "1", "credit_account": "2"}
+    ).encode()
+    csv_body = ("amount,currency,debit_account,credit_account\n"
+                + f"{marker},USD,1,2\n" * upload_rows).encode()
+    for _ in range(iterations):
+        call("GET /api/accounts", "/api/accounts?status=active&limit=50")
+        call("GET /api/payments", "/api/payments?currency=USD&limit=50")
+        # A rejected payment also redirects, back to /payments?error=...
+        ok, _ = call("POST /payments/create", "/payments/create", payment,
+                     "application/x-www-form-urlencoded", expect=302,
+                     check=lambda headers, body: "error=" not in headers.get("Location", ""))
+        created += 1 if ok else 0
+        data, content_type = _multipart_csv("file", "load_test.csv", csv_body)
+        ok, body = call("POST /upload/payments", "/upload/payments", data, content_type,
+                        check=lambda headers, body: f"Inserted {upload_rows} payment(s)".encode() in body)
+        created += upload_rows if ok else 0
+    return samples, created
+
+
+def _percentile(sorted_values: list, pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    return sorted_values[max(0, math.ceil(pct / 100 * len(sorted_values)) - 1)]
+
+
+@mcp.tool()
+@_timed
+async def load_test(
+    url: str,
+    username: str,
+    password: str,
+    users: int = 10,
+    iterations: int = 5,
+    upload_rows: int = 20,
+    db_port: int = 5432,
+) -> str:
+    """Drive concurrent virtual users against the webapp and report latency per route.
+
+    Each virtual user has its own HTTP session (no browser): it logs in, then
+    for each iteration searches accounts and payments through the JSON API,
+    creates a payment through the form and uploads a payments CSV. Reports
+    p50/p95/p99 latency, throughput and error rate per route, then checks
+    that every payment the app reported as created is in PostgreSQL.
+
+    Args:
+        url: The login page URL (e.g. http://localhost:9777/login.html)
+        username: The username every virtual user logs in with
+        password: The password to log in with
+        users: Number of concurrent virtual users (capped at 200)
+        iterations: Search/create/upload rounds per user
+        upload_rows: Payment rows in each uploaded CSV
+        db_port: PostgreSQL port used to verify the created rows
+
+    Returns:
+        A per-route latency table and the database verification result.
+    """
+    base_url = url.rsplit("/", 1)[0]  # strip /login.html
+    users = max(1, min(users, 200))
+    iterations = max(1, iterations)
+    upload_rows = max(1, upload_rows)
+    # A run-specific amount identifies this run's payments; ids above the
+    # current maximum rule out older rows that happen to share it.
+    marker = f"{random.randint(100000, 999999)}.{random.randint(0, 99):02d}"
+
+    try:
+        ((max_id,),) = await _in_executor(_query_localdev, db_port, "SELECT coalesce(max(id), 0) FROM payments")
+    except Exception as e:
+        return f"FAIL: Could not connect to PostgreSQL on port {db_port}: {e}"
+
+    log(f"[load_test] {users} user(s) x {iterations} iteration(s) against {base_url}")
+    loop = asyncio.get_running_loop()
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=users, thread_name_prefix="load-test") as executor:
+        results = await asyncio.gather(*(
+            loop.run_in_executor(
+                executor, _virtual_user, base_url, username, password, iterations, marker, upload_rows,
+            )
+            for _ in range(users)
+        ))
+    elapsed = time.monotonic() - start
+
+    by_route = {}
+    created = 0
+    for samples, user_created in results:
+        created += user_created
+        for route, seconds, ok in samples:
+            by_route.setdefault(route, []).append((seconds, ok))
+
+    lines = [
+        f"Load test: {users} user(s) x {iterations} iteration(s) against {base_url} in {elapsed:.2f}s",
+        f"{'route':24} {'count':>6} {'errors':>6} {'err%':>6} {'p50ms':>8} {'p95ms':>8} {'p99ms':>8} {'req/s':>8}",
+    ]
+    total = errors = 0
+    for route, samples in by_route.items():
+        latencies = sorted(seconds * 1000 for seconds, _ in samples)
+        failed = sum(1 for _, ok in samples if not ok)
+        total += len(samples)
+        errors += failed
+        lines.append(
+            f"{route:24} {len(samples):>6} {failed:>6} {100 * failed / len(samples):>5.1f}% "
+            f"{_percentile(latencies, 50):>8.1f} {_percentile(latencies, 95):>8.1f} "
+            f"{_percentile(latencies, 99):>8.1f} {len(samples) / elapsed:>8.1f}"
+        )
+    lines.append(f"{'all routes':24} {total:>6} {errors:>6} {100 * errors / max(total, 1):>5.1f}% "
+                 f"{'':>8} {'':>8} {'':>8} {total / elapsed:>8.1f}")
+
+    try:
+        ((found,),) = await _in_executor(
+            _query_localdev, db_port,
+            f"SELECT count(*) FROM payments WHERE id > {int(max_id)} AND amount = {marker}",
+        )
+    except Exception as e:
+        return "FAIL: Database verification error: " + str(e) + "\n" + "\n".join(lines)
+    lines.append(f"Database: {found} of {created} created payment(s) found (amount={marker})")
+
+    if errors or found != created:
+        return "FAIL: Load test finished with errors or missing rows.\n" + "\n".join(lines)
+    return "SUCCESS: Load test finished without errors.\n" + "\n".join(lines)
+
+
 if __name__ == "__main__":
     mcp.run(transport="stdio")
@@ -1,16 +1,35 @@
 import csv
+import datetime
 import io
+import json
+import logging
 import os
+import time
+import uuid
+from decimal import Decimal
 from functools import wraps
 
-from flask import Flask, jsonify, render_template, request, redirect, session, url_for
+from flask import (
+    Flask, Response, abort, before_render_template, g, jsonify, render_template, request, redirect,
+    session, stream_with_context, template_rendered, url_for,
+)
 from keycloak import KeycloakOpenID
-from keycloak.exceptions import KeycloakAuthenticationError
+from keycloak.exceptions import KeycloakError
 
+from auth import KeycloakAuth
 from db import (
-    insert_accounts, search_accounts, update_account,
-    insert_payments, search_payments, update_payment,
+    insert_accounts, search_accounts, search_account_names, update_account,
+    insert_payments, search_payments, update_payment, iter_payments, create_payments,
+    update_accounts, update_payments,
+    search_cache_stats, pool_stats, dashboard_stats, account_payment_totals,
+    account_balance, account_balances,
+    account_directory_stats, payment_writer_stats,
+    DASHBOARD_DAYS, DASHBOARD_TOP_ACCOUNTS,
+    enqueue_upload, upload_job, recent_upload_jobs, UPLOAD_REQUIRED_COLUMNS, INGEST_WORKERS, ingest_pool_size,
+    create_auth_session, auth_session_tokens, save_auth_session_tokens, delete_auth_session,
 )
+from ingest import chunk_size, split_csv
+from metrics import REGISTRY, start_capture, stop_capture
 
 app = Flask(__name__)
 app.secret_key = "dev-secret-key-change-in-prod"
@@ -18,39 +37,224 @@ app.secret_key = "dev-secret-key-change-in-prod"
 KEYCLOAK_SERVER_URL = os.environ.get("KEYCLOAK_SERVER_URL", "http://localhost:8080/")
 KEYCLOAK_REALM = os.environ.get("KEYCLOAK_REALM", "local-dev")
 KEYCLOAK_CLIENT_ID = os.environ.get("KEYCLOAK_CLIENT_ID", "flask-app")
+KEYCLOAK_TIMEOUT = int(os.environ.get("KEYCLOAK_TIMEOUT", "10"))
 
 keycloak_openid = KeycloakOpenID(
     server_url=KEYCLOAK_SERVER_URL,
     client_id=KEYCLOAK_CLIENT_ID,
     realm_name=KEYCLOAK_REALM,
+    timeout=KEYCLOAK_TIMEOUT,
 )
+keycloak_auth = KeycloakAuth(keycloak_openid)
+auth_log = logging.getLogger("webapp.auth")
 
 
-def authenticate(username: str, password: str) -> bool:
-    """Validate credentials against Keycloak using the direct access grant (password grant)."""
-    try:
-        keycloak_openid.token(username, password)
-        return True
-    except KeycloakAuthenticationError:
-        return False
-    except Exception:
-        return False
+def authenticate(username: str, password: str) -> dict | None:
+    """Validate credentials against Keycloak using the direct access grant (password grant).
+
+    Returns the issued tokens to store server-side (db.create_auth_session), or None if the credentials are invalid.
+    """
+    return keycloak_auth.login(username, password)
 
 
 def require_login(f):
+    # The session cookie is signed but not encrypted, so it carries only the
+    # username and a session id; the tokens stay in auth_sessions.
     @wraps(f)
     def decorated(*args, **kwargs):
-        if not session.get("username"):
+        session_id = session.get("session_id")
+        if not session.get("username") or not session_id:
             return redirect(url_for("login_page"))
+        tokens = auth_session_tokens(session_id, session["username"])
+        if not tokens:
+            session.clear()
+            return redirect(url_for("login_page"))
+        try:
+            claims, fresh = keycloak_auth.validate(tokens)
+        except KeycloakError as e:
+            # Keycloak is down, not the tokens invalid: keep the session for a retry.
+            auth_log.warning("keycloak unavailable while validating session: %s", e)
+            abort(503)
+        if claims is None:
+            delete_auth_session(session_id)
+            session.clear()
+            return redirect(url_for("login_page"))
+        if fresh is not tokens:
+            save_auth_session_tokens(session_id, fresh)
         return f(*args, **kwargs)
     return decorated
 
 
-def parse_csv(file_storage):
-    """Parse an uploaded CSV file into a list of dicts."""
-    stream = io.StringIO(file_storage.stream.read().decode("utf-8"))
-    reader = csv.DictReader(stream)
-    return list(reader)
+def parse_csv(file_storage, required=(), chunked=False):
+    """Lazily parse an uploaded CSV file into dicts.
+
+    The upload stream is decoded incrementally, so only the rows currently
+    being batched by the DB writer are held in memory. With chunked=True the
+    file is instead split into chunks of whole records (an ingest.CsvChunks)
+    for db.insert_payments() to validate in parallel, sized so every ingest
+    worker gets a share. Raises ValueError if the header lacks any of the
+    required columns.
+    """
+    if chunked:
+        reader = split_csv(file_storage.stream, chunk_bytes=chunk_size(upload_size(file_storage), ingest_pool_size()))
+    else:
+        stream = io.TextIOWrapper(file_storage.stream, encoding="utf-8", newline="")
+        reader = csv.DictReader(stream)
+    missing = [c for c in required if c not in (reader.fieldnames or [])]
+    if missing:
+        raise ValueError(f"CSV is missing required column(s): {', '.join(missing)}")
+    return reader
+
+
+def check_csv_header(file_storage, required=()):
+    """parse_csv()'s header check without consuming the upload; the stream is rewound afterwards."""
+    stream = io.TextIOWrapper(file_storage.stream, encoding="utf-8", newline="")
+    try:
+        header = next(csv.reader(stream), [])
+    finally:
+        stream.detach()
+        file_storage.stream.seek(0)
+    missing = [c for c in required if c not in header]
+    if missing:
+        raise ValueError(f"CSV is missing required column(s): {', '.join(missing)}")
+
+
+def upload_size(file_storage):
+    stream = file_storage.stream
+    stream.seek(0, io.SEEK_END)
+    size = stream.tell()
+    stream.seek(0)
+    return size
+
+
+EXPORT_CHUNK_ROWS = 1000
+PAYMENT_EXPORT_COLUMNS = ["id", "amount", "currency", "debit_account", "credit_account", "created_at"]
+
+
+def page_args():
+    """Read the keyset pagination parameters (after, limit) from the query string."""
+    return request.args.get("after", type=int), request.args.get("limit", type=int)
+
+
+def date_range_args():
+    """Read the created_from/created_to (YYYY-MM-DD, inclusive) filters; malformed dates are ignored."""
+    return (request.args.get("created_from", type=datetime.date.fromisoformat),
+            request.args.get("created_to", type=datetime.date.fromisoformat))
+
+
+def set_next_link(response, endpoint, next_after):
+    """Advertise the next page of a JSON listing via Link and X-Next-After headers."""
+    if next_after is not None:
+        args = request.args.to_dict()
+        args["after"] = next_after
+        response.headers["Link"] = f'<{url_for(endpoint, **args)}>; rel="next"'
+        response.headers["X-Next-After"] = str(next_after)
+    return response
+
+
+# ── Instrumentation ──────────────────────────────────────────────────
+
+# Log requests slower than this many milliseconds with the SQL they ran (0 = off).
+SLOW_REQUEST_MS = float(os.environ.get("SLOW_REQUEST_MS", "0"))
+slow_log = logging.getLogger("webapp.slow_requests")
+
+REQUEST_SECONDS = REGISTRY.histogram(
+    "webapp_request_seconds", "Request latency by route, method and status.", ("route", "method", "status"),
+)
+TEMPLATE_SECONDS = REGISTRY.histogram(
+    "webapp_template_render_seconds", "Jinja render time by template.", ("template",),
+)
+SERIALIZE_SECONDS = REGISTRY.histogram(
+    "webapp_serialize_seconds", "Time converting rows to the JSON response, by route.", ("route",),
+)
+
+
+@app.before_request
+def _start_request_timer():
+    g.request_start = time.perf_counter()
+    if SLOW_REQUEST_MS > 0:
+        g.query_capture = start_capture()
+
+
+@app.after_request
+def _time_request(response):
+    # Observed when the server closes the response, so streamed exports are timed end to end.
+    start = g.pop("request_start", time.perf_counter())
+    token = g.pop("query_capture", None)
+    route = request.url_rule.rule if request.url_rule else "<unmatched>"
+    method, status, path = request.method, response.status_code, request.full_path.rstrip("?")
+
+    def observe():
+        elapsed = time.perf_counter() - start
+        REQUEST_SECONDS.observe(elapsed, route, method, str(status))
+        if token is None:
+            return
+        queries = stop_capture(token)
+        if elapsed * 1000 >= SLOW_REQUEST_MS:
+            slow_log.warning(
+                "Slow request %s %s -> %s took %.1fms with %d query(ies)%s",
+                method, path, status, elapsed * 1000, len(queries),
+                "".join(f"\n  [{shape}] {seconds * 1000:.1f}ms {' '.join(sql.split())}"
+                        for shape, sql, seconds in queries),
+            )
+
+    response.call_on_close(observe)
+    return response
+
+
+@before_render_template.connect_via(app)
+def _start_template_timer(sender, template, context, **extra):
+    g.setdefault("template_starts", {})[template.name] = time.perf_counter()
+
+
+@template_rendered.connect_via(app)
+def _observe_template(sender, template, context, **extra):
+    start = g.get("template_starts", {}).pop(template.name, None)
+    if start is not None:
+        TEMPLATE_SECONDS.observe(time.perf_counter() - start, template.name)
+
+
+@REGISTRY.collector
+def _collect_process_stats():
+    pool = pool_stats()
+    if pool:
+        yield ("webapp_db_pool_connections", "gauge", "Pooled connections by state.",
+               [({"state": "in_use"}, pool["in_use"]), ({"state": "idle"}, pool["idle"])])
+        for key in ("connects", "checkouts", "waits", "timeouts", "health_check_failures", "recycled"):
+            yield (f"webapp_db_pool_{key}_total", "counter", f"Connection pool {key.replace('_', ' ')}.",
+                   [({}, pool[key])])
+        yield ("webapp_db_pool_wait_seconds_total", "counter", "Total time spent waiting for a free connection.",
+               [({}, pool["wait_time"])])
+
+    cache = search_cache_stats()
+    for key in ("hits", "misses", "evictions", "expirations", "invalidations"):
+        yield (f"webapp_search_cache_{key}_total", "counter", f"Search cache {key}.", [({}, cache[key])])
+    yield ("webapp_search_cache_entries", "gauge", "Search cache entries.", [({}, cache["size"])])
+
+    directory = account_directory_stats()
+    for key in ("hits", "misses", "loads", "resets"):
+        yield (f"webapp_account_directory_{key}_total", "counter", f"Account directory {key}.", [({}, directory[key])])
+    yield ("webapp_account_directory_bytes", "gauge", "Account directory bitmap size.", [({}, directory["bytes"])])
+
+    writer = payment_writer_stats()
+    for key in ("requests", "items", "groups", "retries"):
+        yield (f"webapp_payment_writer_{key}_total", "counter", f"Payment writer {key}.", [({}, writer[key])])
+    yield ("webapp_payment_writer_queued", "gauge", "Payment creation requests waiting for the writer.",
+           [({}, writer["queued"])])
+
+    ops = keycloak_auth.metrics.snapshot()
+    yield ("webapp_keycloak_requests_total", "counter", "Keycloak requests by operation.",
+           [({"op": op}, s["calls"]) for op, s in ops.items()])
+    yield ("webapp_keycloak_request_errors_total", "counter", "Failed Keycloak requests by operation.",
+           [({"op": op}, s["errors"]) for op, s in ops.items()])
+    yield ("webapp_keycloak_request_seconds_total", "counter", "Time spent in Keycloak requests by operation.",
+           [({"op": op}, s["total_seconds"]) for op, s in ops.items()])
+
+
+@app.route("/metrics")
+def metrics():
+    """Prometheus text exposition of this worker process's metrics."""
+    return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
 
 
 # ── Auth routes ──────────────────────────────────────────────────────
@@ -70,8 +274,13 @@ def login():
     username = request.form.get("username", "")
     password = request.form.get("password", "")
 
-    if authenticate(username, password):
+    tokens = authenticate(username, password)
+    if tokens:
+        if session.get("session_id"):
+            delete_auth_session(session["session_id"])
+        session.clear()
         session["username"] = username
+        session["session_id"] = create_auth_session(username, tokens)
         return redirect(url_for("dashboard"))
 
     return render_template("login.html", error="Invalid credentials")
@@ -80,47 +289,101 @@ def login():
 @app.route("/dashboard")
 @require_login
 def dashboard():
-    return render_template("dashboard.html", username=session["username"])
+    return render_template("dashboard.html", username=session["username"], stats=dashboard_stats())
 
 
 # ── Upload routes ────────────────────────────────────────────────────
 
+# Files larger than this are queued for webapp/upload_worker.py instead of
+# being ingested inside the request; 0 queues every upload.
+UPLOAD_ASYNC_BYTES = int(os.environ.get("UPLOAD_ASYNC_BYTES", str(5 * 1024 * 1024)))
+# With INGEST_WORKERS set, payment files at least this large are validated
+# and loaded by a process pool (see db.insert_payments).
+PARALLEL_INGEST_BYTES = int(os.environ.get("PARALLEL_INGEST_BYTES", str(1024 * 1024)))
+
+
 @app.route("/upload")
 @require_login
 def upload_page():
-    return render_template("upload.html")
+    return render_template("upload.html", jobs=recent_upload_jobs(session["username"]))
 
 
-@app.route("/upload/accounts", methods=["POST"])
-@require_login
-def upload_accounts():
+def _upload(kind, insert):
+    def page(**kwargs):
+        return render_template("upload.html", jobs=recent_upload_jobs(session["username"]), **kwargs)
+
     f = request.files.get("file")
     if not f or not f.filename.endswith(".csv"):
-        return render_template("upload.html", message="Please upload a .csv file.", success=False)
-    rows = parse_csv(f)
-    inserted, errors = insert_accounts(rows)
-    return render_template(
-        "upload.html",
-        message=f"Inserted {inserted} account(s).",
+        return page(message="Please upload a .csv file.", success=False)
+    required = UPLOAD_REQUIRED_COLUMNS[kind]
+    size = upload_size(f)
+    if size > UPLOAD_ASYNC_BYTES:
+        try:
+            check_csv_header(f, required)
+        except (ValueError, UnicodeDecodeError) as e:
+            return page(message=str(e), success=False)
+        job_id = enqueue_upload(kind, f.stream, f.filename, session["username"])
+        return page(message=f"Upload queued as job #{job_id}; progress is shown below.", success=True)
+    try:
+        chunked = kind == "payments" and INGEST_WORKERS > 0 and size >= PARALLEL_INGEST_BYTES
+        rows = parse_csv(f, required=required, chunked=chunked)
+    except (ValueError, UnicodeDecodeError) as e:
+        return page(message=str(e), success=False)
+    inserted, errors = insert(rows)
+    return page(
+        message=f"Inserted {inserted} {kind[:-1]}(s).",
         success=inserted > 0,
         errors=errors,
     )
 
 
+@app.route("/upload/accounts", methods=["POST"])
+@require_login
+def upload_accounts():
+    return _upload("accounts", insert_accounts)
+
+
 @app.route("/upload/payments", methods=["POST"])
 @require_login
 def upload_payments():
+    return _upload("payments", insert_payments)
+
+
+@app.route("/api/uploads/<kind>", methods=["POST"])
+@require_login
+def api_enqueue_upload(kind):
+    """Queue a CSV upload (multipart field "file") whatever its size. Returns 202 with the job id."""
+    if kind not in UPLOAD_REQUIRED_COLUMNS:
+        return jsonify(error=f"unknown upload kind {kind!r}"), 404
     f = request.files.get("file")
-    if not f or not f.filename.endswith(".csv"):
-        return render_template("upload.html", message="Please upload a .csv file.", success=False)
-    rows = parse_csv(f)
-    inserted, errors = insert_payments(rows)
-    return render_template(
-        "upload.html",
-        message=f"Inserted {inserted} payment(s).",
-        success=inserted > 0,
-        errors=errors,
-    )
+    if not f:
+        return jsonify(error='expected a CSV file in the "file" field'), 400
+    try:
+        check_csv_header(f, UPLOAD_REQUIRED_COLUMNS[kind])
+    except (ValueError, UnicodeDecodeError) as e:
+        return jsonify(error=str(e)), 400
+    job_id = enqueue_upload(kind, f.stream, f.filename or f"{kind}.csv", session["username"])
+    response = jsonify(id=job_id, status="queued")
+    response.status_code = 202
+    response.headers["Location"] = url_for("api_upload_job", job_id=job_id)
+    return response
+
+
+@app.route("/api/uploads")
+@require_login
+def api_upload_jobs():
+    """The current user's recent upload jobs."""
+    return jsonify(jobs=_json_rows(recent_upload_jobs(session["username"], limit=50)))
+
+
+@app.route("/api/uploads/<int:job_id>")
+@require_login
+def api_upload_job(job_id):
+    """Status, progress (rows done/inserted/failed) and row errors of one of the current user's uploads."""
+    job = upload_job(job_id, session["username"])
+    if job is None:
+        return jsonify(error="not found"), 404
+    return jsonify(_json_rows([job])[0])
 
 
 # ── Accounts routes ─────────────────────────────────────────────────
@@ -128,21 +391,34 @@ def upload_payments():
 @app.route("/accounts")
 @require_login
 def accounts_page():
-    name = request.args.get("name", "").strip()
+    query = request.args.get("q", "").strip()
     account_type = request.args.get("account_type", "").strip()
     status = request.args.get("status", "").strip()
     updated = request.args.get("updated") == "1"
-    accounts = search_accounts(
-        name=name or None,
-        account_type=account_type or None,
-        status=status or None,
-    )
+    after, limit = page_args()
+    if query:
+        accounts, next_after = search_account_names(
+            query, account_type=account_type or None, status=status or None, limit=limit,
+        ), None
+    else:
+        accounts, next_after = search_accounts(
+            account_type=account_type or None,
+            status=status or None,
+            after=after,
+            limit=limit,
+        )
+    balances = account_balances([a["id"] for a in accounts])
     return render_template(
         "accounts.html",
         accounts=accounts,
-        search_name=name,
+        balances=balances,
+        # One balance column per currency any account on this page holds.
+        balance_currencies=sorted({c for b in balances.values() for c in b}),
+        search_q=query,
         search_type=account_type,
         search_status=status,
+        after=after,
+        next_after=next_after,
         updated=updated,
     )
 
@@ -150,17 +426,19 @@ def accounts_page():
 @app.route("/accounts/<int:account_id>/update", methods=["POST"])
 @require_login
 def update_account_route(account_id):
-    update_account(
+    if not update_account(
         account_id,
         name=request.form["name"],
         account_type=request.form["account_type"],
         status=request.form["status"],
-    )
+    ):
+        abort(404)
     return redirect(url_for(
         "accounts_page",
-        name=request.form.get("search_name", ""),
+        q=request.form.get("search_q", ""),
         account_type=request.form.get("search_type", ""),
         status=request.form.get("search_status", ""),
+        after=request.form.get("search_after", ""),
         updated="1",
     ))
 
@@ -175,10 +453,17 @@ def payments_page():
     max_amount = request.args.get("max_amount", "").strip()
     updated = request.args.get("updated") == "1"
     created = request.args.get("created") == "1"
-    payments = search_payments(
+    error = request.args.get("error")
+    created_from, created_to = date_range_args()
+    after, limit = page_args()
+    payments, next_after = search_payments(
         currency=currency or None,
         min_amount=min_amount or None,
         max_amount=max_amount or None,
+        created_from=created_from,
+        created_to=created_to,
+        after=after,
+        limit=limit,
     )
     return render_template(
         "payments.html",
@@ -186,40 +471,57 @@ def payments_page():
         search_currency=currency,
         search_min=min_amount,
         search_max=max_amount,
+        search_from=created_from.isoformat() if created_from else "",
+        search_to=created_to.isoformat() if created_to else "",
+        after=after,
+        next_after=next_after,
         updated=updated,
         created=created,
+        error=error,
+        # Resubmitting this form (a double click, a reload) then creates the payment only once.
+        idempotency_key=uuid.uuid4().hex,
     )
 
 
 @app.route("/payments/create", methods=["POST"])
 @require_login
 def create_payment():
-    row = {
+    payment = {
         "amount": request.form["amount"],
         "currency": request.form["currency"],
         "debit_account": request.form["debit_account"],
         "credit_account": request.form["credit_account"],
+        "idempotency_key": request.form.get("idempotency_key") or None,
     }
-    insert_payments([row])
+    _, (result,) = create_payments([payment], session["username"])
+    if result["status"] in ("error", "conflict"):
+        return redirect(url_for("payments_page", error=f"Payment not created: {result['error']}"))
     return redirect(url_for("payments_page", created="1"))
 
 
 @app.route("/payments/<int:payment_id>/update", methods=["POST"])
 @require_login
 def update_payment_route(payment_id):
-    update_payment(
-        payment_id,
-        amount=request.form["amount"],
-        currency=request.form["currency"],
-        debit_account=request.form["debit_account"],
-        credit_account=request.form["credit_account"],
-    )
+    outcome = {"updated": "1"}
+    try:
+        update_payment(
+            payment_id,
+            amount=request.form["amount"],
+            currency=request.form["currency"],
+            debit_account=request.form["debit_account"],
+            credit_account=request.form["credit_account"],
+        )
+    except ValueError as e:
+        outcome = {"error": f"Payment {payment_id} not updated: {e}"}
     return redirect(url_for(
         "payments_page",
         currency=request.form.get("search_currency", ""),
         min_amount=request.form.get("search_min", ""),
         max_amount=request.form.get("search_max", ""),
-        updated="1",
+        created_from=request.form.get("search_from", ""),
+        created_to=request.form.get("search_to", ""),
+        after=request.form.get("search_after", ""),
+        **outcome,
     ))
 
 
@@ -228,13 +530,23 @@ def update_payment_route(payment_id):
 @app.route("/api/accounts")
 @require_login
 def api_accounts():
+    """A page of accounts, or with q, the top limit accounts by name relevance (each with a rank, no next page)."""
+    query = request.args.get("q")
     name = request.args.get("name")
     account_type = request.args.get("account_type")
     status = request.args.get("status")
-    rows = search_accounts(name=name, account_type=account_type, status=status)
-    for r in rows:
-        r["created_at"] = r["created_at"].isoformat()
-    return jsonify(rows)
+    after, limit = page_args()
+    if query:
+        rows, next_after = search_account_names(query, account_type=account_type, status=status, limit=limit), None
+    else:
+        rows, next_after = search_accounts(
+            name=name, account_type=account_type, status=status, after=after, limit=limit,
+        )
+    with SERIALIZE_SECONDS.time("/api/accounts"):
+        for r in rows:
+            r["created_at"] = r["created_at"].isoformat()
+        response = jsonify(rows)
+    return set_next_link(response, "api_accounts", next_after)
 
 
 @app.route("/api/payments")
@@ -243,11 +555,179 @@ def api_payments():
     currency = request.args.get("currency")
     min_amount = request.args.get("min_amount")
     max_amount = request.args.get("max_amount")
-    rows = search_payments(currency=currency, min_amount=min_amount, max_amount=max_amount)
+    created_from, created_to = date_range_args()
+    after, limit = page_args()
+    rows, next_after = search_payments(
+        currency=currency, min_amount=min_amount, max_amount=max_amount,
+        created_from=created_from, created_to=created_to, after=after, limit=limit,
+    )
+    with SERIALIZE_SECONDS.time("/api/payments"):
+        for r in rows:
+            r["created_at"] = r["created_at"].isoformat()
+            r["amount"] = float(r["amount"])
+        response = jsonify(rows)
+    return set_next_link(response, "api_payments", next_after)
+
+
+def _json_rows(rows):
+    for r in rows:
+        for k, v in r.items():
+            if isinstance(v, Decimal):
+                r[k] = float(v)
+            elif isinstance(v, (datetime.date, datetime.datetime)):
+                r[k] = v.isoformat()
+    return rows
+
+
+def _batch_update_response(update):
+    changes = request.get_json(silent=True)
+    if not isinstance(changes, list):
+        return jsonify(error="expected a JSON array of changes"), 400
+    try:
+        updated, results = update(changes)
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    _json_rows([r["row"] for r in results if "row" in r])
+    return jsonify(updated=updated, failed=len(results) - updated, results=results)
+
+
+@app.route("/api/payments", methods=["POST"])
+@require_login
+def api_create_payments():
+    """Create one payment (a JSON object) or a batch (a JSON array); see db.create_payments.
+
+    A single payment may carry its idempotency key in an Idempotency-Key
+    header instead. It answers 201 when created, 200 with the original
+    payment when its key was already used, 409 when the key was used for a
+    different payment and 422 when it is invalid. A batch answers 200 with a
+    result per payment.
+    """
+    body = request.get_json(silent=True)
+    single = isinstance(body, dict)
+    if single:
+        body = [dict(body)]
+        if request.headers.get("Idempotency-Key") and "idempotency_key" not in body[0]:
+            body[0]["idempotency_key"] = request.headers["Idempotency-Key"]
+    if not isinstance(body, list):
+        return jsonify(error="expected a JSON payment object or array of payments"), 400
+    try:
+        created, results = create_payments(body, session["username"])
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    _json_rows([r["payment"] for r in results if "payment" in r])
+    if single:
+        result = results[0]
+        if "payment" in result:
+            return jsonify(result["payment"]), 201 if result["status"] == "created" else 200
+        return jsonify(error=result["error"]), 409 if result["status"] == "conflict" else 422
+    return jsonify(created=created, failed=sum(r["status"] in ("error", "conflict") for r in results), results=results)
+
+
+@app.route("/api/accounts/<int:account_id>/balance")
+@require_login
+def api_account_balance(account_id):
+    """JSON — an account's balance (credits less debits) per currency; see db.account_balances."""
+    balances = account_balance(account_id)
+    if balances is None:
+        return jsonify(error=f"account {account_id} does not exist"), 404
+    return jsonify(account_id=account_id, balances={c: float(b) for c, b in balances.items()})
+
+
+@app.route("/api/accounts/update", methods=["POST"])
+@require_login
+def api_update_accounts():
+    """Apply a JSON array of account changes in one transaction; see db.update_accounts."""
+    return _batch_update_response(update_accounts)
+
+
+@app.route("/api/payments/update", methods=["POST"])
+@require_login
+def api_update_payments():
+    """Apply a JSON array of payment changes in one transaction; see db.update_payments."""
+    return _batch_update_response(update_payments)
+
+
+@app.route("/api/dashboard/stats")
+@require_login
+def api_dashboard_stats():
+    """Payment volume by currency, by day and by top debit/credit accounts, from the rollup tables."""
+    stats = dashboard_stats(
+        days=request.args.get("days", DASHBOARD_DAYS, type=int),
+        top=request.args.get("top", DASHBOARD_TOP_ACCOUNTS, type=int),
+    )
+    return jsonify({k: _json_rows(rows) for k, rows in stats.items()})
+
+
+@app.route("/api/dashboard/accounts/<int:account_id>")
+@require_login
+def api_account_payment_totals(account_id):
+    """Debit and credit count and volume per currency for one account."""
+    return jsonify(_json_rows(account_payment_totals(account_id)))
+
+
+@app.route("/api/keycloak/metrics")
+@require_login
+def api_keycloak_metrics():
+    """Call counts and latency of the Keycloak requests made by this process."""
+    return jsonify(keycloak_auth.metrics.snapshot())
+
+
+@app.route("/api/cache/stats")
+@require_login
+def api_cache_stats():
+    """Hit/miss/eviction counters of the search result cache in this worker."""
+    return jsonify(search_cache_stats())
+
+
+def _ndjson_chunks(rows):
+    lines = []
     for r in rows:
         r["created_at"] = r["created_at"].isoformat()
         r["amount"] = float(r["amount"])
-    return jsonify(rows)
+        lines.append(json.dumps(r))
+        if len(lines) >= EXPORT_CHUNK_ROWS:
+            yield "\n".join(lines) + "\n"
+            lines = []
+    if lines:
+        yield "\n".join(lines) + "\n"
+
+
+def _csv_chunks(rows):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(PAYMENT_EXPORT_COLUMNS)
+    for i, r in enumerate(rows, 1):
+        r["created_at"] = r["created_at"].isoformat()
+        writer.writerow([r[c] for c in PAYMENT_EXPORT_COLUMNS])
+        if i % EXPORT_CHUNK_ROWS == 0:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+    yield buf.getvalue()
+
+
+@app.route("/api/payments/export")
+@require_login
+def api_payments_export():
+    """Stream every matching payment as NDJSON (default) or CSV."""
+    fmt = request.args.get("format", "ndjson")
+    if fmt not in ("ndjson", "csv"):
+        return jsonify(error="format must be 'ndjson' or 'csv'"), 400
+    created_from, created_to = date_range_args()
+    rows = iter_payments(
+        currency=request.args.get("currency"),
+        min_amount=request.args.get("min_amount"),
+        max_amount=request.args.get("max_amount"),
+        created_from=created_from,
+        created_to=created_to,
+    )
+    if fmt == "csv":
+        return Response(
+            stream_with_context(_csv_chunks(rows)),
+            mimetype="text/csv",
+            headers={"Content-Disposition": "attachment; filename=payments.csv"},
+        )
+    return Response(stream_with_context(_ndjson_chunks(rows)), mimetype="application/x-ndjson")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,147 @@
+import threading
+import time
+from contextlib import contextmanager
+
+from jwcrypto import jwk
+from jwcrypto.jwt import JWTMissingKey
+from keycloak.exceptions import KeycloakError
+
+# Refresh the access token when it has less than this many seconds left.
+REFRESH_MARGIN = 30
+
+
+class KeycloakMetrics:
+    """Call count, error count and latency for each kind of Keycloak request."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ops = {}
+
+    @contextmanager
+    def timed(self, op):
+        start = time.perf_counter()
+        ok = False
+        try:
+            yield
+            ok = True
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                s = self._ops.setdefault(op, {"calls": 0, "errors": 0, "total_seconds": 0.0, "max_seconds": 0.0})
+                s["calls"] += 1
+                s["errors"] += 0 if ok else 1
+                s["total_seconds"] += elapsed
+                s["max_seconds"] = max(s["max_seconds"], elapsed)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                op: dict(s, avg_seconds=s["total_seconds"] / s["calls"] if s["calls"] else 0.0)
+                for op, s in self._ops.items()
+            }
+
+
+class KeycloakAuth:
+    """Password-grant login plus local verification of the issued tokens.
+
+    Access tokens are checked against the realm JWKS, fetched once and cached.
+    A token signed with an unknown key id triggers a re-fetch (at most every
+    ``jwks_min_refresh`` seconds), which picks up Keycloak key rotation.
+    Tokens close to expiry are renewed with the refresh-token grant, so
+    Keycloak is only contacted at login, on refresh, and on key rotation.
+    """
+
+    def __init__(self, openid, jwks_min_refresh=30.0):
+        self.openid = openid
+        self.jwks_min_refresh = jwks_min_refresh
+        self.metrics = KeycloakMetrics()
+        self._lock = threading.Lock()
+        self._keyset = None
+        self._keyset_fetched_at = 0.0
+
+    def _tokens(self, response):
+        now = time.time()
+        return {
+            "access_token": response["access_token"],
+            "refresh_token": response.get("refresh_token"),
+            "expires_at": now + response.get("expires_in", 0),
+            "refresh_expires_at": now + response.get("refresh_expires_in", 0),
+        }
+
+    def login(self, username, password):
+        """Run the password grant. Returns the token dict to store for the session, or None."""
+        try:
+            with self.metrics.timed("token"):
+                response = self.openid.token(username, password)
+        except Exception:
+            return None
+        return self._tokens(response)
+
+    def refresh(self, tokens):
+        """Exchange the refresh token for new tokens.
+
+        Returns the new token dict, or None if Keycloak rejects the refresh
+        token. Raises KeycloakError if Keycloak cannot be reached.
+        """
+        if not tokens.get("refresh_token") or tokens["refresh_expires_at"] <= time.time():
+            return None
+        try:
+            with self.metrics.timed("refresh"):
+                response = self.openid.refresh_token(tokens["refresh_token"])
+        except KeycloakError as e:
+            # Keycloak answers a revoked or expired refresh token with 400
+            # invalid_grant; anything else, such as a KeycloakConnectionError
+            # or a 5xx, says nothing about the token.
+            if e.response_code == 400:
+                return None
+            raise
+        return self._tokens(response)
+
+    def _get_keyset(self, force=False):
+        # The fetch runs outside the lock so a slow Keycloak only stalls the
+        # threads that need new keys, not those verifying with the cached set.
+        with self._lock:
+            stale = time.monotonic() - self._keyset_fetched_at >= self.jwks_min_refresh
+            if self._keyset is not None and not (force and stale):
+                return self._keyset
+        with self.metrics.timed("certs"):
+            certs = self.openid.certs()
+        keyset = jwk.JWKSet()
+        for cert in certs["keys"]:
+            keyset.add(jwk.JWK(**cert))
+        with self._lock:
+            self._keyset = keyset
+            self._keyset_fetched_at = time.monotonic()
+        return keyset
+
+    def verify(self, access_token):
+        """Verify signature and expiry locally. Returns the claims, or None if the token is invalid.
+
+        Raises KeycloakError if the JWKS has to be fetched and Keycloak cannot be reached.
+        """
+        for force in (False, True):
+            keyset = self._get_keyset(force=force)
+            try:
+                return self.openid.decode_token(access_token, key=keyset, check_claims={"exp": None})
+            except JWTMissingKey:
+                continue
+            except Exception:
+                return None
+        return None
+
+    def validate(self, tokens):
+        """Check a session's tokens, refreshing them when close to expiry.
+
+        Returns (claims, tokens); tokens may be a refreshed set that the
+        caller should store back for the session. Returns (None, None) when
+        the user has to log in again, and raises KeycloakError when Keycloak
+        is needed but unavailable, which says nothing about the tokens.
+        """
+        if tokens["expires_at"] - time.time() < REFRESH_MARGIN:
+            tokens = self.refresh(tokens)
+            if tokens is None:
+                return None, None
+        claims = self.verify(tokens["access_token"])
+        if claims is None:
+            return None, None
+        return claims, tokens
@@ -0,0 +1,305 @@
+import collections
+import json
+import select
+import threading
+import time
+
+import psycopg2
+
+NOTIFY_CHANNEL = "search_cache"
+ACCOUNT_NOTIFY_CHANNEL = "account_directory"
+
+
+class SearchCache:
+    """LRU + TTL cache of search result pages with precise invalidation.
+
+    Entries are keyed on (table, normalized filters, after, limit) and remember
+    which ids they hold and which id range they cover, so a write only drops
+    the pages it can actually affect:
+
+    - an updated row drops pages that contain it, and pages whose filters
+      match its new values and whose id range covers it;
+    - inserted rows (ids >= min_id) drop pages whose range reaches min_id.
+
+    ``matchers`` maps a table name to ``fn(filters, row) -> bool`` deciding
+    whether a row satisfies a search's filters. Cached rows are copied on the
+    way in and out because callers convert values in place.
+    """
+
+    def __init__(self, matchers, maxsize=512, ttl=30.0):
+        self.matchers = matchers
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+        self._generation = collections.Counter()
+        self._stats = collections.Counter(hits=0, misses=0, evictions=0, expirations=0, invalidations=0)
+
+    @property
+    def enabled(self):
+        return self.maxsize > 0
+
+    def generation(self, table):
+        """Token to pass to put(); a write in between makes put() a no-op so stale results are not cached."""
+        with self._lock:
+            return self._generation[table]
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            if entry["expires_at"] <= time.monotonic():
+                del self._entries[key]
+                self._stats["expirations"] += 1
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return [dict(r) for r in entry["rows"]], entry["next_after"]
+
+    def put(self, key, generation, filters, after, rows, next_after):
+        table = key[0]
+        entry = {
+            "filters": filters,
+            "after": after,
+            "next_after": next_after,
+            "ids": {r["id"] for r in rows},
+            "rows": [dict(r) for r in rows],
+            "expires_at": time.monotonic() + self.ttl,
+        }
+        with self._lock:
+            if self._generation[table] != generation:
+                return
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def _drop(self, table, predicate):
+        with self._lock:
+            self._generation[table] += 1
+            stale = [k for k, e in self._entries.items() if k[0] == table and predicate(e)]
+            for k in stale:
+                del self._entries[k]
+            self._stats["invalidations"] += len(stale)
+
+    def invalidate_inserted(self, table, min_id):
+        """Drop pages that rows with ids >= min_id could have landed in."""
+        if min_id is None:
+            return
+        self._drop(table, lambda e: e["next_after"] is None or e["next_after"] >= min_id)
+
+    def invalidate_row(self, table, row):
+        """Drop pages affected by a row's new values (row must include its id)."""
+        matcher = self.matchers[table]
+
+        def affected(e):
+            if row["id"] in e["ids"]:
+                return True
+            in_range = ((e["after"] is None or row["id"] > e["after"])
+                        and (e["next_after"] is None or row["id"] <= e["next_after"]))
+            if not in_range:
+                return False
+            try:
+                return matcher(e["filters"], row)
+            except Exception:
+                return True
+
+        self._drop(table, affected)
+
+    def invalidate_table(self, table):
+        """Drop every page of a table, for writes too large to invalidate row by row."""
+        self._drop(table, lambda e: True)
+
+    def clear(self):
+        with self._lock:
+            for table in {k[0] for k in self._entries}:
+                self._generation[table] += 1
+            self._stats["invalidations"] += len(self._entries)
+            self._entries.clear()
+
+    def apply(self, event):
+        """Apply an invalidation event as produced by event_payload()."""
+        if event["op"] == "insert":
+            self.invalidate_inserted(event["table"], event["min_id"])
+        elif event["op"] == "reset":
+            self.invalidate_table(event["table"])
+        else:
+            self.invalidate_row(event["table"], event["row"])
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, size=len(self._entries), maxsize=self.maxsize, ttl=self.ttl)
+
+
+def event_payload(table, op, row=None, min_id=None):
+    return json.dumps({"table": table, "op": op, "row": row, "min_id": min_id}, default=str)
+
+
+def _set_bit(bits, i, on):
+    byte, mask = i >> 3, 1 << (i & 7)
+    if byte >= len(bits):
+        if not on:
+            return
+        bits.extend(bytes(byte + 1 - len(bits)))
+    if on:
+        bits[byte] |= mask
+    else:
+        bits[byte] &= ~mask
+
+
+def _get_bit(bits, i):
+    byte = i >> 3
+    return byte < len(bits) and bool(bits[byte] >> (i & 7) & 1)
+
+
+class AccountDirectory:
+    """Which account ids exist and which are active, as two bitmaps indexed by id.
+
+    Loaded once from the accounts table, then kept current by the events the
+    accounts trigger sends on ACCOUNT_NOTIFY_CHANNEL
+    (db/migrations/004_account_directory.sql), applied by an
+    InvalidationListener. A million accounts take 250KB.
+
+    status() answers None, meaning "ask the database", until a load succeeds
+    and for ids above the highest one seen, which may belong to an account
+    created since the last event arrived.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._exists = None
+        self._active = None
+        self._max_id = 0
+        self._generation = 0
+        self._stats = collections.Counter(hits=0, misses=0, loads=0, resets=0)
+
+    @property
+    def loaded(self):
+        return self._exists is not None
+
+    def generation(self):
+        """Token to pass to load(); an event in between makes load() a no-op so a stale snapshot is not installed."""
+        with self._lock:
+            return self._generation
+
+    def load(self, rows, generation):
+        """Install (id, is_active) rows read after generation(). Returns False if they may be stale."""
+        exists, active, max_id = bytearray(), bytearray(), 0
+        for account_id, is_active in rows:
+            _set_bit(exists, account_id, True)
+            _set_bit(active, account_id, is_active)
+            max_id = max(max_id, account_id)
+        with self._lock:
+            if self._generation != generation:
+                return False
+            self._exists, self._active, self._max_id = exists, active, max_id
+            self._stats["loads"] += 1
+        return True
+
+    def status(self, account_id):
+        """'active', 'inactive', 'missing', or None when the database has to be asked."""
+        with self._lock:
+            if self._exists is None or account_id > self._max_id:
+                self._stats["misses"] += 1
+                return None
+            self._stats["hits"] += 1
+            if not _get_bit(self._exists, account_id):
+                return "missing"
+            return "active" if _get_bit(self._active, account_id) else "inactive"
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._exists = self._active = None
+            self._max_id = 0
+
+    def apply(self, event):
+        """Apply an accounts trigger event: {"active": [...], "inactive": [...], "deleted": [...]} or {"reset": true}."""
+        if event.get("reset"):
+            self.clear()
+            with self._lock:
+                self._stats["resets"] += 1
+            return
+        with self._lock:
+            self._generation += 1
+            if self._exists is None:
+                return
+            for account_id in event.get("active", ()):
+                _set_bit(self._exists, account_id, True)
+                _set_bit(self._active, account_id, True)
+                self._max_id = max(self._max_id, account_id)
+            for account_id in event.get("inactive", ()):
+                _set_bit(self._exists, account_id, True)
+                _set_bit(self._active, account_id, False)
+                self._max_id = max(self._max_id, account_id)
+            for account_id in event.get("deleted", ()):
+                _set_bit(self._exists, account_id, False)
+                _set_bit(self._active, account_id, False)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, loaded=self._exists is not None, max_id=self._max_id,
+                        bytes=len(self._exists or b"") + len(self._active or b""))
+
+
+class InvalidationListener:
+    """Background LISTEN on a channel (search_cache by default), applying other processes' writes to a local cache.
+
+    Writers send the same event with pg_notify() inside their transaction, so
+    it is only delivered once the write commits. While the listener is not
+    connected, invalidations could be missed, so ``connected`` is False and
+    the cache is cleared on every (re)connect. Any object with clear() and
+    apply(event) can be kept current this way.
+    """
+
+    def __init__(self, cache, conn_kwargs, reconnect_delay=5.0, channel=NOTIFY_CHANNEL, name="search-cache-listener"):
+        self.cache = cache
+        self.conn_kwargs = conn_kwargs
+        self.reconnect_delay = reconnect_delay
+        self.channel = channel
+        self.name = name
+        self.connected = False
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            conn = None
+            try:
+                conn = psycopg2.connect(**self.conn_kwargs)
+                conn.autocommit = True
+                with conn.cursor() as cur:
+                    cur.execute(f"LISTEN {self.channel}")
+                self.cache.clear()
+                self.connected = True
+                while True:
+                    if select.select([conn], [], [], 5.0) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        notify = conn.notifies.pop(0)
+                        try:
+                            self.cache.apply(json.loads(notify.payload))
+                        except Exception:
+                            self.cache.clear()
+            except Exception:
+                pass
+            finally:
+                self.connected = False
+                self.cache.clear()
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+            time.sleep(self.reconnect_delay)
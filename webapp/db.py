@@ -1,5 +1,29 @@
-import psycopg2
-from psycopg2.extras import RealDictCursor
+import collections
+import datetime
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import re
+import secrets
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from decimal import ROUND_HALF_UP, Decimal, InvalidOperation
+
+from psycopg2.extras import RealDictCursor, execute_values
+
+from cache import (
+    ACCOUNT_NOTIFY_CHANNEL, NOTIFY_CHANNEL, AccountDirectory, InvalidationListener, SearchCache, event_payload,
+)
+from group_commit import GroupCommitWriter
+from ingest import CsvChunks, init_loader, load_payment_chunk
+from metrics import REGISTRY, record_query
+from pool import ConnectionPool
 
 DB_CONFIG = {
     "host": "localhost",
@@ -9,37 +33,461 @@ DB_CONFIG = {
     "password": "localdev",
 }
 
+POOL_CONFIG = {
+    "minconn": int(os.environ.get("DB_POOL_MIN", "1")),
+    "maxconn": int(os.environ.get("DB_POOL_MAX", "10")),
+    "timeout": float(os.environ.get("DB_POOL_TIMEOUT", "10")),
+    "max_lifetime": float(os.environ.get("DB_POOL_MAX_LIFETIME", "1800")),
+    "max_idle": float(os.environ.get("DB_POOL_MAX_IDLE", "300")),
+    "check_after": float(os.environ.get("DB_POOL_CHECK_AFTER", "5")),
+}
+
+CACHE_CONFIG = {
+    "maxsize": int(os.environ.get("SEARCH_CACHE_SIZE", "512")),
+    "ttl": float(os.environ.get("SEARCH_CACHE_TTL", "30")),
+}
+# Broadcast invalidations to the other worker processes via LISTEN/NOTIFY.
+CACHE_NOTIFY = os.environ.get("SEARCH_CACHE_NOTIFY", "1") == "1"
+
+# Batch updates touching more rows than this reset the table's cached pages.
+CACHE_RESET_ROWS = 50
+
+# Check payment accounts against the in-memory account directory.
+ACCOUNT_DIRECTORY = os.environ.get("ACCOUNT_DIRECTORY", "1") == "1"
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+# Ranked name search: results returned by default, and the pg_trgm word
+# similarity (0-1) a misspelt query must reach to match a name.
+NAME_SEARCH_LIMIT = int(os.environ.get("NAME_SEARCH_LIMIT", "20"))
+NAME_SEARCH_SIMILARITY = float(os.environ.get("NAME_SEARCH_SIMILARITY", "0.5"))
+EXPORT_ITERSIZE = 5000
+
+QUERY_SECONDS = REGISTRY.histogram(
+    "webapp_db_query_seconds", "Time spent executing SQL, by query shape.", ("shape",),
+)
+ACQUIRE_SECONDS = REGISTRY.histogram(
+    "webapp_db_connection_acquire_seconds", "Time spent waiting for a pooled connection.",
+)
 
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Return the process-wide connection pool, creating it on first use."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(**POOL_CONFIG, **DB_CONFIG)
+                threading.Thread(target=_maintain_partitions, name="payment-partitions", daemon=True).start()
+    return _pool
+
+
+@contextmanager
 def get_conn():
-    return psycopg2.connect(**DB_CONFIG)
+    """Check a connection out of the pool for the duration of the block.
+
+    Any transaction left open is rolled back when the connection is returned.
+    """
+    pool = get_pool()
+    with ACQUIRE_SECONDS.time():
+        conn = pool.getconn()
+    try:
+        yield conn
+    finally:
+        pool.putconn(conn, discard=bool(conn.closed))
 
 
-# ── Accounts ─────────────────────────────────────────────────────────
+def pool_stats():
+    return get_pool().stats() if _pool is not None else {}
 
-def insert_accounts(rows):
-    """Insert list of dicts with keys: name, account_type, status. Returns (inserted, errors)."""
-    inserted, errors = 0, []
-    conn = get_conn()
+
+@contextmanager
+def _timed_query(shape, sql):
+    """Time the block into QUERY_SECONDS under a low-cardinality shape label."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        QUERY_SECONDS.observe(elapsed, shape)
+        record_query(shape, sql, elapsed)
+
+
+def _execute(cur, shape, sql, params=None):
+    with _timed_query(shape, sql):
+        cur.execute(sql, params)
+
+
+def _filter_shape(table, clauses):
+    """e.g. "accounts:name+status" for the columns a WHERE clause filters on."""
+    return f"{table}:" + ("+".join(dict.fromkeys(c.split()[0] for c in clauses)) or "all")
+
+
+# ── Search cache ─────────────────────────────────────────────────────
+
+def _name_matches(pattern, name):
+    # LIKE wildcards in the search term cannot be evaluated here; assume a match.
+    if any(c in pattern for c in "%_\\"):
+        return True
+    return pattern.lower() in name.lower()
+
+
+def _account_matches(filters, row):
+    if filters.get("name") and not _name_matches(filters["name"], row["name"]):
+        return False
+    if filters.get("account_type") and row["account_type"] != filters["account_type"]:
+        return False
+    if filters.get("status") and row["status"] != filters["status"]:
+        return False
+    return True
+
+
+def _payment_matches(filters, row):
+    if filters.get("currency") and row["currency"] != filters["currency"]:
+        return False
+    amount = Decimal(str(row["amount"]))
+    if filters.get("min_amount") and amount < Decimal(filters["min_amount"]):
+        return False
+    if filters.get("max_amount") and amount > Decimal(filters["max_amount"]):
+        return False
+    if filters.get("created_from") or filters.get("created_to"):
+        # Update events do not carry created_at; assume the row may be in range.
+        if row.get("created_at") is None:
+            return True
+        day = str(row["created_at"])[:10]
+        if filters.get("created_from") and day < filters["created_from"].isoformat():
+            return False
+        if filters.get("created_to") and day > filters["created_to"].isoformat():
+            return False
+    return True
+
+
+search_cache = SearchCache({"accounts": _account_matches, "payments": _payment_matches}, **CACHE_CONFIG)
+_cache_listener = InvalidationListener(search_cache, DB_CONFIG)
+
+
+def _usable_cache():
+    """The search cache, or None while it is disabled or could miss other workers' invalidations."""
+    if not search_cache.enabled:
+        return None
+    if CACHE_NOTIFY:
+        _cache_listener.start()
+        if not _cache_listener.connected:
+            return None
+    return search_cache
+
+
+def _normalize_amount(value):
     try:
+        return str(Decimal(str(value).strip()).normalize())
+    except (InvalidOperation, ValueError):
+        return value
+
+
+def _publish_write(cur, table, op, row=None, min_id=None):
+    """Queue an invalidation for the other workers; pg_notify is delivered on commit. Returns the event."""
+    event = {"table": table, "op": op, "row": row, "min_id": min_id}
+    if CACHE_NOTIFY and search_cache.enabled:
+        cur.execute("SELECT pg_notify(%s, %s)", (NOTIFY_CHANNEL, event_payload(**event)))
+    return event
+
+
+def _publish_writes(cur, table, rows):
+    """Like _publish_write() for many updated rows; past CACHE_RESET_ROWS the table's pages are reset instead.
+
+    Returns the events to apply to this process's cache after commit.
+    """
+    if len(rows) > CACHE_RESET_ROWS:
+        return [_publish_write(cur, table, "reset")]
+    events = [{"table": table, "op": "update", "row": row, "min_id": None} for row in rows]
+    if events and CACHE_NOTIFY and search_cache.enabled:
+        cur.execute(
+            "SELECT pg_notify(%s, payload) FROM unnest(%s::text[]) AS payload",
+            (NOTIFY_CHANNEL, [event_payload(**e) for e in events]),
+        )
+    return events
+
+
+def search_cache_stats():
+    return dict(search_cache.stats(), listener_connected=_cache_listener.connected, notify=CACHE_NOTIFY)
+
+
+# ── Payment partitions ───────────────────────────────────────────────
+#
+# payments is partitioned by month of created_at
+# (db/migrations/006_partition_payments.sql). Every process tops up the
+# partitions PAYMENT_PARTITION_MONTHS_AHEAD months ahead once an hour; the
+# call is idempotent, and a payment dated past the last partition lands in
+# payments_default until then.
+
+PAYMENT_PARTITION_MONTHS_AHEAD = int(os.environ.get("PAYMENT_PARTITION_MONTHS_AHEAD", "3"))
+PAYMENT_PARTITION_CHECK_SECONDS = float(os.environ.get("PAYMENT_PARTITION_CHECK_SECONDS", "3600"))
+
+
+def ensure_payment_partitions(months_ahead=PAYMENT_PARTITION_MONTHS_AHEAD):
+    """Create any missing monthly partitions up to months_ahead months out. Returns how many were created."""
+    with get_conn() as conn:
         cur = conn.cursor()
-        for i, row in enumerate(rows, 1):
-            try:
-                cur.execute(
-                    "INSERT INTO accounts (name, account_type, status) VALUES (%s, %s, %s)",
-                    (row["name"], row["account_type"], row.get("status", "active")),
-                )
-                inserted += 1
-            except Exception as e:
-                conn.rollback()
-                errors.append(f"Row {i}: {e}")
-                continue
+        _execute(cur, "partitions:payments", "SELECT payments_create_partitions(%s)", (months_ahead,))
+        created = cur.fetchone()[0]
         conn.commit()
-    finally:
-        conn.close()
+    return created
+
+
+def _maintain_partitions():
+    while True:
+        try:
+            ensure_payment_partitions()
+        except Exception:
+            pass  # retried next round
+        time.sleep(PAYMENT_PARTITION_CHECK_SECONDS)
+
+
+# ── Account directory ────────────────────────────────────────────────
+#
+# Payment writes look their accounts up here rather than leaving a bad or
+# inactive account to the foreign key (or to nobody, for inactive ones).
+# The directory is loaded on first use once its listener is connected, and
+# follows the accounts trigger from db/migrations/004_account_directory.sql.
+# The database checks stay in place behind it for the short window before
+# another process's change arrives.
+
+account_directory = AccountDirectory()
+_directory_listener = InvalidationListener(
+    account_directory, DB_CONFIG, channel=ACCOUNT_NOTIFY_CHANNEL, name="account-directory-listener",
+)
+
+
+def _usable_directory():
+    """The account directory, loading it if needed, or None while it could be missing changes."""
+    if not ACCOUNT_DIRECTORY:
+        return None
+    _directory_listener.start()
+    if not _directory_listener.connected:
+        return None
+    if not account_directory.loaded:
+        generation = account_directory.generation()
+        with get_conn() as conn:
+            cur = conn.cursor()
+            _execute(cur, "account_directory:load", "SELECT id, status = 'active' FROM accounts")
+            if not account_directory.load(cur, generation):
+                return None
+    return account_directory
+
+
+def _account_statuses(ids):
+    """{id: 'active' | 'inactive' | 'missing'}, querying only for the ids the directory cannot answer."""
+    directory = _usable_directory()
+    statuses = {i: directory.status(i) if directory else None for i in ids}
+    unknown = [i for i, status in statuses.items() if status is None]
+    if unknown:
+        with get_conn() as conn:
+            cur = conn.cursor()
+            _execute(cur, "account_directory:lookup", "SELECT id, status FROM accounts WHERE id = ANY(%s)", (unknown,))
+            found = dict(cur.fetchall())
+        statuses.update((i, found.get(i, "missing")) for i in unknown)
+    return statuses
+
+
+def _account_error(field, account_id, statuses):
+    status = statuses[account_id]
+    if status == "missing":
+        return f"{field} {account_id} does not exist"
+    if status != "active":
+        return f"{field} {account_id} is inactive"
+    return None
+
+
+def payment_account_error(debit_account, credit_account):
+    """Why a payment between these accounts would be rejected, or None if both exist and are active."""
+    try:
+        debit = _id_value(debit_account, "debit_account")
+        credit = _id_value(credit_account, "credit_account")
+    except ValueError as e:
+        return str(e)
+    statuses = _account_statuses({debit, credit})
+    return _account_error("debit_account", debit, statuses) or _account_error("credit_account", credit, statuses)
+
+
+def account_directory_stats():
+    return dict(account_directory.stats(), listener_connected=_directory_listener.connected, enabled=ACCOUNT_DIRECTORY)
+
+
+# ── Pagination ───────────────────────────────────────────────────────
+
+def _clamp_limit(limit):
+    return max(1, min(limit or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE))
+
+
+def _page_query(table, clauses, params, after, limit):
+    """Build the keyset page query. Returns (sql, params, limit); the query fetches one extra row."""
+    limit = _clamp_limit(limit)
+    if after is not None:
+        clauses = clauses + ["id > %s"]
+        params = params + [after]
+    where = (" WHERE " + " AND ".join(clauses)) if clauses else ""
+    return f"SELECT * FROM {table}{where} ORDER BY id LIMIT %s", params + [limit + 1], limit
+
+
+def _page(table, clauses, params, after, limit):
+    """Fetch one keyset page ordered by id. Returns (rows, next_after)."""
+    sql, params, limit = _page_query(table, clauses, params, after, limit)
+    with get_conn() as conn:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        _execute(cur, "page:" + _filter_shape(table, clauses + (["id"] if after is not None else [])), sql, params)
+        rows = cur.fetchall()
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, rows[-1]["id"]
+    return rows, None
+
+
+def _cached_page(table, filters, key_filters, clauses, params, after, limit):
+    """_page() through the search cache; key_filters is the normalized form of filters."""
+    cache = _usable_cache()
+    if cache is None:
+        return _page(table, clauses, params, after, limit)
+    key = (table, key_filters, after, _clamp_limit(limit))
+    hit = cache.get(key)
+    if hit is not None:
+        return hit
+    generation = cache.generation(table)
+    rows, next_after = _page(table, clauses, params, after, limit)
+    cache.put(key, generation, filters, after, rows, next_after)
+    return rows, next_after
+
+
+# ── Bulk ingest ──────────────────────────────────────────────────────
+#
+# Uploads are streamed into a temporary staging table with COPY, validated
+# there with set-based UPDATEs that record a per-row error, and the clean
+# rows are merged into the real table with a single INSERT ... SELECT. Bad
+# rows never abort the transaction, so earlier good rows are kept and the
+# reported counts match what was committed.
+
+COPY_BATCH_SIZE = 10000
+MAX_REPORTED_ERRORS = 1000
+
+
+def _copy_value(value):
+    """Encode one value for COPY text format; None becomes NULL."""
+    if value is None:
+        return "\\N"
+    return (str(value).replace("\\", "\\\\").replace("\t", "\\t")
+            .replace("\n", "\\n").replace("\r", "\\r"))
+
+
+def _copy_rows(cur, stage, columns, rows):
+    """COPY an iterable of dicts into stage, numbering them from 1 in row_no. Returns the row count."""
+    copy_sql = f"COPY {stage} (row_no, {', '.join(columns)}) FROM STDIN"
+    buf = io.StringIO()
+    count = 0
+    for count, row in enumerate(rows, 1):
+        buf.write(f"{count}\t" + "\t".join(_copy_value(row.get(c)) for c in columns) + "\n")
+        if count % COPY_BATCH_SIZE == 0:
+            buf.seek(0)
+            cur.copy_expert(copy_sql, buf)
+            buf.seek(0)
+            buf.truncate()
+    if buf.tell():
+        buf.seek(0)
+        cur.copy_expert(copy_sql, buf)
+    return count
+
+
+def _stage_and_merge(cur, table, stage_ddl, columns, validations, merge_sql, rows, row_offset=0):
+    """Stage rows in {table}_stage, run the validation statements, merge the clean rows.
+
+    Runs inside the caller's transaction and raises on database errors.
+    merge_sql must return (inserted count, lowest inserted id). Error
+    messages number rows from row_offset + 1. Returns
+    (staged, inserted, failed, errors, cache event).
+    """
+    stage = f"{table}_stage"
+    cur.execute(stage_ddl)
+    with _timed_query(f"ingest:{table}:copy", f"COPY {stage} FROM STDIN"):
+        staged = _copy_rows(cur, stage, columns, rows)
+    _execute(cur, f"ingest:{table}:analyze", f"ANALYZE {stage}")
+    for sql in validations:
+        _execute(cur, f"ingest:{table}:validate", sql)
+    _execute(cur, f"ingest:{table}:merge", merge_sql)
+    inserted, min_id = cur.fetchone()
+    event = _publish_write(cur, table, "insert", min_id=min_id)
+    _execute(cur, f"ingest:{table}:errors", f"SELECT count(*) FROM {stage} WHERE error IS NOT NULL")
+    failed = cur.fetchone()[0]
+    _execute(
+        cur, f"ingest:{table}:errors",
+        f"SELECT row_no, error FROM {stage} WHERE error IS NOT NULL ORDER BY row_no LIMIT %s",
+        (MAX_REPORTED_ERRORS,),
+    )
+    errors = [f"Row {row_no + row_offset}: {error}" for row_no, error in cur.fetchall()]
+    return staged, inserted, failed, errors, event
+
+
+def _bulk_ingest(conn, table, stage_ddl, columns, validations, merge_sql, rows):
+    """_stage_and_merge() in its own transaction. Returns (inserted, errors)."""
+    try:
+        cur = conn.cursor()
+        _, inserted, failed, errors, event = _stage_and_merge(
+            cur, table, stage_ddl, columns, validations, merge_sql, rows,
+        )
+        if failed > len(errors):
+            errors.append(f"... and {failed - len(errors)} more rejected row(s)")
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        return 0, [f"Upload failed, nothing was inserted: {e}"]
+    search_cache.apply(event)
     return inserted, errors
 
 
-def search_accounts(name=None, account_type=None, status=None):
+# ── Accounts ─────────────────────────────────────────────────────────
+
+ACCOUNTS_STAGE_DDL = """
+    CREATE TEMP TABLE accounts_stage (
+        row_no       integer,
+        name         text,
+        account_type text,
+        status       text,
+        error        text
+    ) ON COMMIT DROP
+"""
+
+ACCOUNTS_VALIDATIONS = [
+    """
+    UPDATE accounts_stage SET error = CASE
+        WHEN name IS NULL OR trim(name) = '' THEN 'name is required'
+        WHEN length(name) > 100 THEN 'name is longer than 100 characters'
+        WHEN account_type IS NULL OR trim(account_type) = '' THEN 'account_type is required'
+        WHEN length(account_type) > 50 THEN 'account_type is longer than 50 characters'
+        WHEN COALESCE(status, 'active') NOT IN ('active', 'inactive')
+            THEN 'invalid status ' || quote_literal(status)
+    END
+    """,
+]
+
+ACCOUNTS_MERGE = """
+    WITH inserted AS (
+        INSERT INTO accounts (name, account_type, status)
+        SELECT name, account_type, COALESCE(status, 'active')
+        FROM accounts_stage WHERE error IS NULL ORDER BY row_no
+        RETURNING id
+    )
+    SELECT count(*), min(id) FROM inserted
+"""
+
+
+def insert_accounts(rows):
+    """Insert an iterable of dicts with keys: name, account_type, status. Returns (inserted, errors)."""
+    with get_conn() as conn:
+        return _bulk_ingest(conn, "accounts", *_INGEST["accounts"], rows=rows)
+
+
+def _account_filters(name=None, account_type=None, status=None):
     clauses, params = [], []
     if name:
         clauses.append("name ILIKE %s")
@@ -50,55 +498,337 @@ def search_accounts(name=None, account_type=None, status=None):
     if status:
         clauses.append("status = %s")
         params.append(status)
-    where = (" WHERE " + " AND ".join(clauses)) if clauses else ""
-    conn = get_conn()
-    try:
+    return clauses, params
+
+
+def search_accounts(name=None, account_type=None, status=None, after=None, limit=None):
+    """Return one page of matching accounts as (rows, next_after); pass next_after back as after for the next page."""
+    filters = {"name": name, "account_type": account_type, "status": status}
+    key_filters = (name.lower() if name else None, account_type or None, status or None)
+    clauses, params = _account_filters(**filters)
+    return _cached_page("accounts", filters, key_filters, clauses, params, after, limit)
+
+
+# Ranked name search. Every query word must prefix a word of the name
+# (full-text index); failing that, the whole query must be similar enough to
+# some stretch of the name (trigram index), which catches typos. Prefix
+# matches rank above fuzzy ones, and each group by word similarity. Results
+# are the top k rather than a page, so they are not cached or paginated.
+
+def _name_search_query(query, account_type=None, status=None, limit=None):
+    """Build the ranked search. Returns (sql, params), or None if query has no words."""
+    words = re.findall(r"\w+", query.lower())
+    if not words:
+        return None
+    tsquery = " & ".join(f"{w}:*" for w in words)
+    clauses, params = _account_filters(account_type=account_type, status=status)
+    filters = "".join(f" AND {c}" for c in clauses)
+    sql = f"""
+        SELECT *, (to_tsvector('simple', name) @@ to_tsquery('simple', %s))::int
+                  + word_similarity(%s, name) AS rank
+        FROM accounts
+        WHERE (to_tsvector('simple', name) @@ to_tsquery('simple', %s) OR %s <%% name){filters}
+        ORDER BY rank DESC, id
+        LIMIT %s
+    """
+    limit = max(1, min(limit or NAME_SEARCH_LIMIT, MAX_PAGE_SIZE))
+    return sql, [tsquery, query, tsquery, query] + params + [limit]
+
+
+def _set_name_search_similarity(cur):
+    """Make <% match at NAME_SEARCH_SIMILARITY for the rest of cur's transaction (SET LOCAL)."""
+    cur.execute("SELECT set_config('pg_trgm.word_similarity_threshold', %s, true)", (str(NAME_SEARCH_SIMILARITY),))
+
+
+def search_account_names(query, account_type=None, status=None, limit=None):
+    """The top limit (default NAME_SEARCH_LIMIT) accounts whose name matches query, best first, each with a rank."""
+    built = _name_search_query(query, account_type, status, limit)
+    if built is None:
+        return []
+    sql, params = built
+    clauses, _ = _account_filters(account_type=account_type, status=status)
+    with get_conn() as conn:
         cur = conn.cursor(cursor_factory=RealDictCursor)
-        cur.execute(f"SELECT * FROM accounts{where} ORDER BY id", params)
+        # Rolled back with the rest of the transaction when the connection is returned.
+        _set_name_search_similarity(cur)
+        _execute(cur, "name_search:" + _filter_shape("accounts", ["name"] + clauses), sql, params)
         return cur.fetchall()
-    finally:
-        conn.close()
 
 
 def update_account(account_id, name, account_type, status):
-    conn = get_conn()
-    try:
+    """Update one account. Returns False, changing nothing, if it does not exist."""
+    with get_conn() as conn:
         cur = conn.cursor()
-        cur.execute(
-            "UPDATE accounts SET name=%s, account_type=%s, status=%s WHERE id=%s",
+        _execute(
+            cur, "update:accounts",
+            "UPDATE accounts SET name=%s, account_type=%s, status=%s WHERE id=%s RETURNING id",
             (name, account_type, status, account_id),
         )
+        if cur.fetchone() is None:
+            conn.rollback()
+            return False
+        row = {"id": account_id, "name": name, "account_type": account_type, "status": status}
+        event = _publish_write(cur, "accounts", "update", row=row)
         conn.commit()
-    finally:
-        conn.close()
+    search_cache.apply(event)
+    # The trigger's event reaches the directory shortly; apply it now for this process's next request.
+    account_directory.apply({"active" if status == "active" else "inactive": [account_id]})
+    return True
 
 
 # ── Payments ─────────────────────────────────────────────────────────
 
+PAYMENTS_STAGE_DDL = """
+    CREATE TEMP TABLE payments_stage (
+        row_no         integer,
+        amount         text,
+        currency       text,
+        debit_account  text,
+        credit_account text,
+        error          text,
+        v_amount       numeric(15,2),
+        v_currency     varchar(3),
+        v_debit        integer,
+        v_credit       integer
+    ) ON COMMIT DROP
+"""
+
+PAYMENTS_VALIDATIONS = [
+    # Format checks. CASE evaluates in order, so the casts only run on
+    # values that already matched their pattern.
+    r"""
+    UPDATE payments_stage SET error = CASE
+        WHEN amount IS NULL OR trim(amount) = '' THEN 'amount is required'
+        WHEN trim(amount) !~ '^[-+]?([0-9]+\.?[0-9]*|\.[0-9]+)$'
+            THEN 'invalid amount ' || quote_literal(amount)
+        WHEN abs(round(trim(amount)::numeric, 2)) >= 1e13
+            THEN 'amount out of range ' || quote_literal(amount)
+        WHEN NULLIF(trim(currency), '') !~ '^[A-Z]{3}$'
+            THEN 'invalid currency ' || quote_literal(currency)
+        WHEN debit_account IS NULL OR trim(debit_account) = '' THEN 'debit_account is required'
+        WHEN trim(debit_account) !~ '^[0-9]{1,9}$'
+            THEN 'invalid debit_account ' || quote_literal(debit_account)
+        WHEN credit_account IS NULL OR trim(credit_account) = '' THEN 'credit_account is required'
+        WHEN trim(credit_account) !~ '^[0-9]{1,9}$'
+            THEN 'invalid credit_account ' || quote_literal(credit_account)
+        WHEN trim(debit_account)::integer = trim(credit_account)::integer
+            THEN 'debit_account and credit_account are the same'
+    END
+    """,
+    """
+    UPDATE payments_stage SET
+        v_amount = round(trim(amount)::numeric, 2),
+        v_currency = COALESCE(NULLIF(trim(currency), ''), 'USD'),
+        v_debit = trim(debit_account)::integer,
+        v_credit = trim(credit_account)::integer
+    WHERE error IS NULL
+    """,
+    """
+    UPDATE payments_stage s SET error = CASE
+        WHEN NOT EXISTS (SELECT 1 FROM accounts a WHERE a.id = s.v_debit)
+            THEN 'debit_account ' || s.v_debit || ' does not exist'
+        WHEN NOT EXISTS (SELECT 1 FROM accounts a WHERE a.id = s.v_debit AND a.status = 'active')
+            THEN 'debit_account ' || s.v_debit || ' is inactive'
+        WHEN NOT EXISTS (SELECT 1 FROM accounts a WHERE a.id = s.v_credit)
+            THEN 'credit_account ' || s.v_credit || ' does not exist'
+        ELSE 'credit_account ' || s.v_credit || ' is inactive'
+    END
+    WHERE s.error IS NULL
+      AND (NOT EXISTS (SELECT 1 FROM accounts a WHERE a.id = s.v_debit AND a.status = 'active')
+           OR NOT EXISTS (SELECT 1 FROM accounts a WHERE a.id = s.v_credit AND a.status = 'active'))
+    """,
+]
+
+PAYMENTS_MERGE = """
+    WITH inserted AS (
+        INSERT INTO payments (amount, currency, debit_account, credit_account)
+        SELECT v_amount, v_currency, v_debit, v_credit
+        FROM payments_stage WHERE error IS NULL ORDER BY row_no
+        RETURNING id
+    )
+    SELECT count(*), min(id) FROM inserted
+"""
+
+
 def insert_payments(rows):
-    """Insert list of dicts with keys: amount, currency, debit_account, credit_account. Returns (inserted, errors)."""
-    inserted, errors = 0, []
-    conn = get_conn()
+    """Insert an iterable of dicts with keys: amount, currency, debit_account, credit_account. Returns (inserted, errors).
+
+    rows may also be a CsvChunks (app.parse_csv(..., chunked=True)), which
+    is validated and loaded in parallel by worker processes.
+    """
+    if isinstance(rows, CsvChunks):
+        return _insert_payments_parallel(rows)
+    with get_conn() as conn:
+        return _bulk_ingest(conn, "payments", *_INGEST["payments"], rows=rows)
+
+
+# Parallel ingest: each chunk of whole CSV records is parsed and validated
+# by a worker process (webapp/ingest.py) against the accounts it read for
+# the upload, and its clean rows are COPYed over that worker's own
+# connection into an unlogged per-upload table. One transaction then moves
+# them into payments in file order, so an upload still commits all or
+# nothing and the rollup triggers run once. Errors are numbered and ordered
+# exactly as in a serial ingest. The worker pool is started on first use and
+# kept for later uploads; queued payment jobs use it too (ingest_upload_chunks).
+INGEST_WORKERS = int(os.environ.get("INGEST_WORKERS", "0"))
+
+_ingest_pool = None
+_ingest_pool_lock = threading.Lock()
+
+
+def ingest_pool_size():
+    return INGEST_WORKERS or os.cpu_count()
+
+
+def _get_ingest_pool():
+    global _ingest_pool
+    with _ingest_pool_lock:
+        if _ingest_pool is None:
+            _ingest_pool = ProcessPoolExecutor(
+                ingest_pool_size(), mp_context=multiprocessing.get_context("spawn"),
+                initializer=init_loader, initargs=(DB_CONFIG,),
+            )
+        return _ingest_pool
+
+
+def _discard_ingest_pool(pool):
+    """Drop a pool that lost a worker; the next upload starts a fresh one."""
+    global _ingest_pool
+    with _ingest_pool_lock:
+        if _ingest_pool is pool:
+            _ingest_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _ordered_map(executor, fn, items, window):
+    """Like executor.map(), but with at most window items in flight, so a large upload is never read ahead."""
+    pending = collections.deque()
+    for args in items:
+        pending.append(executor.submit(fn, *args))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def _create_load_table(conn):
+    """Create and commit an unlogged table for one parallel load. Returns its name."""
+    table = f"payments_load_{uuid.uuid4().hex}"
+    conn.cursor().execute(f"""
+        CREATE UNLOGGED TABLE {table} (
+            chunk_no integer, row_no integer, amount numeric(15,2), currency varchar(3),
+            debit_account integer, credit_account integer
+        )
+    """)
+    conn.commit()
+    return table
+
+
+def _drop_load_table(conn, table):
     try:
-        cur = conn.cursor()
-        for i, row in enumerate(rows, 1):
-            try:
-                cur.execute(
-                    "INSERT INTO payments (amount, currency, debit_account, credit_account) VALUES (%s, %s, %s, %s)",
-                    (row["amount"], row.get("currency", "USD"), row["debit_account"], row["credit_account"]),
-                )
-                inserted += 1
-            except Exception as e:
-                conn.rollback()
-                errors.append(f"Row {i}: {e}")
-                continue
+        conn.cursor().execute(f"DROP TABLE IF EXISTS {table}")
         conn.commit()
-    finally:
-        conn.close()
+    except Exception:
+        conn.rollback()
+
+
+def _load_payment_chunks(table, fieldnames, chunks):
+    """Validate chunks and COPY their clean rows into table through the ingest pool.
+
+    Returns (rows, rejected, [(row_no, error)], first row number of each
+    chunk minus one, bytes read); rows are numbered from 1 across chunks.
+    """
+    pool = _get_ingest_pool()
+    load = (table, fieldnames, MAX_REPORTED_ERRORS)
+    offsets, errors, total, failed, size = [], [], 0, 0, 0
+
+    def tasks():
+        nonlocal size
+        for chunk_no, data in enumerate(chunks):
+            size += len(data)
+            yield load, chunk_no, data
+
+    try:
+        with _timed_query("ingest:payments:parallel_load", f"COPY {table} FROM STDIN"):
+            for count, rejected, chunk_errors in _ordered_map(pool, load_payment_chunk, tasks(), 2 * ingest_pool_size()):
+                errors += [(total + row_no, error) for row_no, error in chunk_errors]
+                del errors[MAX_REPORTED_ERRORS:]
+                offsets.append(total)
+                total += count
+                failed += rejected
+    except BrokenProcessPool:
+        _discard_ingest_pool(pool)
+        raise
+    return total, failed, errors, offsets, size
+
+
+def _merge_payment_load(cur, table, total, failed, errors, offsets):
+    """Insert a load table's rows into payments in file order, inside the caller's transaction.
+
+    Returns (inserted, failed, [(row_no, error)] sorted, cache event).
+    """
+    # Accounts deleted or deactivated since the workers read them are caught here rather than by the FK.
+    exists = """
+        EXISTS (SELECT 1 FROM accounts a WHERE a.id = s.debit_account AND a.status = 'active')
+        AND EXISTS (SELECT 1 FROM accounts a WHERE a.id = s.credit_account AND a.status = 'active')
+    """
+    _execute(cur, "ingest:payments:merge", f"""
+        WITH inserted AS (
+            INSERT INTO payments (amount, currency, debit_account, credit_account)
+            SELECT amount, currency, debit_account, credit_account
+            FROM {table} s WHERE {exists}
+            ORDER BY chunk_no, row_no
+            RETURNING id
+        )
+        SELECT count(*), min(id) FROM inserted
+    """)
+    inserted, min_id = cur.fetchone()
+    event = _publish_write(cur, "payments", "insert", min_id=min_id)
+    if inserted < total - failed:
+        _execute(cur, "ingest:payments:errors", f"""
+            SELECT chunk_no, row_no, CASE
+                WHEN NOT EXISTS (SELECT 1 FROM accounts a WHERE a.id = s.debit_account)
+                    THEN 'debit_account ' || s.debit_account || ' does not exist'
+                WHEN NOT EXISTS (SELECT 1 FROM accounts a WHERE a.id = s.debit_account AND a.status = 'active')
+                    THEN 'debit_account ' || s.debit_account || ' is inactive'
+                WHEN NOT EXISTS (SELECT 1 FROM accounts a WHERE a.id = s.credit_account)
+                    THEN 'credit_account ' || s.credit_account || ' does not exist'
+                ELSE 'credit_account ' || s.credit_account || ' is inactive'
+            END
+            FROM {table} s WHERE NOT ({exists})
+            ORDER BY chunk_no, row_no LIMIT %s
+        """, (MAX_REPORTED_ERRORS,))
+        errors = sorted(errors + [(offsets[c] + r, e) for c, r, e in cur.fetchall()])
+        del errors[MAX_REPORTED_ERRORS:]
+        failed = total - inserted
+    return inserted, failed, errors, event
+
+
+def _insert_payments_parallel(chunks):
+    with get_conn() as conn:
+        try:
+            table = _create_load_table(conn)
+        except Exception as e:
+            conn.rollback()
+            return 0, [f"Upload failed, nothing was inserted: {e}"]
+        try:
+            total, failed, errors, offsets, _ = _load_payment_chunks(table, chunks.fieldnames, chunks)
+            inserted, failed, errors, event = _merge_payment_load(conn.cursor(), table, total, failed, errors, offsets)
+            errors = [f"Row {row_no}: {error}" for row_no, error in errors]
+            if failed > len(errors):
+                errors.append(f"... and {failed - len(errors)} more rejected row(s)")
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            return 0, [f"Upload failed, nothing was inserted: {e}"]
+        finally:
+            _drop_load_table(conn, table)
+    search_cache.apply(event)
     return inserted, errors
 
 
-def search_payments(currency=None, min_amount=None, max_amount=None):
+def _payment_filters(currency=None, min_amount=None, max_amount=None, created_from=None, created_to=None):
+    """created_from and created_to are dates, both inclusive; as constants they let the planner prune partitions."""
     clauses, params = [], []
     if currency:
         clauses.append("currency = %s")
@@ -109,24 +839,979 @@ def search_payments(currency=None, min_amount=None, max_amount=None):
     if max_amount:
         clauses.append("amount <= %s")
         params.append(max_amount)
+    if created_from:
+        clauses.append("created_at >= %s")
+        params.append(created_from)
+    # Every timestamp falls on or before date.max, which has no next day to bound by.
+    if created_to and created_to < datetime.date.max:
+        clauses.append("created_at < %s")
+        params.append(created_to + datetime.timedelta(days=1))
+    return clauses, params
+
+
+def search_payments(currency=None, min_amount=None, max_amount=None, created_from=None, created_to=None,
+                    after=None, limit=None):
+    """Return one page of matching payments as (rows, next_after); pass next_after back as after for the next page."""
+    filters = {"currency": currency, "min_amount": min_amount, "max_amount": max_amount,
+               "created_from": created_from, "created_to": created_to}
+    key_filters = (
+        currency or None,
+        _normalize_amount(min_amount) if min_amount else None,
+        _normalize_amount(max_amount) if max_amount else None,
+        created_from or None,
+        created_to or None,
+    )
+    clauses, params = _payment_filters(**filters)
+    return _cached_page("payments", filters, key_filters, clauses, params, after, limit)
+
+
+def iter_payments(currency=None, min_amount=None, max_amount=None, created_from=None, created_to=None):
+    """Yield every matching payment in id order through a server-side cursor.
+
+    Rows are pulled EXPORT_ITERSIZE at a time, so memory stays flat however
+    large the table is. The pooled connection is held until the generator
+    is exhausted or closed.
+    """
+    clauses, params = _payment_filters(currency, min_amount, max_amount, created_from, created_to)
     where = (" WHERE " + " AND ".join(clauses)) if clauses else ""
-    conn = get_conn()
-    try:
-        cur = conn.cursor(cursor_factory=RealDictCursor)
-        cur.execute(f"SELECT * FROM payments{where} ORDER BY id", params)
-        return cur.fetchall()
-    finally:
-        conn.close()
+    with get_conn() as conn:
+        cur = conn.cursor(name="payments_export", cursor_factory=RealDictCursor)
+        cur.itersize = EXPORT_ITERSIZE
+        _execute(cur, "export:" + _filter_shape("payments", clauses), f"SELECT * FROM payments{where} ORDER BY id", params)
+        yield from cur
 
 
 def update_payment(payment_id, amount, currency, debit_account, credit_account):
-    conn = get_conn()
+    """Update one payment. Raises ValueError, changing nothing, if either account is unknown or inactive
+    or the payment does not exist.
+    """
+    error = payment_account_error(debit_account, credit_account)
+    if error:
+        raise ValueError(error)
+    debit, credit = int(debit_account), int(credit_account)
+    if debit == credit:
+        raise ValueError("debit_account and credit_account are the same")
+    with get_conn() as conn:
+        cur = conn.cursor()
+        # The accounts are checked again here, for changes the directory has not heard of yet.
+        _execute(cur, "update:payments", """
+            UPDATE payments SET amount=%(amount)s, currency=%(currency)s,
+                debit_account=%(debit)s, credit_account=%(credit)s
+            WHERE id=%(id)s
+              AND EXISTS (SELECT 1 FROM accounts a WHERE a.id = %(debit)s AND a.status = 'active')
+              AND EXISTS (SELECT 1 FROM accounts a WHERE a.id = %(credit)s AND a.status = 'active')
+            RETURNING id
+        """, {"id": payment_id, "amount": amount, "currency": currency, "debit": debit, "credit": credit})
+        if cur.fetchone() is None:
+            _execute(cur, "update:payments", "SELECT id, status FROM accounts WHERE id = ANY(%s)", ([debit, credit],))
+            statuses = collections.defaultdict(lambda: "missing", cur.fetchall())
+            conn.rollback()
+            raise ValueError(
+                _account_error("debit_account", debit, statuses)
+                or _account_error("credit_account", credit, statuses)
+                or f"payment {payment_id} does not exist"
+            )
+        row = {"id": payment_id, "amount": amount, "currency": currency,
+               "debit_account": debit_account, "credit_account": credit_account}
+        event = _publish_write(cur, "payments", "update", row=row)
+        conn.commit()
+    search_cache.apply(event)
+
+
+# (stage DDL, columns, validations, merge) for each table that takes uploads.
+_INGEST = {
+    "accounts": (
+        ACCOUNTS_STAGE_DDL, ["name", "account_type", "status"],
+        ACCOUNTS_VALIDATIONS, ACCOUNTS_MERGE,
+    ),
+    "payments": (
+        PAYMENTS_STAGE_DDL, ["amount", "currency", "debit_account", "credit_account"],
+        PAYMENTS_VALIDATIONS, PAYMENTS_MERGE,
+    ),
+}
+
+# CSV columns an upload must have; the others are optional.
+UPLOAD_REQUIRED_COLUMNS = {
+    "accounts": ("name", "account_type"),
+    "payments": ("amount", "debit_account", "credit_account"),
+}
+
+
+# ── Batch updates ────────────────────────────────────────────────────
+#
+# A change names a row id plus the fields to set; omitted fields keep their
+# current value. Changes are checked here, then every valid one is applied
+# by a single UPDATE ... FROM (VALUES ...) in one transaction. A bad change
+# is reported and skipped without affecting the others.
+
+BATCH_UPDATE_MAX_ROWS = 10000
+CENT = Decimal("0.01")
+MAX_AMOUNT = Decimal("1e13")  # numeric(15,2)
+
+
+def _id_value(value, field):
+    if isinstance(value, bool) or not isinstance(value, (int, str)) or not re.fullmatch(r"[0-9]{1,9}", str(value).strip()):
+        raise ValueError(f"invalid {field} {value!r}")
+    return int(value)
+
+
+def _text_value(value, field, max_length):
+    if not isinstance(value, str) or not value.strip():
+        raise ValueError(f"{field} is required")
+    if len(value) > max_length:
+        raise ValueError(f"{field} is longer than {max_length} characters")
+    return value
+
+
+def _status_value(value):
+    if value not in ("active", "inactive"):
+        raise ValueError(f"invalid status {value!r}")
+    return value
+
+
+def _amount_value(value):
     try:
+        amount = Decimal(str(value).strip()) if not isinstance(value, bool) else None
+    except InvalidOperation:
+        amount = None
+    if amount is None or not amount.is_finite():
+        raise ValueError(f"invalid amount {value!r}")
+    # Checked before rounding too, since quantize() fails on very large values.
+    if abs(amount) < MAX_AMOUNT:
+        # Half away from zero, like round() in the ingest validation.
+        amount = amount.quantize(CENT, ROUND_HALF_UP)
+    if abs(amount) >= MAX_AMOUNT:
+        raise ValueError(f"amount out of range {value!r}")
+    return amount
+
+
+def _currency_value(value):
+    if not isinstance(value, str) or not re.fullmatch(r"[A-Z]{3}", value):
+        raise ValueError(f"invalid currency {value!r}")
+    return value
+
+
+ACCOUNT_CHANGE_FIELDS = {
+    "name": lambda v: _text_value(v, "name", 100),
+    "account_type": lambda v: _text_value(v, "account_type", 50),
+    "status": _status_value,
+}
+
+PAYMENT_CHANGE_FIELDS = {
+    "amount": _amount_value,
+    "currency": _currency_value,
+    "debit_account": lambda v: _id_value(v, "debit_account"),
+    "credit_account": lambda v: _id_value(v, "credit_account"),
+}
+
+ACCOUNTS_BATCH_UPDATE = """
+    WITH v (idx, id, name, account_type, status) AS (VALUES %s),
+    updated AS (
+        UPDATE accounts a SET
+            name = COALESCE(v.name, a.name),
+            account_type = COALESCE(v.account_type, a.account_type),
+            status = COALESCE(v.status, a.status)
+        FROM v WHERE a.id = v.id
+        RETURNING v.idx, a.id, a.name, a.account_type, a.status
+    )
+    SELECT v.idx, NULL::text AS error, u.idx IS NOT NULL AS found,
+           v.id, u.name, u.account_type, u.status
+    FROM v LEFT JOIN updated u ON u.idx = v.idx
+"""
+
+PAYMENTS_BATCH_UPDATE = """
+    WITH v (idx, id, amount, currency, debit_account, credit_account) AS (VALUES %s),
+    checked AS (
+        SELECT v.*, CASE
+            -- Against the stored value of an account the change leaves as it is.
+            WHEN COALESCE(v.debit_account, p.debit_account) = COALESCE(v.credit_account, p.credit_account)
+                THEN 'debit_account and credit_account are the same'
+            WHEN v.debit_account IS NOT NULL
+                 AND NOT EXISTS (SELECT 1 FROM accounts a WHERE a.id = v.debit_account)
+                THEN 'debit_account ' || v.debit_account || ' does not exist'
+            WHEN v.debit_account IS NOT NULL
+                 AND NOT EXISTS (SELECT 1 FROM accounts a WHERE a.id = v.debit_account AND a.status = 'active')
+                THEN 'debit_account ' || v.debit_account || ' is inactive'
+            WHEN v.credit_account IS NOT NULL
+                 AND NOT EXISTS (SELECT 1 FROM accounts a WHERE a.id = v.credit_account)
+                THEN 'credit_account ' || v.credit_account || ' does not exist'
+            WHEN v.credit_account IS NOT NULL
+                 AND NOT EXISTS (SELECT 1 FROM accounts a WHERE a.id = v.credit_account AND a.status = 'active')
+                THEN 'credit_account ' || v.credit_account || ' is inactive'
+        END AS error
+        FROM v LEFT JOIN payments p ON p.id = v.id
+    ),
+    updated AS (
+        UPDATE payments p SET
+            amount = COALESCE(c.amount, p.amount),
+            currency = COALESCE(c.currency, p.currency),
+            debit_account = COALESCE(c.debit_account, p.debit_account),
+            credit_account = COALESCE(c.credit_account, p.credit_account)
+        FROM checked c WHERE p.id = c.id AND c.error IS NULL
+        RETURNING c.idx, p.id, p.amount, p.currency, p.debit_account, p.credit_account
+    )
+    SELECT c.idx, c.error, u.idx IS NOT NULL AS found,
+           c.id, u.amount, u.currency, u.debit_account, u.credit_account
+    FROM checked c LEFT JOIN updated u ON u.idx = c.idx
+"""
+
+
+def _parse_change(change, fields):
+    """Return [id, *field values] for one change (None for omitted fields), or raise ValueError."""
+    if not isinstance(change, dict):
+        raise ValueError("change must be an object")
+    row_id = _id_value(change.get("id"), "id")
+    unknown = set(change) - set(fields) - {"id"}
+    if unknown:
+        raise ValueError(f"unknown field(s): {', '.join(sorted(unknown))}")
+    if not set(change) & set(fields):
+        raise ValueError("nothing to update")
+    return [row_id] + [parse(change[f]) if f in change else None for f, parse in fields.items()]
+
+
+def _batch_update(table, changes, fields, sql, template, check=None):
+    """Apply a list of changes. Returns (updated count, one result dict per change in input order).
+
+    check, if given, takes the parsed [idx, id, *fields] rows and returns
+    {idx: error} for those to reject before the UPDATE.
+    """
+    if len(changes) > BATCH_UPDATE_MAX_ROWS:
+        raise ValueError(f"at most {BATCH_UPDATE_MAX_ROWS} changes per request")
+    results = [None] * len(changes)
+    values, seen = [], set()
+    for idx, change in enumerate(changes):
+        try:
+            parsed = _parse_change(change, fields)
+            if parsed[0] in seen:
+                raise ValueError(f"id {parsed[0]} appears more than once")
+        except ValueError as e:
+            row_id = change.get("id") if isinstance(change, dict) else None
+            results[idx] = {"index": idx, "id": row_id, "status": "error", "error": str(e)}
+            continue
+        seen.add(parsed[0])
+        values.append((idx, *parsed))
+    if check and values:
+        rejected = check(values)
+        for idx, error in rejected.items():
+            results[idx] = {"index": idx, "id": changes[idx]["id"], "status": "error", "error": error}
+        values = [v for v in values if v[0] not in rejected]
+
+    updated = []
+    if values:
+        with get_conn() as conn:
+            cur = conn.cursor(cursor_factory=RealDictCursor)
+            with _timed_query(f"batch_update:{table}", sql):
+                rows = execute_values(cur, sql, values, template=template, page_size=len(values), fetch=True)
+            for r in rows:
+                idx, error, found = r.pop("idx"), r.pop("error"), r.pop("found")
+                if error:
+                    results[idx] = {"index": idx, "id": r["id"], "status": "error", "error": error}
+                elif not found:
+                    results[idx] = {"index": idx, "id": r["id"], "status": "not_found"}
+                else:
+                    updated.append(r)
+                    results[idx] = {"index": idx, "id": r["id"], "status": "updated", "row": dict(r)}
+            events = _publish_writes(cur, table, updated)
+            conn.commit()
+        for event in events:
+            search_cache.apply(event)
+    return len(updated), results
+
+
+def _check_payment_accounts(values):
+    """_batch_update() check: reject changes naming an unknown or inactive account, mostly without a query."""
+    ids = {v[i] for v in values for i in (4, 5) if v[i] is not None}
+    statuses = _account_statuses(ids)
+    errors = {}
+    for idx, _, _, _, debit, credit in values:
+        error = ((debit is not None and _account_error("debit_account", debit, statuses))
+                 or (credit is not None and _account_error("credit_account", credit, statuses)))
+        if error:
+            errors[idx] = error
+    return errors
+
+
+def update_accounts(changes):
+    """Batch-update accounts from dicts with an id and any of: name, account_type, status."""
+    updated, results = _batch_update(
+        "accounts", changes, ACCOUNT_CHANGE_FIELDS, ACCOUNTS_BATCH_UPDATE,
+        "(%s, %s, %s::text, %s::text, %s::text)",
+    )
+    rows = [r["row"] for r in results if r["status"] == "updated"]
+    if rows:
+        account_directory.apply({
+            "active": [r["id"] for r in rows if r["status"] == "active"],
+            "inactive": [r["id"] for r in rows if r["status"] != "active"],
+        })
+    return updated, results
+
+
+def update_payments(changes):
+    """Batch-update payments from dicts with an id and any of: amount, currency, debit_account, credit_account."""
+    return _batch_update(
+        "payments", changes, PAYMENT_CHANGE_FIELDS, PAYMENTS_BATCH_UPDATE,
+        "(%s, %s, %s::numeric, %s::text, %s::integer, %s::integer)", check=_check_payment_accounts,
+    )
+
+
+# ── Payment creation ─────────────────────────────────────────────────
+#
+# Payments are checked in the request thread (format, then accounts through
+# the directory) and the valid ones go to payment_writer, which inserts the
+# payments of every request queued meanwhile in one transaction. A payment
+# with an idempotency_key claims it in payment_requests
+# (db/migrations/007_payment_requests.sql) in that same transaction; a
+# repeated key returns the payment first created with it.
+
+CREATE_PAYMENTS_MAX_ROWS = 1000
+PAYMENT_WRITER_MAX_ROWS = int(os.environ.get("PAYMENT_WRITER_MAX_ROWS", "5000"))
+PAYMENT_WRITER_WAIT = float(os.environ.get("PAYMENT_WRITER_WAIT_MS", "2")) / 1000
+
+NEW_PAYMENT_FIELDS = ("amount", "currency", "debit_account", "credit_account", "idempotency_key")
+
+PAYMENT_REQUESTS_CLAIM = """
+    INSERT INTO payment_requests (submitted_by, idempotency_key, fingerprint, payment_id, payment_created_at)
+    VALUES %s
+    ON CONFLICT DO NOTHING
+    RETURNING submitted_by, idempotency_key
+"""
+
+PAYMENTS_CREATE = """
+    WITH v (id, amount, currency, debit_account, credit_account) AS (VALUES %s)
+    INSERT INTO payments (id, amount, currency, debit_account, credit_account, created_at)
+    SELECT v.id, v.amount, v.currency, v.debit_account, v.credit_account, now()
+    FROM v
+    WHERE EXISTS (SELECT 1 FROM accounts a WHERE a.id = v.debit_account AND a.status = 'active')
+      AND EXISTS (SELECT 1 FROM accounts a WHERE a.id = v.credit_account AND a.status = 'active')
+    RETURNING id
+"""
+
+PAYMENT_REQUESTS_LOOKUP = """
+    SELECT r.submitted_by, r.idempotency_key, r.fingerprint,
+           p.id, p.amount, p.currency, p.debit_account, p.credit_account, p.created_at
+    FROM payment_requests r
+    JOIN payments p ON p.id = r.payment_id AND p.created_at = r.payment_created_at
+    WHERE (r.submitted_by, r.idempotency_key) IN (SELECT * FROM unnest(%s::text[], %s::text[]))
+"""
+
+
+def _parse_new_payment(payment):
+    """Return the checked fields of one new payment, plus its fingerprint, or raise ValueError."""
+    if not isinstance(payment, dict):
+        raise ValueError("payment must be an object")
+    unknown = set(payment) - set(NEW_PAYMENT_FIELDS)
+    if unknown:
+        raise ValueError(f"unknown field(s): {', '.join(sorted(unknown))}")
+    for field in ("amount", "debit_account", "credit_account"):
+        if payment.get(field) in (None, ""):
+            raise ValueError(f"{field} is required")
+    item = {
+        "amount": _amount_value(payment["amount"]),
+        "currency": _currency_value(payment["currency"]) if payment.get("currency") not in (None, "") else "USD",
+        "debit_account": _id_value(payment["debit_account"], "debit_account"),
+        "credit_account": _id_value(payment["credit_account"], "credit_account"),
+        "idempotency_key": None,
+    }
+    if item["debit_account"] == item["credit_account"]:
+        raise ValueError("debit_account and credit_account are the same")
+    if payment.get("idempotency_key") is not None:
+        item["idempotency_key"] = _text_value(payment["idempotency_key"], "idempotency_key", 255)
+    item["fingerprint"] = hashlib.sha256(
+        "|".join(str(item[f]) for f in PAYMENT_CHANGE_FIELDS).encode()
+    ).hexdigest()
+    return item
+
+
+def _write_payments(requests):
+    """payment_writer's write(): create the payments of a group of requests in one transaction.
+
+    Returns, per request, one result dict per item: created, duplicate
+    (with the payment the key was first used for), conflict (the key was
+    used for a different payment) or error.
+    """
+    items = [item for request in requests for item in request]
+    results = [None] * len(items)
+    # The first use of a key in the group claims it; later ones are duplicates of it.
+    claimant = {}
+    for i, item in enumerate(items):
+        if item["idempotency_key"] is not None:
+            claimant.setdefault((item["submitted_by"], item["idempotency_key"]), i)
+    fresh = [i for i, item in enumerate(items)
+             if item["idempotency_key"] is None or claimant[item["submitted_by"], item["idempotency_key"]] == i]
+
+    with get_conn() as conn:
         cur = conn.cursor()
-        cur.execute(
-            "UPDATE payments SET amount=%s, currency=%s, debit_account=%s, credit_account=%s WHERE id=%s",
-            (amount, currency, debit_account, credit_account, payment_id),
+        # Ids are drawn up front so each payment's id is known before it is inserted.
+        _execute(
+            cur, "create:payments:ids",
+            "SELECT now()::timestamp, ARRAY(SELECT nextval('payments_id_seq') FROM generate_series(1, %s))",
+            (len(fresh),),
         )
+        now, ids = cur.fetchone()
+        id_of = dict(zip(fresh, ids))
+
+        keyed = [i for i in fresh if items[i]["idempotency_key"] is not None]
+        claimed = set()
+        if keyed:
+            with _timed_query("create:payments:claim", PAYMENT_REQUESTS_CLAIM):
+                claimed = set(execute_values(cur, PAYMENT_REQUESTS_CLAIM, [
+                    (items[i]["submitted_by"], items[i]["idempotency_key"], items[i]["fingerprint"], id_of[i], now)
+                    for i in keyed
+                ], page_size=len(keyed), fetch=True))
+        new = [i for i in fresh
+               if items[i]["idempotency_key"] is None
+               or (items[i]["submitted_by"], items[i]["idempotency_key"]) in claimed]
+
+        inserted = set()
+        if new:
+            with _timed_query("create:payments:insert", PAYMENTS_CREATE):
+                inserted = {r[0] for r in execute_values(cur, PAYMENTS_CREATE, [
+                    (id_of[i], items[i]["amount"], items[i]["currency"],
+                     items[i]["debit_account"], items[i]["credit_account"])
+                    for i in new
+                ], template="(%s, %s::numeric, %s::text, %s::integer, %s::integer)", page_size=len(new), fetch=True)}
+        for i in new:
+            if id_of[i] in inserted:
+                payment = {f: items[i][f] for f in PAYMENT_CHANGE_FIELDS}
+                results[i] = {"status": "created", "payment": dict(payment, id=id_of[i], created_at=now)}
+
+        # An account deactivated or deleted since the request's own check;
+        # release the key so the payment can be retried once it is fixed.
+        rejected = [i for i in new if id_of[i] not in inserted]
+        if rejected:
+            account_ids = list({items[i][f] for i in rejected for f in ("debit_account", "credit_account")})
+            _execute(cur, "create:payments:accounts", "SELECT id, status FROM accounts WHERE id = ANY(%s)", (account_ids,))
+            statuses = dict(cur.fetchall())
+            statuses.update((a, "missing") for a in account_ids if a not in statuses)
+            for i in rejected:
+                error = (_account_error("debit_account", items[i]["debit_account"], statuses)
+                         or _account_error("credit_account", items[i]["credit_account"], statuses))
+                results[i] = {"status": "error", "error": error}
+            released = [items[i] for i in rejected if items[i]["idempotency_key"] is not None]
+            if released:
+                _execute(
+                    cur, "create:payments:release",
+                    "DELETE FROM payment_requests WHERE (submitted_by, idempotency_key) IN "
+                    "(SELECT * FROM unnest(%s::text[], %s::text[]))",
+                    ([item["submitted_by"] for item in released], [item["idempotency_key"] for item in released]),
+                )
+
+        repeats = [i for i, item in enumerate(items) if item["idempotency_key"] is not None and results[i] is None]
+        if repeats:
+            _execute(cur, "create:payments:lookup", PAYMENT_REQUESTS_LOOKUP, (
+                [items[i]["submitted_by"] for i in repeats], [items[i]["idempotency_key"] for i in repeats],
+            ))
+            found = {(r[0], r[1]): r for r in cur.fetchall()}
+            for i in repeats:
+                key = (items[i]["submitted_by"], items[i]["idempotency_key"])
+                if key not in found:
+                    # Its claimant in this group was rejected.
+                    results[i] = results[claimant[key]]
+                elif found[key][2] != items[i]["fingerprint"]:
+                    results[i] = {"status": "conflict",
+                                  "error": f"idempotency_key {key[1]!r} was already used for a different payment"}
+                else:
+                    payment = dict(zip(("id", *PAYMENT_CHANGE_FIELDS, "created_at"), found[key][3:]))
+                    results[i] = {"status": "duplicate", "payment": payment}
+
+        event = _publish_write(cur, "payments", "insert", min_id=min(inserted)) if inserted else None
         conn.commit()
-    finally:
-        conn.close()
+    if event:
+        search_cache.apply(event)
+
+    grouped, start = [], 0
+    for request in requests:
+        grouped.append(results[start:start + len(request)])
+        start += len(request)
+    return grouped
+
+
+payment_writer = GroupCommitWriter(
+    _write_payments, max_items=PAYMENT_WRITER_MAX_ROWS, max_wait=PAYMENT_WRITER_WAIT, name="payment-writer",
+)
+
+
+def create_payments(payments, submitted_by):
+    """Create payments from dicts with amount, debit_account, credit_account, and optionally currency
+    (default USD) and idempotency_key. Returns (created count, one result dict per payment in input order).
+
+    Keys are scoped to submitted_by. A payment that repeats a key is not
+    inserted again; its result is the earlier payment, with status duplicate.
+    """
+    if len(payments) > CREATE_PAYMENTS_MAX_ROWS:
+        raise ValueError(f"at most {CREATE_PAYMENTS_MAX_ROWS} payments per request")
+    results = [None] * len(payments)
+    parsed = []
+    for idx, payment in enumerate(payments):
+        try:
+            parsed.append((idx, _parse_new_payment(payment)))
+        except ValueError as e:
+            results[idx] = {"index": idx, "status": "error", "error": str(e)}
+
+    statuses = _account_statuses({item[f] for _, item in parsed for f in ("debit_account", "credit_account")})
+    accepted = []
+    for idx, item in parsed:
+        error = (_account_error("debit_account", item["debit_account"], statuses)
+                 or _account_error("credit_account", item["credit_account"], statuses))
+        if error:
+            results[idx] = {"index": idx, "status": "error", "error": error}
+        else:
+            accepted.append((idx, dict(item, submitted_by=submitted_by)))
+
+    if accepted:
+        written = payment_writer.submit([item for _, item in accepted])
+        for (idx, _), result in zip(accepted, written):
+            results[idx] = dict(result, index=idx)
+    return sum(r["status"] == "created" for r in results), results
+
+
+def payment_writer_stats():
+    return payment_writer.stats()
+
+
+# ── Dashboard ────────────────────────────────────────────────────────
+#
+# Read from the rollup tables maintained by triggers on payments
+# (db/migrations/002_payment_rollups.sql), so the cost does not grow with
+# the number of payments.
+
+DASHBOARD_DAYS = 30
+DASHBOARD_TOP_ACCOUNTS = 10
+
+
+def _top_accounts_sql(side):
+    return f"""
+        SELECT c.currency, t.account_id, a.name, t.{side}_count AS payment_count, t.{side}_total AS total_amount
+        FROM (SELECT DISTINCT currency FROM payment_daily_totals) c
+        CROSS JOIN LATERAL (
+            SELECT account_id, {side}_count, {side}_total
+            FROM payment_account_totals
+            WHERE currency = c.currency AND {side}_count > 0
+            ORDER BY {side}_total DESC
+            LIMIT %s
+        ) t
+        JOIN accounts a ON a.id = t.account_id
+        ORDER BY c.currency, t.{side}_total DESC
+    """
+
+
+def dashboard_stats(days=DASHBOARD_DAYS, top=DASHBOARD_TOP_ACCOUNTS):
+    """Payment volume by currency, by day for the last ``days`` days, and the top debit/credit accounts."""
+    days = max(1, min(days, 366))
+    top = max(1, min(top, 100))
+    with get_conn() as conn:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        _execute(cur, "dashboard:by_currency", """
+            SELECT currency, sum(payment_count)::bigint AS payment_count, sum(total_amount) AS total_amount
+            FROM payment_daily_totals
+            GROUP BY currency HAVING sum(payment_count) > 0
+            ORDER BY currency
+        """)
+        by_currency = cur.fetchall()
+        _execute(cur, "dashboard:by_day", """
+            SELECT day, currency, payment_count, total_amount
+            FROM payment_daily_totals
+            WHERE day > current_date - %s AND payment_count > 0
+            ORDER BY day DESC, currency
+        """, (days,))
+        by_day = cur.fetchall()
+        _execute(cur, "dashboard:top_debit", _top_accounts_sql("debit"), (top,))
+        top_debit = cur.fetchall()
+        _execute(cur, "dashboard:top_credit", _top_accounts_sql("credit"), (top,))
+        top_credit = cur.fetchall()
+    return {"by_currency": by_currency, "by_day": by_day, "top_debit": top_debit, "top_credit": top_credit}
+
+
+def account_payment_totals(account_id):
+    """Debit and credit count/volume per currency for one account."""
+    with get_conn() as conn:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        _execute(cur, "dashboard:account", """
+            SELECT currency, debit_count, debit_total, credit_count, credit_total, balance
+            FROM payment_account_totals
+            WHERE account_id = %s AND (debit_count > 0 OR credit_count > 0)
+            ORDER BY currency
+        """, (account_id,))
+        return cur.fetchall()
+
+
+# ── Balances ─────────────────────────────────────────────────────────
+#
+# An account's balance in a currency is its credit volume less its debit
+# volume, the balance column of payment_account_totals
+# (db/migrations/008_account_balances.sql). The payments triggers keep it
+# current within each write's transaction, so a read is one index lookup
+# per account however many payments it has.
+
+def account_balances(account_ids):
+    """{account_id: {currency: balance}} for the given accounts; accounts without payments are left out."""
+    balances = {}
+    if not account_ids:
+        return balances
+    with get_conn() as conn:
+        cur = conn.cursor()
+        _execute(cur, "balances:accounts", """
+            SELECT account_id, currency, balance
+            FROM payment_account_totals
+            WHERE account_id = ANY(%s) AND (debit_count > 0 OR credit_count > 0)
+            ORDER BY account_id, currency
+        """, (list(account_ids),))
+        for account_id, currency, balance in cur:
+            balances.setdefault(account_id, {})[currency] = balance
+    return balances
+
+
+def account_balance(account_id):
+    """{currency: balance} for one account, or None if it does not exist."""
+    if _account_statuses({account_id})[account_id] == "missing":
+        return None
+    return account_balances([account_id]).get(account_id, {})
+
+
+# ── Upload jobs ──────────────────────────────────────────────────────
+#
+# Large uploads are stored in upload_jobs/upload_job_chunks and ingested by
+# webapp/upload_worker.py (db/migrations/003_upload_jobs.sql). A worker owns
+# a job while its row says status = 'running' with that worker's name and
+# attempt number; every batch locks the row, checks that, and commits its
+# rows together with the new progress, so rows are never ingested twice.
+
+UPLOAD_NOTIFY_CHANNEL = "upload_jobs"
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+# A running job whose heartbeat is older than this is handed to another worker.
+UPLOAD_JOB_STALE_SECONDS = float(os.environ.get("UPLOAD_JOB_STALE_SECONDS", "120"))
+UPLOAD_JOB_MAX_ATTEMPTS = int(os.environ.get("UPLOAD_JOB_MAX_ATTEMPTS", "3"))
+
+UPLOAD_JOB_COLUMNS = """
+    id, kind, status, filename, size_bytes, rows_done, rows_inserted, rows_failed,
+    errors, error, attempts, created_at, started_at, finished_at
+"""
+
+
+def enqueue_upload(kind, stream, filename, submitted_by):
+    """Store an uploaded file as a queued job and wake the workers. Returns the job id."""
+    with get_conn() as conn:
+        try:
+            cur = conn.cursor()
+            _execute(cur, "upload_jobs:enqueue", """
+                INSERT INTO upload_jobs (kind, filename, submitted_by)
+                VALUES (%s, %s, %s) RETURNING id
+            """, (kind, filename[:255], submitted_by))
+            job_id = cur.fetchone()[0]
+            size = seq = 0
+            while True:
+                chunk = stream.read(UPLOAD_CHUNK_BYTES)
+                if not chunk:
+                    break
+                _execute(
+                    cur, "upload_jobs:enqueue",
+                    "INSERT INTO upload_job_chunks (job_id, seq, data) VALUES (%s, %s, %s)",
+                    (job_id, seq, chunk),
+                )
+                size += len(chunk)
+                seq += 1
+            _execute(cur, "upload_jobs:enqueue", "UPDATE upload_jobs SET size_bytes = %s WHERE id = %s", (size, job_id))
+            cur.execute("SELECT pg_notify(%s, %s)", (UPLOAD_NOTIFY_CHANNEL, str(job_id)))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    return job_id
+
+
+def _job_report(job):
+    if job["rows_failed"] > len(job["errors"]):
+        job["errors"].append(f"... and {job['rows_failed'] - len(job['errors'])} more rejected row(s)")
+    return job
+
+
+def upload_job(job_id, submitted_by):
+    """Status and progress of one of submitted_by's upload jobs, or None."""
+    with get_conn() as conn:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        _execute(
+            cur, "upload_jobs:status",
+            f"SELECT {UPLOAD_JOB_COLUMNS} FROM upload_jobs WHERE id = %s AND submitted_by = %s",
+            (job_id, submitted_by),
+        )
+        job = cur.fetchone()
+    return _job_report(job) if job else None
+
+
+def recent_upload_jobs(submitted_by, limit=10):
+    """submitted_by's latest upload jobs, newest first, without their error lists."""
+    with get_conn() as conn:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        _execute(cur, "upload_jobs:recent", f"""
+            SELECT {UPLOAD_JOB_COLUMNS} FROM upload_jobs
+            WHERE submitted_by = %s ORDER BY id DESC LIMIT %s
+        """, (submitted_by, limit))
+        jobs = cur.fetchall()
+    for job in jobs:
+        del job["errors"]
+    return jobs
+
+
+def claim_upload_job(worker):
+    """Take the oldest queued job, or a running one whose worker stopped heartbeating.
+
+    Returns {id, kind, rows_done, bytes_done, attempts, worker} or None.
+    Jobs that have already been tried UPLOAD_JOB_MAX_ATTEMPTS times are
+    failed instead.
+    """
+    with get_conn() as conn:
+        try:
+            cur = conn.cursor(cursor_factory=RealDictCursor)
+            _execute(cur, "upload_jobs:claim", """
+                WITH abandoned AS (
+                    UPDATE upload_jobs SET
+                        status = 'failed', worker = NULL, finished_at = now(),
+                        error = 'worker stopped responding after ' || attempts || ' attempt(s)'
+                    WHERE id IN (
+                        SELECT id FROM upload_jobs
+                        WHERE status = 'running' AND attempts >= %s
+                          AND heartbeat_at < now() - %s * interval '1 second'
+                        FOR UPDATE SKIP LOCKED
+                    )
+                    RETURNING id
+                )
+                DELETE FROM upload_job_chunks WHERE job_id IN (SELECT id FROM abandoned)
+            """, (UPLOAD_JOB_MAX_ATTEMPTS, UPLOAD_JOB_STALE_SECONDS))
+            _execute(cur, "upload_jobs:claim", """
+                UPDATE upload_jobs j SET
+                    status = 'running', worker = %s, attempts = j.attempts + 1,
+                    started_at = COALESCE(j.started_at, now()), heartbeat_at = now()
+                WHERE j.id = (
+                    SELECT id FROM upload_jobs
+                    WHERE status = 'queued'
+                       OR (status = 'running' AND attempts < %s
+                           AND heartbeat_at < now() - %s * interval '1 second')
+                    ORDER BY id
+                    FOR UPDATE SKIP LOCKED
+                    LIMIT 1
+                )
+                RETURNING j.id, j.kind, j.rows_done, j.bytes_done, j.attempts, j.worker
+            """, (worker, UPLOAD_JOB_MAX_ATTEMPTS, UPLOAD_JOB_STALE_SECONDS))
+            job = cur.fetchone()
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    return job
+
+
+def iter_upload_job_data(job_id):
+    """Yield a job's stored file in chunks, one short query per chunk."""
+    seq = 0
+    while True:
+        with get_conn() as conn:
+            cur = conn.cursor()
+            _execute(
+                cur, "upload_jobs:read",
+                "SELECT data FROM upload_job_chunks WHERE job_id = %s AND seq = %s",
+                (job_id, seq),
+            )
+            row = cur.fetchone()
+        if row is None:
+            return
+        yield bytes(row[0])
+        seq += 1
+
+
+_OWNED_JOB = "id = %(id)s AND worker = %(worker)s AND attempts = %(attempts)s AND status = 'running'"
+
+
+def ingest_upload_batch(job, rows):
+    """Ingest the next batch of a claimed job's rows and record the progress in the same transaction.
+
+    Returns the number of rows consumed, or None if the job is no longer
+    owned by this worker (it was taken over after a missed heartbeat).
+    """
+    with get_conn() as conn:
+        try:
+            cur = conn.cursor()
+            _execute(
+                cur, "upload_jobs:progress",
+                f"SELECT rows_done, jsonb_array_length(errors) FROM upload_jobs WHERE {_OWNED_JOB} FOR UPDATE",
+                job,
+            )
+            owned = cur.fetchone()
+            if owned is None:
+                conn.rollback()
+                return None
+            rows_done, reported = owned
+            staged, inserted, failed, errors, event = _stage_and_merge(
+                cur, job["kind"], *_INGEST[job["kind"]], rows=rows, row_offset=rows_done,
+            )
+            # Progress is now counted in rows only; a later resume skips rows, not bytes.
+            _execute(cur, "upload_jobs:progress", """
+                UPDATE upload_jobs SET
+                    rows_done = rows_done + %s, rows_inserted = rows_inserted + %s,
+                    rows_failed = rows_failed + %s, errors = errors || %s::jsonb,
+                    bytes_done = 0, heartbeat_at = now()
+                WHERE id = %s
+            """, (staged, inserted, failed, json.dumps(errors[:max(0, MAX_REPORTED_ERRORS - reported)]), job["id"]))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    search_cache.apply(event)
+    return staged
+
+
+def ingest_upload_chunks(job, fieldnames, chunks):
+    """ingest_upload_batch() for a payment job read as CSV chunks, validated and loaded by the ingest pool.
+
+    The chunks must continue the file from the job's bytes_done, which
+    advances past them with the rest of the progress, so a resumed job
+    skips bytes rather than re-reading rows. Returns the number of rows
+    consumed, or None if the job is no longer owned by this worker.
+    """
+    with get_conn() as conn:
+        table = _create_load_table(conn)
+        try:
+            total, failed, errors, offsets, size = _load_payment_chunks(table, fieldnames, chunks)
+            cur = conn.cursor()
+            _execute(
+                cur, "upload_jobs:progress",
+                f"SELECT rows_done, jsonb_array_length(errors) FROM upload_jobs WHERE {_OWNED_JOB} FOR UPDATE",
+                job,
+            )
+            owned = cur.fetchone()
+            if owned is None:
+                conn.rollback()
+                return None
+            rows_done, reported = owned
+            inserted, failed, errors, event = _merge_payment_load(cur, table, total, failed, errors, offsets)
+            errors = [f"Row {rows_done + row_no}: {error}" for row_no, error in errors]
+            _execute(cur, "upload_jobs:progress", """
+                UPDATE upload_jobs SET
+                    rows_done = rows_done + %s, rows_inserted = rows_inserted + %s,
+                    rows_failed = rows_failed + %s, errors = errors || %s::jsonb,
+                    bytes_done = bytes_done + %s, heartbeat_at = now()
+                WHERE id = %s
+            """, (total, inserted, failed, json.dumps(errors[:max(0, MAX_REPORTED_ERRORS - reported)]), size, job["id"]))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            _drop_load_table(conn, table)
+    search_cache.apply(event)
+    return total
+
+
+def finish_upload_job(job, error=None):
+    """Mark a claimed job done (or failed with error) and drop its stored file."""
+    with get_conn() as conn:
+        try:
+            cur = conn.cursor()
+            _execute(cur, "upload_jobs:finish", f"""
+                UPDATE upload_jobs SET
+                    status = %(status)s, error = %(error)s, worker = NULL, finished_at = now()
+                WHERE {_OWNED_JOB}
+                RETURNING id
+            """, dict(job, status="failed" if error else "done", error=error))
+            if cur.fetchone():
+                _execute(cur, "upload_jobs:finish", "DELETE FROM upload_job_chunks WHERE job_id = %s", (job["id"],))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+
+def requeue_upload_job(job, error=None):
+    """Give a claimed job back to the queue.
+
+    With an error the attempt counts towards UPLOAD_JOB_MAX_ATTEMPTS, and the
+    job fails once they are used up; without one (the worker is shutting
+    down) it does not.
+    """
+    if error and job["attempts"] >= UPLOAD_JOB_MAX_ATTEMPTS:
+        return finish_upload_job(job, f"{error} (gave up after {job['attempts']} attempt(s))")
+    with get_conn() as conn:
+        try:
+            cur = conn.cursor()
+            _execute(cur, "upload_jobs:requeue", f"""
+                UPDATE upload_jobs SET
+                    status = 'queued', error = %(error)s, worker = NULL,
+                    attempts = attempts - %(refund)s
+                WHERE {_OWNED_JOB}
+            """, dict(job, error=error, refund=0 if error else 1))
+            cur.execute("SELECT pg_notify(%s, %s)", (UPLOAD_NOTIFY_CHANNEL, str(job["id"])))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+
+# ── Login sessions ───────────────────────────────────────────────────
+#
+# The Keycloak tokens of logged-in users, keyed by the random id that is all
+# the session cookie carries (db/migrations/011_auth_sessions.sql).
+
+def _auth_session_expiry(tokens):
+    """The session is usable until both its access and refresh tokens have expired."""
+    return datetime.datetime.fromtimestamp(
+        max(tokens["expires_at"], tokens.get("refresh_expires_at") or 0), datetime.timezone.utc,
+    ).replace(tzinfo=None)
+
+
+def create_auth_session(username, tokens):
+    """Store a login's tokens under a new session id and return the id."""
+    session_id = secrets.token_urlsafe(32)
+    with get_conn() as conn:
+        try:
+            cur = conn.cursor()
+            _execute(
+                cur, "auth_sessions:expire",
+                "DELETE FROM auth_sessions WHERE expires_at < now() AT TIME ZONE 'UTC'",
+            )
+            _execute(cur, "auth_sessions:create", """
+                INSERT INTO auth_sessions (id, username, tokens, expires_at) VALUES (%s, %s, %s, %s)
+            """, (session_id, username, json.dumps(tokens), _auth_session_expiry(tokens)))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    return session_id
+
+
+def auth_session_tokens(session_id, username):
+    """The tokens stored for username's session, or None if it is unknown or expired."""
+    with get_conn() as conn:
+        cur = conn.cursor()
+        _execute(cur, "auth_sessions:get", """
+            SELECT tokens FROM auth_sessions
+            WHERE id = %s AND username = %s AND expires_at >= now() AT TIME ZONE 'UTC'
+        """, (session_id, username))
+        row = cur.fetchone()
+    return row[0] if row else None
+
+
+def save_auth_session_tokens(session_id, tokens):
+    """Replace a session's tokens after a refresh."""
+    with get_conn() as conn:
+        try:
+            cur = conn.cursor()
+            _execute(
+                cur, "auth_sessions:refresh",
+                "UPDATE auth_sessions SET tokens = %s, expires_at = %s WHERE id = %s",
+                (json.dumps(tokens), _auth_session_expiry(tokens), session_id),
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+
+def delete_auth_session(session_id):
+    """Forget a session's tokens, e.g. once Keycloak no longer accepts them."""
+    with get_conn() as conn:
+        try:
+            cur = conn.cursor()
+            _execute(cur, "auth_sessions:delete", "DELETE FROM auth_sessions WHERE id = %s", (session_id,))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
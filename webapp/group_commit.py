@@ -0,0 +1,78 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+
+class GroupCommitWriter:
+    """Funnel concurrent write requests through one thread that commits them together.
+
+    ``submit(items)`` queues a request and blocks until the group holding it
+    is written. The writer thread takes whatever has queued up, waiting up to
+    ``max_wait`` seconds for more while the group is under ``max_items``
+    items, and passes the group's requests to ``write(requests)`` in one call.
+    That call returns one result per request. If it raises, each request of
+    the group is retried on its own, so one bad request fails nobody else.
+    """
+
+    def __init__(self, write, max_items=1000, max_wait=0.002, name="group-commit"):
+        self.write = write
+        self.max_items = max_items
+        self.max_wait = max_wait
+        self.name = name
+        self._queue = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stats = {"requests": 0, "items": 0, "groups": 0, "retries": 0}
+
+    def _start(self):
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                    self._thread.start()
+
+    def submit(self, items, timeout=None):
+        """Queue one request (a list of items) and return write()'s result for it, re-raising its error."""
+        future = Future()
+        self._queue.put((items, future))
+        self._start()
+        return future.result(timeout)
+
+    def _run(self):
+        while True:
+            group = [self._queue.get()]
+            count = len(group[0][0])
+            deadline = time.monotonic() + self.max_wait
+            while count < self.max_items:
+                remaining = deadline - time.monotonic()
+                try:
+                    entry = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                group.append(entry)
+                count += len(entry[0])
+            with self._lock:
+                self._stats["groups"] += 1
+                self._stats["requests"] += len(group)
+                self._stats["items"] += count
+            self._commit(group)
+
+    def _commit(self, group):
+        try:
+            results = self.write([items for items, _ in group])
+        except Exception as e:
+            if len(group) == 1:
+                group[0][1].set_exception(e)
+                return
+            with self._lock:
+                self._stats["retries"] += 1
+            for entry in group:
+                self._commit([entry])
+            return
+        for (_, future), result in zip(group, results):
+            future.set_result(result)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, queued=self._queue.qsize())
@@ -0,0 +1,30 @@
+"""Gunicorn settings for serving the webapp outside the Flask debug server.
+
+    .venv/bin/gunicorn -c webapp/gunicorn.conf.py app:app
+
+Each worker process runs a pool of threads, so a request blocked on
+Postgres or Keycloak only holds its own thread. Every worker builds its own
+DB connection pool after the fork; it is sized to the thread count unless
+DB_POOL_MAX is set explicitly.
+"""
+import multiprocessing
+import os
+
+chdir = os.path.dirname(os.path.abspath(__file__))
+bind = f"0.0.0.0:{os.environ.get('WEBAPP_PORT', '9777')}"
+
+workers = int(os.environ.get("WEBAPP_WORKERS", min(multiprocessing.cpu_count() * 2 + 1, 8)))
+worker_class = "gthread"
+threads = int(os.environ.get("WEBAPP_THREADS", "8"))
+timeout = int(os.environ.get("WEBAPP_TIMEOUT", "120"))
+graceful_timeout = 30
+keepalive = 5
+
+# Recycle workers now and then so slow leaks cannot accumulate.
+max_requests = 10000
+max_requests_jitter = 1000
+
+accesslog = "-"
+errorlog = "-"
+
+os.environ.setdefault("DB_POOL_MAX", str(threads))
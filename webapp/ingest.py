@@ -0,0 +1,422 @@
+"""Chunked CSV parsing and payment validation for the parallel ingest path.
+
+A CSV upload is cut into chunks of whole records (split_csv), and each
+chunk is parsed, validated and COPYed by a worker process over its own
+connection (load_payment_chunk). Nothing here imports db.py, so the spawned
+workers start quickly; db.py keeps the pool for the life of the process,
+drives it for direct uploads and queued payment jobs alike, and does the
+final merge.
+
+The checks and error messages match PAYMENTS_VALIDATIONS in db.py, so an
+upload reports the same errors whichever path ingested it. With NumPy
+installed a chunk is validated column by column (validate_payment_columns);
+without it, row by row.
+"""
+import collections
+import csv
+import io
+import itertools
+import re
+import signal
+from decimal import ROUND_HALF_UP, Decimal
+
+import psycopg2
+
+try:
+    import numpy as np
+except ImportError:  # optional; chunks are then validated row by row
+    np = None
+
+INGEST_CHUNK_BYTES = 4 * 1024 * 1024
+MIN_CHUNK_BYTES = 256 * 1024
+
+AMOUNT_RE = re.compile(r"[-+]?([0-9]+\.?[0-9]*|\.[0-9]+)")
+CURRENCY_RE = re.compile(r"[A-Z]{3}")
+ACCOUNT_ID_RE = re.compile(r"[0-9]{1,9}")
+CENT = Decimal("0.01")
+MAX_AMOUNT = Decimal("1e13")  # numeric(15,2)
+
+
+class AccountIds(frozenset):
+    """The preloaded active account ids, with a sorted array for np.isin() built on first use.
+
+    inactive holds the ids of the other accounts, which only decides the
+    error message.
+    """
+
+    _array = None
+
+    def __new__(cls, active=(), inactive=()):
+        self = super().__new__(cls, active)
+        self.inactive = frozenset(inactive)
+        return self
+
+    @property
+    def array(self):
+        if self._array is None:
+            self._array = np.array(sorted(self), dtype=np.int64)
+        return self._array
+
+
+class CsvChunks:
+    """A CSV upload as its header plus an iterator of chunks, each holding only whole records."""
+
+    def __init__(self, fieldnames, chunks):
+        self.fieldnames = fieldnames
+        self.chunks = chunks
+
+    def __iter__(self):
+        return iter(self.chunks)
+
+
+def _record_end(buf):
+    """Index just past the last newline in buf that ends a record (even number of quotes before it), or -1."""
+    end = buf.rfind(b"\n")
+    while end >= 0 and buf.count(b'"', 0, end) % 2:
+        end = buf.rfind(b"\n", 0, end)
+    return end + 1 if end >= 0 else -1
+
+
+def chunk_size(total_bytes, workers):
+    """Chunk size spreading total_bytes over workers, between MIN_CHUNK_BYTES and INGEST_CHUNK_BYTES."""
+    return max(MIN_CHUNK_BYTES, min(INGEST_CHUNK_BYTES, -(-total_bytes // max(1, workers))))
+
+
+def split_csv(stream, chunk_bytes=INGEST_CHUNK_BYTES, start=0):
+    """Read the header of a binary CSV stream and return CsvChunks over the rest.
+
+    Chunks end on a record boundary, so a quoted field containing a newline
+    is never split. start skips that many bytes after the header, which
+    must be a record boundary: the total size of chunks already ingested.
+    Raises UnicodeDecodeError if the header is not UTF-8.
+    """
+    buf = b""
+    while True:
+        block = stream.read(chunk_bytes)
+        buf += block
+        newline = buf.find(b"\n")
+        while newline >= 0 and buf.count(b'"', 0, newline) % 2:
+            newline = buf.find(b"\n", newline + 1)
+        if newline >= 0 or not block:
+            break
+    header_end = newline + 1 if newline >= 0 else len(buf)
+    fieldnames = next(csv.reader([buf[:header_end].decode("utf-8")]), None)
+    rest = buf[header_end:]
+    while start > len(rest):
+        start -= len(rest)
+        rest = stream.read(chunk_bytes)
+        if not rest:
+            break
+    rest = rest[start:]
+
+    def chunks(buf):
+        while True:
+            block = stream.read(chunk_bytes)
+            if block:
+                buf += block
+                if len(buf) < chunk_bytes:
+                    continue
+            end = _record_end(buf) if block else len(buf)
+            if end > 0:
+                yield buf[:end]
+                buf = buf[end:]
+            if not block:
+                if buf:
+                    yield buf
+                return
+
+    return CsvChunks(fieldnames, chunks(rest))
+
+
+def quote_literal(value):
+    """Python twin of PostgreSQL's quote_literal(), for error messages."""
+    if "\\" in value:
+        return "E'" + value.replace("\\", "\\\\").replace("'", "''") + "'"
+    return "'" + value.replace("'", "''") + "'"
+
+
+def _blank(value):
+    return value is None or value.strip(" ") == ""
+
+
+def _account_error(field, account_id, accounts):
+    if account_id in getattr(accounts, "inactive", ()):
+        return f"{field} {account_id} is inactive"
+    return f"{field} {account_id} does not exist"
+
+
+def validate_payment(row, accounts):
+    """Check one payment dict. Returns ((amount, currency, debit, credit), None) or (None, error)."""
+    amount, currency = row.get("amount"), row.get("currency")
+    debit, credit = row.get("debit_account"), row.get("credit_account")
+    if _blank(amount):
+        return None, "amount is required"
+    if not AMOUNT_RE.fullmatch(amount.strip(" ")):
+        return None, f"invalid amount {quote_literal(amount)}"
+    value = Decimal(amount.strip(" "))
+    if abs(value) >= MAX_AMOUNT or abs(value.quantize(CENT, ROUND_HALF_UP)) >= MAX_AMOUNT:
+        return None, f"amount out of range {quote_literal(amount)}"
+    if not _blank(currency) and not CURRENCY_RE.fullmatch(currency.strip(" ")):
+        return None, f"invalid currency {quote_literal(currency)}"
+    if _blank(debit):
+        return None, "debit_account is required"
+    if not ACCOUNT_ID_RE.fullmatch(debit.strip(" ")):
+        return None, f"invalid debit_account {quote_literal(debit)}"
+    if _blank(credit):
+        return None, "credit_account is required"
+    if not ACCOUNT_ID_RE.fullmatch(credit.strip(" ")):
+        return None, f"invalid credit_account {quote_literal(credit)}"
+    debit, credit = int(debit), int(credit)
+    if debit == credit:
+        return None, "debit_account and credit_account are the same"
+    if debit not in accounts:
+        return None, _account_error("debit_account", debit, accounts)
+    if credit not in accounts:
+        return None, _account_error("credit_account", credit, accounts)
+    currency = "USD" if _blank(currency) else currency.strip(" ")
+    # "+ 0" turns -0.00 into 0.00
+    return (value.quantize(CENT, ROUND_HALF_UP) + 0, currency, debit, credit), None
+
+
+def validate_payment_rows(fieldnames, data, accounts, max_errors, prefix=""):
+    """Parse and validate one chunk.
+
+    Returns (row count, COPY text of the clean rows as
+    "{prefix}row_no\\tamount\\tcurrency\\tdebit\\tcredit", rejected count,
+    [(row_no, error)] for the first max_errors rejects).
+    Rows are numbered from 1 within the chunk; blank lines are skipped, as
+    csv.DictReader does.
+    """
+    rows = [values for values in csv.reader(io.StringIO(data.decode("utf-8"), newline="")) if values]
+    if np is not None:
+        return validate_payment_columns(fieldnames, rows, accounts, max_errors, prefix)
+    out = io.StringIO()
+    errors = []
+    rejected = 0
+    for row_no, values in enumerate(rows, 1):
+        clean, error = validate_payment(dict(zip(fieldnames, values)), accounts)
+        if error is None:
+            out.write(f"{prefix}{row_no}\t{clean[0]}\t{clean[1]}\t{clean[2]}\t{clean[3]}\n")
+        else:
+            rejected += 1
+            if len(errors) < max_errors:
+                errors.append((row_no, error))
+    return len(rows), out.getvalue(), rejected, errors
+
+
+# ── Columnar validation (NumPy) ──────────────────────────────────────
+#
+# Each column becomes a fixed-width bytes array and every check is one
+# array operation over the whole chunk. Non-ASCII characters are replaced by
+# "?", which no check accepts. Rejects are classified with np.select in the
+# same order as validate_payment(), so the first failing check wins, and
+# their messages are only formatted for the rows that are reported. Values
+# longer than WIDE_VALUE characters (a valid one never is, short of
+# zero padding) are left to validate_payment().
+
+WIDE_VALUE = 32
+
+
+def _columns(fieldnames, rows, names):
+    """The named columns of rows as tuples of strings; short rows and absent columns read as ""."""
+    position = {name: i for i, name in enumerate(fieldnames)}  # duplicate names: last wins, as in DictReader
+    columns = list(itertools.zip_longest(*rows, fillvalue=""))
+    blank = ("",) * len(rows)
+    return {
+        name: columns[position[name]] if position.get(name, len(columns)) < len(columns) else blank
+        for name in names
+    }
+
+
+def _ascii_array(values):
+    """Values as a stripped bytes array, encoded in one call rather than per value."""
+    encoded = "\n".join(values).encode("ascii", "replace").split(b"\n")
+    if len(encoded) != len(values):  # a value contains a newline
+        encoded = [v.encode("ascii", "replace") for v in values]
+    return np.char.strip(np.array(encoded, dtype=bytes), b" ")
+
+
+def _is_digits(a):
+    return (np.char.str_len(a) > 0) & np.char.isdigit(a)
+
+
+def _account_column(a):
+    """(blank, invalid, ids) for an account id column."""
+    blank = np.char.str_len(a) == 0
+    invalid = ~blank & ~(_is_digits(a) & (np.char.str_len(a) <= 9))
+    ids = np.where(blank | invalid, b"0", a).astype(np.int64)
+    return blank, invalid, ids
+
+
+def _amount_column(a):
+    """(blank, invalid, out_of_range, cents) with cents rounded half away from zero, as round(numeric, 2) does."""
+    blank = np.char.str_len(a) == 0
+    negative = np.char.startswith(a, b"-")
+    body = np.where(negative | np.char.startswith(a, b"+"), np.char.lstrip(a, b"+-"), a)
+    # One sign at most: lstrip above takes all leading signs, so compare lengths.
+    signs = np.char.str_len(a) - np.char.str_len(body)
+    whole, _, frac = np.char.partition(body, b".").T if body.size else (body, body, body)
+    invalid = ~blank & ~(
+        (signs <= 1)
+        & (np.char.str_len(whole) + np.char.str_len(frac) > 0)
+        & ((np.char.str_len(whole) == 0) | _is_digits(whole))
+        & ((np.char.str_len(frac) == 0) | _is_digits(frac))
+    )
+    whole = np.char.lstrip(whole, b"0")
+    out_of_range = ~blank & ~invalid & (np.char.str_len(whole) > 13)
+    ok = ~blank & ~invalid & ~out_of_range
+    units = np.where(ok & (np.char.str_len(whole) > 0), whole, b"0").astype(np.int64)
+    # The first three fraction digits; the third decides the rounding.
+    digits = np.where(ok, np.char.ljust(frac, 3, b"0"), b"000").astype("S3")
+    digits = digits.view(np.uint8).reshape(-1, 3).astype(np.int64) - ord("0")
+    cents = units * 100 + digits[:, 0] * 10 + digits[:, 1] + (digits[:, 2] >= 5)
+    out_of_range |= ok & (cents >= 10 ** 15)
+    return blank, invalid, out_of_range, np.where(negative, -cents, cents)
+
+
+def validate_payment_columns(fieldnames, rows, accounts, max_errors, prefix=""):
+    """validate_payment_rows() for already-split rows, one array operation per check."""
+    n = len(rows)
+    raw = _columns(fieldnames, rows, ("amount", "currency", "debit_account", "credit_account"))
+    wide = np.zeros(n, dtype=bool)
+    cols = {}
+    for name, values in raw.items():
+        if n and max(map(len, values)) > WIDE_VALUE:
+            too_wide = np.fromiter(map(len, values), dtype=np.int64, count=n) > WIDE_VALUE
+            wide |= too_wide
+            values = ["" if w else v for v, w in zip(values, too_wide.tolist())]
+        cols[name] = _ascii_array(values)
+
+    amount_blank, amount_invalid, amount_range, cents = _amount_column(cols["amount"])
+    currency = cols["currency"]
+    currency_blank = np.char.str_len(currency) == 0
+    currency_invalid = ~currency_blank & ~(
+        (np.char.str_len(currency) == 3) & np.char.isalpha(currency) & np.char.isupper(currency)
+    )
+    debit_blank, debit_invalid, debit = _account_column(cols["debit_account"])
+    credit_blank, credit_invalid, credit = _account_column(cols["credit_account"])
+    known = accounts.array if isinstance(accounts, AccountIds) else np.fromiter(accounts, dtype=np.int64)
+    checks = [
+        ("amount is required", amount_blank),
+        ("invalid amount", amount_invalid),
+        ("amount out of range", amount_range),
+        ("invalid currency", currency_invalid),
+        ("debit_account is required", debit_blank),
+        ("invalid debit_account", debit_invalid),
+        ("credit_account is required", credit_blank),
+        ("invalid credit_account", credit_invalid),
+        ("debit_account and credit_account are the same", debit == credit),
+        ("debit_account does not exist", ~np.isin(debit, known)),
+        ("credit_account does not exist", ~np.isin(credit, known)),
+    ]
+    failed = np.select([mask for _, mask in checks], np.arange(1, len(checks) + 1), 0)
+    failed[wide] = -1
+
+    # Clean values are sent as written (stripped): COPY into numeric(15,2)
+    # rounds half away from zero like round(), and integers ignore leading zeros.
+    out = {
+        "amount": cols["amount"],
+        "currency": np.where(currency_blank, b"USD", currency),
+        "debit_account": cols["debit_account"],
+        "credit_account": cols["credit_account"],
+    }
+    if wide.any():
+        out = {name: a.astype(f"S{max(a.itemsize, WIDE_VALUE)}") for name, a in out.items()}
+
+    def message(i):
+        code = failed[i]
+        text = checks[code - 1][0]
+        field = {2: "amount", 3: "amount", 4: "currency", 6: "debit_account", 8: "credit_account"}.get(code)
+        if field:
+            return f"{text} {quote_literal(raw[field][i])}"
+        if code == 10:
+            return _account_error("debit_account", int(debit[i]), accounts)
+        if code == 11:
+            return _account_error("credit_account", int(credit[i]), accounts)
+        return text
+
+    wide_errors = {}
+    for i in np.flatnonzero(wide).tolist():
+        clean, error = validate_payment({name: values[i] for name, values in raw.items()}, accounts)
+        if error is None:
+            for name, value in zip(out, clean):
+                out[name][i] = str(value).encode()
+            failed[i] = 0
+        else:
+            wide_errors[i] = error
+    rejects = np.flatnonzero(failed)
+    errors = [(i + 1, wide_errors.get(i) or message(i)) for i in rejects[:max_errors].tolist()]
+    rejected = int(rejects.size)
+
+    clean = np.flatnonzero(failed == 0)
+    if not clean.size:
+        return n, "", rejected, errors
+    row_nos = ("\n" + prefix).join(map(str, (clean + 1).tolist())).encode().split(b"\n")
+    row_nos[0] = prefix.encode() + row_nos[0]
+    fields = [row_nos] + [a[clean].tolist() for a in out.values()]
+    copy_text = b"\n".join(map(b"\t".join, zip(*fields))) + b"\n"
+    return n, copy_text.decode("ascii"), rejected, errors
+
+
+# ── Worker process side ──────────────────────────────────────────────
+#
+# The pool outlives any one upload, so everything about an upload travels
+# with its chunks as a small "load" tuple: (loader table, CSV header, error
+# cap). Each worker reads the accounts once per load, on its first chunk of
+# it, and keeps the sets of the last few loads for uploads running side by
+# side.
+
+LOADER_CACHED_LOADS = 2
+
+_loader = {"conn": None, "accounts": collections.OrderedDict()}
+
+
+def init_loader(conn_kwargs):
+    """ProcessPoolExecutor initializer: remember how to connect; the connection is opened on first use and reused."""
+    # Ctrl-C reaches the whole process group; the parent decides when its upload stops.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _loader["conn_kwargs"] = conn_kwargs
+
+
+def _loader_conn():
+    if _loader["conn"] is None or _loader["conn"].closed:
+        _loader["conn"] = psycopg2.connect(**_loader["conn_kwargs"])
+    return _loader["conn"]
+
+
+def _load_accounts(table):
+    """AccountIds as of this worker's first chunk of the load into table."""
+    cache = _loader["accounts"]
+    if table not in cache:
+        conn = _loader_conn()
+        active, inactive = [], []
+        with conn.cursor() as cur:
+            cur.execute("SELECT id, status = 'active' FROM accounts")
+            for account_id, is_active in cur:
+                (active if is_active else inactive).append(account_id)
+        conn.rollback()
+        cache[table] = AccountIds(active, inactive)
+        while len(cache) > LOADER_CACHED_LOADS:
+            cache.popitem(last=False)
+    return cache[table]
+
+
+def load_payment_chunk(load, chunk_no, data):
+    """Validate one chunk and COPY its clean rows into the loader table. Returns validate_payment_rows()'s counts."""
+    table, fieldnames, max_errors = load
+    count, copy_text, rejected, errors = validate_payment_rows(
+        fieldnames, data, _load_accounts(table), max_errors, prefix=f"{chunk_no}\t",
+    )
+    conn = _loader_conn()
+    try:
+        with conn.cursor() as cur:
+            cur.copy_expert(
+                f"COPY {table} (chunk_no, row_no, amount, currency, debit_account, credit_account) FROM STDIN",
+                io.StringIO(copy_text),
+            )
+        conn.commit()
+    except Exception:
+        if not conn.closed:
+            conn.rollback()
+        raise
+    return count, rejected, errors
@@ -0,0 +1,174 @@
+import collections
+import threading
+import time
+
+import psycopg2
+from psycopg2 import extensions
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection could be checked out within the acquire timeout."""
+
+
+class ConnectionPool:
+    """Thread-safe psycopg2 connection pool.
+
+    Connections are handed out LIFO so the hottest ones stay warm, and are
+    validated on checkout: closed/broken connections and those older than
+    ``max_lifetime`` are replaced, and anything idle for longer than
+    ``check_after`` seconds gets a ``SELECT 1`` ping first. Idle connections
+    above ``minconn`` are closed after ``max_idle`` seconds.
+    """
+
+    def __init__(self, minconn, maxconn, timeout=10.0, max_lifetime=1800.0,
+                 max_idle=300.0, check_after=5.0, **conn_kwargs):
+        if minconn < 0 or maxconn < 1 or minconn > maxconn:
+            raise ValueError(f"invalid pool size min={minconn} max={maxconn}")
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.max_idle = max_idle
+        self.check_after = check_after
+        self._conn_kwargs = conn_kwargs
+        self._cond = threading.Condition()
+        self._idle = collections.deque()  # (conn, last_used), most recent on the right
+        self._born = {}                   # conn -> creation time, for every open connection
+        self._size = 0                    # open connections, idle + checked out
+        self._stats = {
+            "connects": 0,
+            "checkouts": 0,
+            "waits": 0,
+            "wait_time": 0.0,
+            "timeouts": 0,
+            "health_check_failures": 0,
+            "recycled": 0,
+        }
+        for _ in range(minconn):
+            with self._cond:
+                self._size += 1
+            conn = self._connect()
+            self._idle.append((conn, time.monotonic()))
+
+    def _connect(self):
+        try:
+            conn = psycopg2.connect(**self._conn_kwargs)
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._born[conn] = time.monotonic()
+            self._stats["connects"] += 1
+        return conn
+
+    def _discard(self, conn):
+        """Close a connection and free its slot. Caller must hold the lock."""
+        self._born.pop(conn, None)
+        self._size -= 1
+        self._cond.notify()
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _is_usable(self, conn, last_used):
+        now = time.monotonic()
+        if conn.closed:
+            return False
+        if now - self._born.get(conn, now) > self.max_lifetime:
+            with self._cond:
+                self._stats["recycled"] += 1
+            return False
+        if now - last_used > self.check_after:
+            try:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT 1")
+                conn.rollback()
+            except Exception:
+                with self._cond:
+                    self._stats["health_check_failures"] += 1
+                return False
+        return True
+
+    def _prune_idle(self):
+        """Close idle connections above minconn that have sat unused too long. Caller must hold the lock."""
+        now = time.monotonic()
+        while self._idle and self._size > self.minconn and now - self._idle[0][1] > self.max_idle:
+            conn, _ = self._idle.popleft()
+            self._discard(conn)
+
+    def getconn(self):
+        start = time.monotonic()
+        deadline = start + self.timeout
+        waited = False
+        while True:
+            entry = None
+            with self._cond:
+                self._prune_idle()
+                while True:
+                    if self._idle:
+                        entry = self._idle.pop()
+                        break
+                    if self._size < self.maxconn:
+                        self._size += 1
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats["timeouts"] += 1
+                        raise PoolTimeout(
+                            f"no connection available within {self.timeout}s (max={self.maxconn})"
+                        )
+                    waited = True
+                    self._cond.wait(remaining)
+
+            if entry is None:
+                conn = self._connect()
+                break
+            conn, last_used = entry
+            if self._is_usable(conn, last_used):
+                break
+            with self._cond:
+                self._discard(conn)
+
+        with self._cond:
+            self._stats["checkouts"] += 1
+            if waited:
+                self._stats["waits"] += 1
+                self._stats["wait_time"] += time.monotonic() - start
+        return conn
+
+    def putconn(self, conn, discard=False):
+        with self._cond:
+            if conn not in self._born:
+                raise ValueError("connection does not belong to this pool")
+        if not discard and not conn.closed:
+            try:
+                if conn.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except Exception:
+                discard = True
+        with self._cond:
+            if discard or conn.closed:
+                self._discard(conn)
+            else:
+                self._idle.append((conn, time.monotonic()))
+                self._cond.notify()
+
+    def closeall(self):
+        with self._cond:
+            while self._idle:
+                conn, _ = self._idle.pop()
+                self._discard(conn)
+
+    def stats(self):
+        with self._cond:
+            return dict(
+                self._stats,
+                size=self._size,
+                idle=len(self._idle),
+                in_use=self._size - len(self._idle),
+                minconn=self.minconn,
+                maxconn=self.maxconn,
+            )
@@ -0,0 +1,214 @@
+"""Worker processes for queued CSV uploads.
+
+    python webapp/upload_worker.py --workers 4
+
+Each worker claims one job at a time from upload_jobs (FOR UPDATE SKIP
+LOCKED, so workers never contend for the same job), streams the stored file
+back out of Postgres, and ingests it in batches of UPLOAD_BATCH_ROWS rows.
+With INGEST_WORKERS set, payment jobs are instead cut into CSV chunks, and
+each batch of UPLOAD_BATCH_CHUNKS chunks is validated and loaded by the
+ingest process pool (see db.ingest_upload_chunks). Every batch commits
+together with the job's progress, which is what the
+/api/uploads/<id> endpoint reports. Throughput scales with the number of
+workers, on this host or any other that can reach the database.
+
+Idle workers sleep on LISTEN upload_jobs and are woken when a job is
+queued. SIGTERM or Ctrl-C lets each worker finish its current batch and
+hand the job back to the queue; a worker that dies instead leaves the job
+to be picked up once its heartbeat is UPLOAD_JOB_STALE_SECONDS old, resuming
+after the last committed batch.
+"""
+import argparse
+import csv
+import io
+import itertools
+import multiprocessing
+import os
+import select
+import signal
+import socket
+import time
+
+import psycopg2
+
+from db import (
+    DB_CONFIG, INGEST_WORKERS, UPLOAD_NOTIFY_CHANNEL, UPLOAD_REQUIRED_COLUMNS,
+    claim_upload_job, finish_upload_job, ingest_upload_batch, ingest_upload_chunks, iter_upload_job_data,
+    requeue_upload_job,
+)
+from ingest import split_csv
+
+UPLOAD_BATCH_ROWS = int(os.environ.get("UPLOAD_BATCH_ROWS", "20000"))
+# Chunks (of ingest.INGEST_CHUNK_BYTES) per batch of a parallel payment job.
+UPLOAD_BATCH_CHUNKS = int(os.environ.get("UPLOAD_BATCH_CHUNKS", "0")) or 2 * max(1, INGEST_WORKERS)
+# Fallback poll interval in case a NOTIFY is missed.
+POLL_SECONDS = float(os.environ.get("UPLOAD_WORKER_POLL", "5"))
+
+
+class _ChunkReader(io.RawIOBase):
+    """Binary file over an iterator of byte chunks."""
+
+    def __init__(self, chunks):
+        self._chunks = chunks
+        self._pending = b""
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self._pending:
+            self._pending = next(self._chunks, b"")
+            if not self._pending:
+                return 0
+        n = min(len(buffer), len(self._pending))
+        buffer[:n] = self._pending[:n]
+        self._pending = self._pending[n:]
+        return n
+
+
+def _check_header(job, fieldnames):
+    missing = [c for c in UPLOAD_REQUIRED_COLUMNS[job["kind"]] if c not in (fieldnames or [])]
+    if missing:
+        raise ValueError(f"CSV is missing required column(s): {', '.join(missing)}")
+
+
+def read_job_rows(job):
+    """The job's CSV rows as dicts, skipping the ones already ingested. Raises ValueError on a bad header."""
+    stream = io.TextIOWrapper(
+        io.BufferedReader(_ChunkReader(iter_upload_job_data(job["id"]))), encoding="utf-8", newline="",
+    )
+    reader = csv.DictReader(stream)
+    _check_header(job, reader.fieldnames)
+    return itertools.islice(reader, job["rows_done"], None)
+
+
+def read_job_chunks(job):
+    """The job's CSV as ingest.CsvChunks, from bytes_done on. Raises ValueError on a bad header."""
+    chunks = split_csv(io.BufferedReader(_ChunkReader(iter_upload_job_data(job["id"]))), start=job["bytes_done"])
+    _check_header(job, chunks.fieldnames)
+    return chunks
+
+
+def job_batches(job):
+    """(iterator of batches, function ingesting one) for a claimed job.
+
+    Payment jobs go through the ingest pool when INGEST_WORKERS is set,
+    unless their progress so far was counted in rows only.
+    """
+    if job["kind"] == "payments" and INGEST_WORKERS > 0 and (job["bytes_done"] or not job["rows_done"]):
+        chunks = read_job_chunks(job)
+        batches = iter(lambda: list(itertools.islice(chunks, UPLOAD_BATCH_CHUNKS)), [])
+        return batches, lambda batch: ingest_upload_chunks(job, chunks.fieldnames, batch)
+    rows = read_job_rows(job)
+    batches = iter(lambda: list(itertools.islice(rows, UPLOAD_BATCH_ROWS)), [])
+    return batches, lambda batch: ingest_upload_batch(job, batch)
+
+
+def process_job(job, stopping, log=print):
+    """Ingest a claimed job batch by batch until it is done, lost, or the worker is stopping."""
+    log(f"[{job['worker']}] job {job['id']} ({job['kind']}) attempt {job['attempts']}, from row {job['rows_done'] + 1}")
+    try:
+        batches, ingest = job_batches(job)
+        while True:
+            batch = next(batches, None)
+            if batch is None:
+                finish_upload_job(job)
+                log(f"[{job['worker']}] job {job['id']} done")
+                return
+            if ingest(batch) is None:
+                log(f"[{job['worker']}] job {job['id']} was taken over by another worker")
+                return
+            if stopping():
+                requeue_upload_job(job)
+                log(f"[{job['worker']}] job {job['id']} handed back to the queue")
+                return
+    except (ValueError, UnicodeDecodeError, csv.Error) as e:
+        # The file itself is bad; retrying cannot help.
+        finish_upload_job(job, f"Upload failed: {e}")
+        log(f"[{job['worker']}] job {job['id']} failed: {e}")
+    except Exception as e:
+        log(f"[{job['worker']}] job {job['id']} error, requeueing: {e}")
+        requeue_upload_job(job, f"Upload interrupted: {e}")
+
+
+def _listen():
+    conn = psycopg2.connect(**DB_CONFIG)
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute(f"LISTEN {UPLOAD_NOTIFY_CHANNEL}")
+    return conn
+
+
+def _wait_for_work(conn, timeout):
+    """Block until a job is queued or the timeout passes. Returns the (possibly reconnected) LISTEN connection."""
+    try:
+        if conn is None or conn.closed:
+            conn = _listen()
+        if select.select([conn], [], [], timeout) != ([], [], []):
+            conn.poll()
+            conn.notifies.clear()
+    except Exception:
+        if conn is not None:
+            conn.close()
+        time.sleep(timeout)
+        return None
+    return conn
+
+
+def run_worker(stop, exit_when_idle=False, log=print):
+    """Claim and process jobs until stop is set (or, with exit_when_idle, the queue is empty)."""
+    name = f"{socket.gethostname()}:{os.getpid()}"
+    listen_conn = None
+    while not stop.is_set():
+        try:
+            job = claim_upload_job(name)
+            if job is not None:
+                process_job(job, stop.is_set, log)
+                continue
+        except Exception as e:
+            # Database unreachable; a claimed job is recovered once its heartbeat goes stale.
+            log(f"[{name}] {e}")
+            time.sleep(POLL_SECONDS)
+            continue
+        if exit_when_idle:
+            break
+        listen_conn = _wait_for_work(listen_conn, POLL_SECONDS)
+    if listen_conn is not None:
+        listen_conn.close()
+
+
+def _worker_main(stop, exit_when_idle):
+    # The parent turns Ctrl-C and SIGTERM into stop, so the current batch can finish.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    run_worker(stop, exit_when_idle, log=lambda msg: print(msg, flush=True))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Process queued CSV uploads.")
+    parser.add_argument(
+        "--workers", type=int, default=int(os.environ.get("UPLOAD_WORKERS", min(multiprocessing.cpu_count(), 4))),
+        help="worker processes to run (default: UPLOAD_WORKERS or min(cpus, 4))",
+    )
+    parser.add_argument("--exit-when-idle", action="store_true", help="exit once the queue is empty")
+    args = parser.parse_args()
+
+    stop = multiprocessing.Event()
+    processes = [
+        multiprocessing.Process(target=_worker_main, args=(stop, args.exit_when_idle), name=f"upload-worker-{i}")
+        for i in range(max(1, args.workers))
+    ]
+    for p in processes:
+        p.start()
+    print(f"Started {len(processes)} upload worker(s)", flush=True)
+
+    def shutdown(*_):
+        stop.set()
+    signal.signal(signal.SIGINT, shutdown)
+    signal.signal(signal.SIGTERM, shutdown)
+    for p in processes:
+        p.join()
+
+
+if __name__ == "__main__":
+    main()